@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from cookie_jars import cookie_identity
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+
+# Admission control for the expensive work behind the routes. Each budget (metadata extractions, download
+# jobs, transcodes) has its own concurrency limit and a bounded queue served round-robin per client, so one
+# client sending many requests waits behind its own work instead of everyone else's. When the queue is
+# full the caller is turned away right away (Rejected, answered with 429/503 and Retry-After) rather than
+# left to time out.
+
+# Client the current request is served for. Request threads set it in before_request; work handed to other
+# threads carries it along through with_client(). None is the server itself (warm-ups, background work),
+# which no budget applies to.
+_context = threading.local()
+
+
+def current_client():
+    return getattr(_context, 'client', None)
+
+
+def set_client(client):
+    _context.client = client
+
+
+def with_client(client, fn):
+    def wrapper(*args, **kwargs):
+        previous = getattr(_context, 'client', None)
+        _context.client = client
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _context.client = previous
+    return wrapper
+
+
+# Who a request counts against: its address, or with key='cookies' the cookies it sends (several users
+# behind one NAT then get a share each; requests without cookies fall back to the address).
+# proxy_hops is the number of reverse proxies in front of the app; the client address is taken that many
+# entries from the end of X-Forwarded-For, so clients cannot pick their identity by sending the header.
+def client_identity(remote_addr, forwarded_for=None, proxy_hops=0, cookies_str=None, key='ip'):
+    if key == 'cookies' and cookies_str:
+        return f"cookies:{cookie_identity(cookies_str)}"
+    if proxy_hops and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if hops:
+            return hops[-min(proxy_hops, len(hops))]
+    return remote_addr or 'unknown'
+
+
+# Raised when a budget turns a request away. status is 429 when the client is over its own share, 503 when
+# the server as a whole is saturated; retry_after is the suggested wait in seconds. client is who was
+# turned away.
+class Rejected(Exception):
+    def __init__(self, message, status=503, retry_after=10, client=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.client = client
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+# A concurrency budget with per-client fair queueing. At most max_running holders at once and at most
+# max_per_client of them for one client; callers beyond that wait in their client's queue, and a freed slot
+# goes to the next client in round-robin order that is under its own limit. A client may have at most
+# max_queued_per_client waiting (429 beyond that), the whole queue at most max_queued (503), and nobody
+# waits longer than queue_timeout seconds (503). A limit of 0 disables it.
+class FairLimiter:
+    def __init__(self, name, max_running, max_queued=64, max_per_client=0, max_queued_per_client=0, queue_timeout=30, retry_after=5):
+        self.name = name
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._running = {}  # client -> slots held
+        self._queues = OrderedDict()  # client -> deque of _Waiter, in round-robin order
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {}
+        self._waits = deque(maxlen=200)
+
+    def _under_client_limit(self, client):
+        return not self.max_per_client or self._running.get(client, 0) < self.max_per_client
+
+    def _grant(self, client):
+        self.running += 1
+        self._running[client] = self._running.get(client, 0) + 1
+
+    # Hand free slots to waiting clients, one per client per round
+    def _dispatch(self):
+        while self.running < self.max_running:
+            client = next((c for c in self._queues if self._under_client_limit(c)), None)
+            if client is None:
+                return
+            queue = self._queues[client]
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self.queued -= 1
+            self._grant(client)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _reject(self, reason, message, status, client):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED.inc(budget=self.name, reason=reason)
+        return Rejected(message, status, self.retry_after, client)
+
+    def _record_wait(self, seconds):
+        self.admitted += 1
+        self._waits.append(seconds)
+        ADMISSION_WAIT.observe(seconds, budget=self.name)
+
+    def acquire(self, client):
+        started = time.monotonic()
+        with self._lock:
+            if self.running < self.max_running and self._under_client_limit(client):
+                self._grant(client)
+                self._record_wait(0.0)
+                return
+            queue = self._queues.get(client)
+            if self.max_queued_per_client and queue is not None and len(queue) >= self.max_queued_per_client:
+                raise self._reject('client_limit', "You have too many requests in progress. Please wait for them to finish.", 429, client)
+            if self.queued >= self.max_queued:
+                raise self._reject('queue_full', "The server is busy. Please try again shortly.", 503, client)
+            waiter = _Waiter()
+            if queue is None:
+                queue = self._queues[client] = deque()
+            queue.append(waiter)
+            self.queued += 1
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if not waiter.granted:
+                queue = self._queues.get(client)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self.queued -= 1
+                    if not queue:
+                        del self._queues[client]
+                raise self._reject('timeout', "The server is busy. Please try again shortly.", 503, client)
+            self._record_wait(time.monotonic() - started)
+
+    def release(self, client):
+        with self._lock:
+            self.running -= 1
+            held = self._running.get(client, 0) - 1
+            if held > 0:
+                self._running[client] = held
+            else:
+                self._running.pop(client, None)
+            self._dispatch()
+
+    # Non-blocking slot for long-lived work such as pass-through streams, which should not wait in line: raises
+    # Rejected right away when the client is over its share or every slot is taken. Returns a release callable
+    # that is safe to call more than once; client None is not limited.
+    def try_slot(self, client):
+        if client is None:
+            return lambda: None
+        with self._lock:
+            if not self._under_client_limit(client):
+                raise self._reject('client_limit', "You have too many requests in progress. Please wait for them to finish.", 429, client)
+            if self.running >= self.max_running:
+                raise self._reject('queue_full', "The server is busy. Please try again shortly.", 503, client)
+            self._grant(client)
+            self._record_wait(0.0)
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.release(client)
+        return release
+
+    # Hold a slot for the with-block; client None (the server's own work) is not limited
+    @contextmanager
+    def slot(self, client):
+        if client is None:
+            yield
+            return
+        self.acquire(client)
+        try:
+            yield
+        finally:
+            self.release(client)
+
+    def stats(self):
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                'max_running': self.max_running,
+                'max_queued': self.max_queued,
+                'max_per_client': self.max_per_client,
+                'max_queued_per_client': self.max_queued_per_client,
+                'running': self.running,
+                'queued': self.queued,
+                'clients': len(set(self._running) | set(self._queues)),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'avg_wait_seconds': round(sum(waits) / len(waits), 3) if waits else None,
+                'max_wait_seconds': round(max(waits), 3) if waits else None,
+            }
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+import metrics
+from admission import Rejected, client_identity, with_client
+from metrics import REQUEST_SECONDS
+from app import (
+    app as flask_app,
+    logger,
+    get_info_result,
+    parse_batch_request,
+    batch_lookup_item,
+    expand_playlist,
+)
+
+# asyncio serving mode. /get_info and /get_info_batch are handled on the event loop: a request waiting for a
+# lookup is a coroutine, not a worker, and the blocking yt-dlp extraction runs on a bounded thread pool.
+# Everything else is passed to the Flask app unchanged, on a thread pool of its own. Run with:
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+# (start.sh does this when SERVER_MODE=async)
+
+MAX_LOOKUPS = flask_app.config['ASYNC_MAX_LOOKUPS']
+MAX_PENDING = flask_app.config['ASYNC_MAX_PENDING']
+
+lookup_executor = ThreadPoolExecutor(max_workers=MAX_LOOKUPS, thread_name_prefix='async-lookup')
+wsgi_executor = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_WSGI_THREADS'], thread_name_prefix='async-wsgi')
+
+
+# Raised when more lookups are waiting than ASYNC_MAX_PENDING allows
+class Overloaded(Exception):
+    pass
+
+
+class LookupLimiter:
+    def __init__(self, max_running, max_pending):
+        self.max_running = max_running
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+        self._semaphore = None  # created on the serving loop
+
+    # Run fn(*args) on the lookup pool once a slot is free. A request that goes away while it is still
+    # waiting never occupies a thread; one that goes away mid-extraction lets the thread finish.
+    async def run(self, fn, *args, timeout=None):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_running)
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                self.running += 1
+                try:
+                    future = asyncio.get_running_loop().run_in_executor(lookup_executor, fn, *args)
+                    return await asyncio.wait_for(future, timeout)
+                finally:
+                    self.running -= 1
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending': self.pending,
+            'max_running': self.max_running,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected,
+        }
+
+
+limiter = LookupLimiter(MAX_LOOKUPS, MAX_PENDING)
+
+
+async def read_json(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(body or b'{}')
+    except ValueError:
+        return {}
+
+
+async def send_json(send, body, status=200, headers=()):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_overloaded(send):
+    await send_json(send, {'error': 'The server is busy. Please try again shortly.'}, 503, [(b'retry-after', b'5')])
+
+
+async def send_rejected(send, e):
+    await send_json(send, {'error': str(e)}, e.status, [(b'retry-after', str(e.retry_after).encode())])
+
+
+# Same identity the Flask app gives a request (see identify_client in app.py)
+def request_client(scope, data):
+    headers = dict(scope.get('headers') or [])
+    forwarded_for = headers.get(b'x-forwarded-for')
+    return client_identity(
+        (scope.get('client') or (None,))[0],
+        forwarded_for.decode('latin-1') if forwarded_for else None,
+        flask_app.config['ADMISSION_PROXY_HOPS'],
+        data.get('cookies') if isinstance(data.get('cookies'), str) else None,
+        flask_app.config['ADMISSION_CLIENT_KEY'],
+    )
+
+
+# Run handler until it finishes or the client disconnects, whichever comes first
+async def until_disconnect(receive, handler):
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    handler_task = asyncio.ensure_future(handler)
+    watcher = asyncio.ensure_future(disconnected())
+    done, _ = await asyncio.wait({handler_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    for task in (handler_task, watcher):
+        if task not in done:
+            task.cancel()
+    if handler_task in done:
+        handler_task.result()
+
+
+async def get_info(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return
+    client = request_client(scope, data)
+
+    async def handle():
+        try:
+            body, status = await limiter.run(with_client(client, metrics.with_route('/get_info', get_info_result)), data.get('url'), data.get('cookies'))
+        except Overloaded:
+            await send_overloaded(send)
+            return
+        except Rejected as e:
+            await send_rejected(send, e)
+            return
+        await send_json(send, body, status)
+
+    await until_disconnect(receive, handle())
+
+
+async def get_info_batch(scope, receive, send):
+    data = await read_json(receive)
+    if data is None:
+        return
+    cookies_str, urls, playlist_url, error = parse_batch_request(data)
+    if error:
+        await send_json(send, error, 400)
+        return
+    client = request_client(scope, data)
+
+    async def handle():
+        nonlocal urls
+        if not urls:
+            try:
+                urls, playlist_error = await limiter.run(with_client(client, metrics.with_route('/get_info_batch', expand_playlist)), playlist_url, cookies_str, flask_app.config['BATCH_MAX_ITEMS'])
+            except Overloaded:
+                await send_overloaded(send)
+                return
+            except Rejected as e:
+                await send_rejected(send, e)
+                return
+            if urls is None:
+                await send_json(send, {'error': f'Could not retrieve playlist: {playlist_error}'}, 500)
+                return
+
+        item_timeout = flask_app.config['BATCH_ITEM_TIMEOUT']
+        # A batch runs at most the client's metadata share at once, so its own items never overflow the
+        # client's queue and get rejected
+        share = asyncio.Semaphore(flask_app.config['METADATA_MAX_PER_CLIENT'] or MAX_LOOKUPS)
+        batch_lookup = with_client(client, metrics.with_route('/get_info_batch', batch_lookup_item))
+
+        async def lookup(index, item_url):
+            try:
+                async with share:
+                    return await limiter.run(batch_lookup, index, item_url, cookies_str, timeout=item_timeout)
+            except asyncio.TimeoutError:
+                return {'index': index, 'url': item_url, 'error': f'Timed out after {item_timeout} seconds'}
+            except Overloaded:
+                return {'index': index, 'url': item_url, 'error': 'The server is busy. Please try again shortly.'}
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+        tasks = [asyncio.ensure_future(lookup(i, u)) for i, u in enumerate(urls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                await send({'type': 'http.response.body', 'body': (json.dumps(item) + '\n').encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    await until_disconnect(receive, handle())
+
+
+def wsgi_environ(scope, body):
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers') or []:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if name in environ:
+            value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+        environ[name] = value
+    return environ
+
+
+# Runs on a wsgi_executor thread. send_message() hands one ASGI message to the event loop and waits until it
+# is sent, so a slow client holds back the thread writing its body, not the loop. When the response has a
+# Content-Length, the chunk that completes it is sent as the last message: a client that has all the bytes
+# may send its next request on the connection right away, and the response must be complete by then. The
+# response iterable is closed either way (Flask's teardown, the request metrics and streamed bodies rely on
+# it), and iteration stops once the client has gone away.
+def run_wsgi(scope, body, send_message, disconnected):
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response_start.get('sent'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response_start.update(status=int(status.split(' ', 1)[0]),
+                              headers=[(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers])
+        length = next((value for name, value in headers if name.lower() == 'content-length'), None)
+        response_start['remaining'] = int(length) if length is not None and scope['method'] != 'HEAD' else None
+
+    def send_start():
+        if not response_start.get('sent'):
+            response_start['sent'] = True
+            send_message({'type': 'http.response.start', 'status': response_start['status'], 'headers': response_start['headers']})
+
+    result = flask_app.wsgi_app(wsgi_environ(scope, body), start_response)
+    try:
+        for chunk in result:
+            if disconnected.is_set():
+                return
+            if not chunk:
+                continue
+            send_start()
+            remaining = response_start['remaining']
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                response_start['remaining'] = remaining = remaining - len(chunk)
+            send_message({'type': 'http.response.body', 'body': chunk, 'more_body': remaining != 0})
+            if remaining == 0:
+                return
+        send_start()
+        send_message({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+# Fallthrough to the Flask app for every route without a native handler. The WSGI app runs on its own
+# thread pool (ASYNC_WSGI_THREADS), so a long /download_file body occupies one of those threads and
+# nothing else.
+async def wsgi_application(scope, receive, send):
+    with SpooledTemporaryFile(max_size=65536) as body:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await loop.run_in_executor(wsgi_executor, run_wsgi, scope, body, send_message, disconnected)
+        finally:
+            watcher.cancel()
+
+
+async def async_stats(scope, receive, send):
+    await send_json(send, {'lookups': limiter.stats()})
+
+
+ROUTES = {
+    ('POST', '/get_info'): get_info,
+    ('POST', '/get_info_batch'): get_info_batch,
+    ('GET', '/async_stats'): async_stats,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            lookup_executor.shutdown(wait=False)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    route = ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if route is None:
+        await wsgi_application(scope, receive, send)
+        return
+    started = time.monotonic()
+    status = [500]
+
+    async def send_with_status(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+        await send(message)
+
+    try:
+        await route(scope, receive, send_with_status)
+    except Exception as e:
+        logger.error("Unhandled error in async handler for %s: %s", scope.get('path'), str(e), exc_info=True)
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.monotonic() - started, route=scope['path'], method=scope['method'], status=status[0])
@@ -0,0 +1,281 @@
+import hashlib
+import http.client
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Local stand-ins for the video site and the proxies, so benchmarks never touch YouTube or real proxies.
+#
+# FakeUpstream serves, for any video ID:
+#   /watch/<id>                 HTML page that yt-dlp's generic extractor understands: OpenGraph title and
+#                               thumbnail, and an HTML5 <video> with one progressive mp4 source per height
+#   /media/<id>/<height>.mp4    deterministic media bytes (Range and HEAD supported, optional bandwidth cap)
+#   /thumb/<id>.jpg             small JPEG with an ETag, answering 304 to If-None-Match
+# FakeProxy is a plain-HTTP forward proxy with configurable latency, jitter and failure rate.
+
+HEIGHTS = (360, 720)
+# Declared codecs make the sources progressive (video and audio) formats in yt-dlp's eyes
+SOURCE_TYPE = 'video/mp4; codecs="avc1.64001F, mp4a.40.2"'
+
+# Smallest JFIF-ish payload image decoders accept as a JPEG; padded so the cache has something to store
+THUMBNAIL = bytes.fromhex('ffd8ffe000104a46494600010100000100010000ffd9') + b'\0' * 4096
+
+
+def _media_chunk(video_id, height, size=64 * 1024):
+    seed = hashlib.sha256(f'{video_id}:{height}'.encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+def _parse_range(header, length):
+    match = re.match(r'bytes=(\d*)-(\d*)$', header or '')
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else length - 1
+    else:
+        start, end = max(0, length - int(match.group(2))), length - 1
+    if start >= length:
+        return None
+    return start, min(end, length - 1)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _Service:
+    handler = None
+
+    def __init__(self, host='127.0.0.1', port=0):
+        handler = type('Handler', (self.handler,), {'service': self})
+        self.server = _Server((host, port), handler)
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UpstreamHandler(_QuietHandler):
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        service = self.service
+        service.count('requests')
+        if service.latency:
+            time.sleep(service.latency)
+        path = urlsplit(self.path).path
+        match = re.match(r'^/watch/([\w-]+)$', path)
+        if match:
+            return self._send(200, 'text/html; charset=utf-8', service.watch_page(match.group(1)).encode(), head)
+        match = re.match(r'^/media/([\w-]+)/(\d+)\.mp4$', path)
+        if match:
+            return self._media(match.group(1), int(match.group(2)), head)
+        match = re.match(r'^/thumb/([\w-]+)\.jpg$', path)
+        if match:
+            etag = f'"{hashlib.sha1(match.group(1).encode()).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, None, b'', True, {'ETag': etag})
+            return self._send(200, 'image/jpeg', THUMBNAIL, head, {'ETag': etag})
+        self._send(404, 'text/plain', b'not found', head)
+
+    def _send(self, status, content_type, body, head=False, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head and body:
+            self.wfile.write(body)
+
+    def _media(self, video_id, height, head):
+        service = self.service
+        length = service.media_size(height)
+        byte_range = _parse_range(self.headers.get('Range'), length) if self.headers.get('Range') else None
+        start, end = byte_range if byte_range else (0, length - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{length}')
+        self.end_headers()
+        if head:
+            return
+        chunk = _media_chunk(video_id, height)
+        position = start
+        started = time.monotonic()
+        try:
+            while position <= end:
+                offset = position % len(chunk)
+                piece = chunk[offset:offset + min(len(chunk) - offset, end - position + 1)]
+                self.wfile.write(piece)
+                position += len(piece)
+                service.count('media_bytes', len(piece))
+                if service.bandwidth:
+                    ahead = (position - start) / service.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeUpstream(_Service):
+    handler = _UpstreamHandler
+
+    # media_bytes: size of the 720p file (360p is a quarter of it); bandwidth: bytes/second per response (0 = unlimited)
+    def __init__(self, host='127.0.0.1', port=0, media_bytes=2 * 1024 * 1024, bandwidth=0, latency=0.0):
+        super().__init__(host, port)
+        self.media_bytes = media_bytes
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'media_bytes': 0}
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def media_size(self, height):
+        return max(1, self.media_bytes * height * height // (max(HEIGHTS) ** 2))
+
+    def watch_url(self, video_id):
+        return f'{self.address}/watch/{video_id}'
+
+    def watch_page(self, video_id):
+        thumbnail = f'{self.address}/thumb/{video_id}.jpg'
+        sources = '\n'.join(
+            f"<source src=\"/media/{video_id}/{h}.mp4\" type='{SOURCE_TYPE}' res=\"{h}\" label=\"{h}p\">" for h in HEIGHTS)
+        return f'''<!DOCTYPE html>
+<html><head>
+<title>Benchmark video {video_id}</title>
+<meta property="og:title" content="Benchmark video {video_id}">
+<meta property="og:image" content="{thumbnail}">
+</head><body>
+<video controls poster="{thumbnail}">
+{sources}
+</video>
+</body></html>'''
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class _ProxyHandler(_QuietHandler):
+    def do_HEAD(self):
+        self._forward()
+
+    def do_GET(self):
+        self._forward()
+
+    def do_CONNECT(self):
+        # Only plain-HTTP targets are proxied; the fake upstream never needs TLS
+        self.send_error(501)
+
+    def _forward(self):
+        service = self.service
+        delay = service.delay()
+        if delay:
+            time.sleep(delay)
+        failure = service.roll_failure()
+        if failure == 'reset':
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        if failure == 'error':
+            body = b'proxy error'
+            self.send_response(502)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        target = urlsplit(self.path)
+        if not target.hostname:
+            self.send_error(400, 'absolute URL required')
+            return
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in ('proxy-connection', 'proxy-authorization', 'connection')}
+        upstream = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        try:
+            upstream.request(self.command, target.path + (f'?{target.query}' if target.query else ''), headers=headers)
+            response = upstream.getresponse()
+            self.send_response(response.status, response.reason)
+            for name, value in response.getheaders():
+                if name.lower() not in ('connection', 'transfer-encoding', 'keep-alive'):
+                    self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                while True:
+                    piece = response.read(64 * 1024)
+                    if not piece:
+                        break
+                    self.wfile.write(piece)
+        except (OSError, http.client.HTTPException):
+            self.close_connection = True
+        finally:
+            upstream.close()
+        service.count('forwarded')
+
+
+class FakeProxy(_Service):
+    handler = _ProxyHandler
+
+    # latency (+ uniform jitter) is added before every request; failure_rate of them fail, half as a 502 and
+    # half as a dropped connection
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, jitter=0.0, failure_rate=0.0, seed=None):
+        super().__init__(host, port)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'forwarded': 0, 'failed': 0}
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def delay(self):
+        with self._lock:
+            self.counters['requests'] += 1
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def roll_failure(self):
+        with self._lock:
+            if self._random.random() >= self.failure_rate:
+                return None
+            self.counters['failed'] += 1
+            return 'reset' if self._random.random() < 0.5 else 'error'
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, latency=self.latency, failure_rate=self.failure_rate)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""Load test against a local stand-in for YouTube and the proxies.
+
+Starts a fake upstream and fake proxies (bench/fake_upstream.py), starts the app under gunicorn in a scratch
+directory with PROXIES pointing at the fake proxies, drives /get_info, /download, /get_thumbnail and
+/get_video_info at the requested concurrency, and reports latency percentiles, throughput, the server's
+RSS and the disk used by downloads and thumbnails. Startup is measured too: seconds until the server answers,
+until it reports ready (yt-dlp warm-up done), and until a killed worker is replaced by a ready one. Results
+are written to bench/results/ as JSON; pass --compare with an earlier result file to see the difference.
+
+    python bench/run.py --label baseline
+    python bench/run.py --label pooled --compare bench/results/<earlier>.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from fake_upstream import FakeProxy, FakeUpstream
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SCENARIOS = ('get_info', 'download', 'get_thumbnail', 'get_video_info')
+COOKIES = '# Netscape HTTP Cookie File\n.example.com\tTRUE\t/\tFALSE\t0\tbench\t1\n'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+# Resident memory of a process and all of its descendants (gunicorn master plus workers), from /proc.
+# Returns (rss, pss): RSS counts pages shared between the processes (e.g. copy-on-write after a preloading
+# fork) once per process, PSS splits them between the processes sharing them.
+def tree_rss(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    rss, pss, stack = 0, 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                pss += next(int(line.split()[1]) * 1024 for line in f if line.startswith('Pss:'))
+        except (OSError, IndexError, ValueError, StopIteration):
+            pass
+        stack.extend(children.get(current, ()))
+    return rss, pss
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.last = 0
+        self.pss_peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.last, pss = tree_rss(self.pid)
+            self.peak = max(self.peak, self.last)
+            self.pss_peak = max(self.pss_peak, pss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Server:
+    def __init__(self, args, proxies, workdir):
+        self.args = args
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.workdir = workdir
+        env = dict(os.environ)
+        env.update({
+            'PROXIES': ','.join(proxies),
+            'LOG_LEVEL': args.log_level,
+            'PYTHONUNBUFFERED': '1',
+            # Every driver thread is a separate client (X-Forwarded-For), as with real traffic
+            'ADMISSION_PROXY_HOPS': '1',
+            'PRELOAD_APP': '1' if args.preload else '0',
+        })
+        for item in args.env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        module = 'asgi:application' if args.server == 'async' else 'app:app'
+        cmd = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+               '--bind', f'127.0.0.1:{self.port}', '--pythonpath', REPO_DIR,
+               '--workers', str(args.workers), '--threads', str(args.threads), '--timeout', '300']
+        if args.server == 'async':
+            cmd += ['-k', 'uvicorn.workers.UvicornWorker']
+        cmd.append(module)
+        self.log = open(os.path.join(workdir, 'server.log'), 'wb')
+        started = time.monotonic()
+        self.process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.boot_seconds = None
+        self.ready_seconds, self.worker_pid = self._wait_ready(started)
+        self.respawn_seconds = None
+
+    # Poll /ready until it answers 200 (any answer but 503 from builds without the endpoint). Records when
+    # the server first answered at all and returns (seconds until ready, pid of the worker that answered).
+    def _wait_ready(self, started, timeout=120, old_pid=None):
+        while time.monotonic() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'server exited with {self.process.returncode}; see {self.log.name}')
+            try:
+                response = requests.get(self.base_url + '/ready', timeout=2)
+            except requests.RequestException:
+                response = None
+            if response is not None:
+                if self.boot_seconds is None:
+                    self.boot_seconds = round(time.monotonic() - started, 3)
+                pid = response.json().get('pid') if response.status_code == 200 else None
+                if response.status_code != 503 and (old_pid is None or pid != old_pid):
+                    return round(time.monotonic() - started, 3), pid
+            time.sleep(0.05)
+        raise RuntimeError(f'server was not ready within {timeout}s; see {self.log.name}')
+
+    # Kill the (single) worker and time until its replacement is ready, as after a crash or a recycle
+    def measure_respawn(self):
+        if self.args.workers != 1 or not self.worker_pid:
+            return None
+        started = time.monotonic()
+        os.kill(self.worker_pid, signal.SIGKILL)
+        self.respawn_seconds, self.worker_pid = self._wait_ready(started, old_pid=self.worker_pid)
+        return self.respawn_seconds
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+class Driver:
+    def __init__(self, base_url, upstream, args):
+        self.base_url = base_url
+        self.upstream = upstream
+        self.args = args
+        self._local = threading.local()
+        self._client_ids = itertools.count()
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            client = next(self._client_ids)
+            self._local.session = requests.Session()
+            self._local.session.headers['X-Forwarded-For'] = f'10.0.{client // 250}.{client % 250 + 1}'
+        return self._local.session
+
+    def video_url(self, i):
+        return self.upstream.watch_url(f'bench{i % self.args.videos:05d}')
+
+    # Each operation returns the number of response bytes received; failures raise
+    def get_info(self, url):
+        response = self.session().post(self.base_url + '/get_info', json={'url': url, 'cookies': COOKIES}, timeout=300)
+        response.raise_for_status()
+        return len(response.content)
+
+    def get_thumbnail(self, url):
+        response = self.session().post(self.base_url + '/get_thumbnail', json={'url': url, 'cookies': COOKIES}, timeout=300)
+        response.raise_for_status()
+        return len(response.content)
+
+    def get_video_info(self, url):
+        response = self.session().post(self.base_url + '/get_video_info', json={'url': url, 'cookies': COOKIES}, timeout=300)
+        response.raise_for_status()
+        return len(response.content)
+
+    # Queue the download, poll the job until it finishes, then fetch the file
+    def download(self, url):
+        session = self.session()
+        body = {'url': url, 'cookies': COOKIES, 'type': 'video', 'quality': self.args.quality}
+        if self.args.connections:
+            body['connections'] = self.args.connections
+        response = session.post(self.base_url + '/download', json=body, timeout=300)
+        response.raise_for_status()
+        job = response.json()
+        deadline = time.monotonic() + 600
+        while job.get('status') not in ('finished', 'error', 'cancelled'):
+            if time.monotonic() > deadline:
+                raise RuntimeError('download did not finish in time')
+            time.sleep(self.args.poll_interval)
+            job = session.get(f"{self.base_url}/download_status/{job['job_id']}", timeout=30).json()
+        if job['status'] != 'finished':
+            raise RuntimeError(job.get('error') or job['status'])
+        received = 0
+        with session.get(f"{self.base_url}/download_file/{job['filename']}", stream=True, timeout=300) as file_response:
+            file_response.raise_for_status()
+            for chunk in file_response.iter_content(256 * 1024):
+                received += len(chunk)
+        return received
+
+    def run(self, scenario, count, concurrency):
+        operation = getattr(self, scenario)
+        latencies, errors, received = [], {}, [0]
+        lock = threading.Lock()
+
+        def one(i):
+            started = time.monotonic()
+            try:
+                size = operation(self.video_url(i))
+            except Exception as e:
+                key = f'{type(e).__name__}: {str(e)[:120]}'
+                with lock:
+                    errors[key] = errors.get(key, 0) + 1
+                return
+            elapsed = time.monotonic() - started
+            with lock:
+                latencies.append(elapsed)
+                received[0] += size
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, range(count)))
+        wall = time.monotonic() - started
+        latencies.sort()
+        return {
+            'requests': count,
+            'concurrency': concurrency,
+            'ok': len(latencies),
+            'errors': sum(errors.values()),
+            'error_kinds': errors,
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+            'bytes_per_second': round(received[0] / wall) if wall else None,
+            'latency_seconds': {
+                'mean': round(sum(latencies) / len(latencies), 4) if latencies else None,
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+
+
+def print_report(result):
+    print(f"\n{result['label']}  ({result['started_at']}, commit {result.get('commit') or '?'})")
+    print(f"{'scenario':<16}{'ok':>6}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'MB/s':>9}")
+    for name, s in result['scenarios'].items():
+        lat = s['latency_seconds']
+        fmt = lambda v: f'{v:9.3f}' if v is not None else f"{'-':>9}"
+        print(f"{name:<16}{s['ok']:>6}{s['errors']:>6}{fmt(lat['p50'])}{fmt(lat['p95'])}{fmt(lat['p99'])}"
+              f"{fmt(s['throughput_rps'])}{fmt((s['bytes_per_second'] or 0) / 1e6)}")
+        for kind, n in s['error_kinds'].items():
+            print(f'    {n} x {kind}')
+    server = result['server']
+    print(f"server: boot {server['boot_seconds']}s, ready {server.get('ready_seconds')}s, worker respawn {server.get('respawn_seconds')}s, RSS peak {server['rss_peak_bytes'] / 2**20:.1f}MB, "
+          f"end {server['rss_end_bytes'] / 2**20:.1f}MB, PSS peak {server.get('pss_peak_bytes', 0) / 2**20:.1f}MB; disk {result['disk']['total_bytes'] / 2**20:.1f}MB")
+
+
+def print_comparison(previous, current):
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return '      -'
+        return f'{(new - old) / old * 100:+6.1f}%'
+
+    print(f"\nchange vs {previous['label']} ({previous['started_at']}):")
+    print(f"{'scenario':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for name, s in current['scenarios'].items():
+        old = previous['scenarios'].get(name)
+        if not old:
+            continue
+        print(f"{name:<16}" + ''.join(f"{change(old['latency_seconds'][q], s['latency_seconds'][q]):>9}" for q in ('p50', 'p95', 'p99'))
+              + f"{change(old['throughput_rps'], s['throughput_rps']):>9}")
+    for key, label in (('ready_seconds', 'ready'), ('respawn_seconds', 'respawn')):
+        print(f"{label:<16}{change(previous['server'].get(key), current['server'].get(key)):>9}")
+    print(f"{'RSS peak':<16}{change(previous['server']['rss_peak_bytes'], current['server']['rss_peak_bytes']):>9}")
+    print(f"{'PSS peak':<16}{change(previous['server'].get('pss_peak_bytes'), current['server'].get('pss_peak_bytes')):>9}")
+    print(f"{'disk':<16}{change(previous['disk']['total_bytes'], current['disk']['total_bytes']):>9}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--label', default='run', help='name stored with the results')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'comma-separated subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario (downloads: a tenth of this)')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--videos', type=int, default=50, help='distinct video IDs; fewer means more cache hits')
+    parser.add_argument('--quality', default='720p', help='quality requested by the download scenario')
+    parser.add_argument('--connections', type=int, default=0, help='connections per download (0 = server default)')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='seconds between /download_status polls')
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync', help='gunicorn sync workers (app:app) or SERVER_MODE=async (asgi:application)')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn threads per worker (sync mode)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false', help='load the app in every worker instead of once in the master')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra environment for the server (repeatable)')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL for the server')
+    parser.add_argument('--proxies', type=int, default=4, help='fake proxies to start (0 = direct connections only)')
+    parser.add_argument('--proxy-latency', type=float, default=0.05, help='seconds added by each proxy per request')
+    parser.add_argument('--proxy-jitter', type=float, default=0.05, help='extra random latency, uniform in [0, jitter]')
+    parser.add_argument('--proxy-failure-rate', type=float, default=0.1, help='fraction of proxied requests that fail')
+    parser.add_argument('--media-bytes', type=int, default=4 * 1024 * 1024, help='size of the 720p media file')
+    parser.add_argument('--bandwidth', type=int, default=0, help='upstream bytes/second per response (0 = unlimited)')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='seconds the upstream waits before answering')
+    parser.add_argument('--seed', type=int, default=1, help='seed for proxy failures')
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help='directory for result files')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--keep-workdir', action='store_true', help='keep the server scratch directory (downloads, logs)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    upstream = FakeUpstream(media_bytes=args.media_bytes, bandwidth=args.bandwidth, latency=args.upstream_latency).start()
+    proxies = [FakeProxy(latency=args.proxy_latency, jitter=args.proxy_jitter, failure_rate=args.proxy_failure_rate,
+                         seed=args.seed + i).start() for i in range(args.proxies)]
+    workdir = tempfile.mkdtemp(prefix='freeytzone-bench-')
+    server = Server(args, [p.address for p in proxies], workdir)
+    sampler = RssSampler(server.process.pid)
+    sampler.start()
+    try:
+        server.measure_respawn()
+        driver = Driver(server.base_url, upstream, args)
+        results = {}
+        for scenario in scenarios:
+            count = max(1, args.requests // 10) if scenario == 'download' else args.requests
+            print(f'{scenario}: {count} requests at concurrency {args.concurrency}...', flush=True)
+            results[scenario] = driver.run(scenario, count, args.concurrency)
+        try:
+            proxy_stats = requests.get(server.base_url + '/proxy_stats', timeout=10).json()
+        except (requests.RequestException, ValueError):
+            proxy_stats = None
+    finally:
+        sampler.stop()
+        server.stop()
+        upstream.stop()
+        for proxy in proxies:
+            proxy.stop()
+
+    result = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'config': vars(args),
+        'scenarios': results,
+        'server': {'boot_seconds': server.boot_seconds, 'ready_seconds': server.ready_seconds, 'respawn_seconds': server.respawn_seconds,
+                   'pss_peak_bytes': sampler.pss_peak, 'rss_peak_bytes': sampler.peak, 'rss_end_bytes': sampler.last},
+        'disk': {
+            'downloads_bytes': disk_usage(os.path.join(workdir, 'downloads')),
+            'thumbnails_bytes': disk_usage(os.path.join(workdir, 'thumbnails')),
+            'total_bytes': disk_usage(workdir) - os.path.getsize(os.path.join(workdir, 'server.log')),
+        },
+        'upstream': upstream.stats(),
+        'proxies': [p.stats() for p in proxies],
+        'app_proxy_stats': proxy_stats,
+    }
+    if args.keep_workdir:
+        print(f'server directory kept at {workdir}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), result)
+    print(f'\nresults written to {path}')
+
+
+if __name__ == '__main__':
+    main()
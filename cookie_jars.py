@@ -0,0 +1,79 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+
+# Stable identity for a cookies string, used in cache and pool keys instead of the cookies themselves
+def cookie_identity(cookies_str):
+    if not cookies_str:
+        return None
+    return hashlib.sha256(cookies_str.encode('utf-8')).hexdigest()[:16]
+
+
+class _ParsedCookies:
+    __slots__ = ('cookies', 'expires_at')
+
+    def __init__(self, cookies, expires_at):
+        self.cookies = cookies
+        self.expires_at = expires_at
+
+
+# Netscape cookies strings parsed once and kept in memory, keyed by content hash. jar() hands out a fresh
+# YoutubeDLCookieJar (a MozillaCookieJar) per caller so cookies set during one session never leak into the
+# cached copy; nothing is written to or read from disk.
+class CookieJarCache:
+    def __init__(self, ttl=900, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _parse(cookies_str):
+        jar = YoutubeDLCookieJar()
+        # Same parser yt-dlp uses for cookiefile; raises http.cookiejar.LoadError on malformed input
+        jar.load(io.StringIO(cookies_str))
+        return list(jar)
+
+    # Return a new jar holding the cookies from cookies_str, or None when there are no cookies
+    def jar(self, cookies_str):
+        if not cookies_str:
+            return None
+        key = cookie_identity(cookies_str)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = _ParsedCookies(self._parse(cookies_str), now + self.ttl)
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        jar = YoutubeDLCookieJar()
+        for cookie in entry.cookies:
+            jar.set_cookie(cookie)
+        jar.clear_expired_cookies()
+        return jar
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
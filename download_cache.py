@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Cached files are named <key>.<ext>, with a <key>.meta.json sidecar holding the original title
+CACHE_FILE_RE = re.compile(r'^(?P<key>[0-9a-f]{24})\.(?P<ext>[A-Za-z0-9]+)$')
+META_SUFFIX = '.meta.json'
+
+
+# Content address of a download: the video plus everything that changes the output bytes
+def download_cache_key(video_key, format_selector, postprocessors=None, transcode=None):
+    material = [video_key, format_selector, postprocessors or []]
+    if transcode:
+        material.append(transcode)
+    material = json.dumps(material, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:24]
+
+
+class CachedDownload:
+    __slots__ = ('key', 'path', 'title', 'size', 'last_access')
+
+    def __init__(self, key, path, title, size, last_access):
+        self.key = key
+        self.path = path
+        self.title = title
+        self.size = size
+        self.last_access = last_access
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+
+# Index of finished downloads in UPLOAD_FOLDER, keyed by download_cache_key(). Finished files are reused
+# across requests; storage.StorageManager decides when the least recently used or expired ones are deleted.
+class DownloadCache:
+    def __init__(self, folder, max_bytes=2 * 1024 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    # Rebuild the index from disk so files survive restarts
+    def _load(self):
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return
+        for name in names:
+            match = CACHE_FILE_RE.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            self._entries[match.group('key')] = self._entry_from_disk(match.group('key'), path, st)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self.folder, key + META_SUFFIX), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _entry_from_disk(self, key, path, st, meta=None):
+        if meta is None:
+            meta = self._read_meta(key) or {}
+        return CachedDownload(key, path, meta.get('title'), st.st_size, st.st_mtime)
+
+    # Whether a file in the folder is a cached download or its sidecar
+    def owns(self, name):
+        key, _, rest = name.partition('.')
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (name == entry.filename or rest == META_SUFFIX[1:])
+
+    # Index a finished download that appeared on disk without going through store() (another worker
+    # process wrote it). store() writes the sidecar once the file is final, so a file without one, or
+    # other than the one its sidecar names, is still being downloaded or converted and is left alone.
+    # Returns False for names that are not finished downloads.
+    def adopt(self, name):
+        match = CACHE_FILE_RE.match(name)
+        if not match:
+            return False
+        meta = self._read_meta(match.group('key'))
+        if meta is None or meta.get('filename', name) != name:
+            return False
+        path = os.path.join(self.folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        entry = self._entry_from_disk(match.group('key'), path, st, meta)
+        with self._lock:
+            self._entries.setdefault(entry.key, entry)
+        return True
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(entry.path):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry.last_access = time.time()
+            self.hits += 1
+            return entry
+
+    # Like lookup() without counting a hit or miss or touching the entry
+    def contains(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and os.path.exists(entry.path)
+
+    def find_by_filename(self, filename):
+        match = CACHE_FILE_RE.match(os.path.basename(filename))
+        if not match:
+            return None
+        with self._lock:
+            return self._entries.get(match.group('key'))
+
+    def store(self, key, path, title=None):
+        size = os.path.getsize(path)
+        try:
+            atomic_write_json(os.path.join(self.folder, key + META_SUFFIX), {'title': title, 'filename': os.path.basename(path), 'created_at': time.time()})
+        except OSError as e:
+            logger.warning("Could not write download cache metadata for %s: %s", key, e)
+        entry = CachedDownload(key, path, title, size, time.time())
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    # Delete least recently used files until the cache fits target_bytes (default max_bytes). Keys in `keep`
+    # (in-flight downloads or the file just stored) are never evicted.
+    def evict(self, keep=(), target_bytes=None):
+        target = self.max_bytes if target_bytes is None else target_bytes
+        removed = []
+        with self._lock:
+            total = sum(e.size for e in self._entries.values())
+            for entry in sorted(self._entries.values(), key=lambda e: e.last_access):
+                if total <= target:
+                    break
+                if entry.key in keep:
+                    continue
+                del self._entries[entry.key]
+                total -= entry.size
+                removed.append(entry)
+                self.evictions += 1
+        self._delete(removed)
+        for entry in removed:
+            logger.info("Evicted cached download %s (%s bytes)", entry.filename, entry.size)
+        return removed
+
+    # Delete files nobody asked for in max_age seconds
+    def expire(self, max_age, keep=()):
+        cutoff = time.time() - max_age
+        with self._lock:
+            removed = [e for e in self._entries.values() if e.last_access < cutoff and e.key not in keep]
+            for entry in removed:
+                del self._entries[entry.key]
+        self._delete(removed)
+        return removed
+
+    def _delete(self, entries):
+        for entry in entries:
+            for path in (entry.path, os.path.join(self.folder, entry.key + META_SUFFIX)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Could not remove cached download %s: %s", path, e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': sum(e.size for e in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+ACTIVE_STATUSES = ('queued', 'running', 'postprocessing')
+
+
+# Raised by submit() when the worker pool and its queue are both full
+class QueueFullError(Exception):
+    pass
+
+
+# Raised by submit() when the client already has max_per_client downloads queued or running
+class ClientLimitError(QueueFullError):
+    pass
+
+
+# Raised by job functions to fail the job with a user-facing message
+class DownloadJobError(Exception):
+    pass
+
+
+class DownloadJob:
+    def __init__(self, meta=None):
+        self.id = uuid.uuid4().hex
+        self.meta = meta or {}
+        self.status = 'queued'  # queued -> running -> postprocessing -> finished | error | cancelled
+        self.filename = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.client = None  # admission.client_identity() of the submitter; not part of to_dict()
+        self.dedupe_key = None
+        self.subscribers = set()  # clients attached to this job through single-flight; None is the server itself
+        self._files = {}  # per-file (downloaded_bytes, total_bytes); video+audio jobs download two files
+        self.speed = None
+        self.eta = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    # yt-dlp progress_hooks callback
+    def update_progress(self, d):
+        name = d.get('filename') or d.get('tmpfilename') or ''
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        with self._lock:
+            if d.get('status') == 'downloading':
+                self._files[name] = (d.get('downloaded_bytes') or 0, total)
+                self.speed = d.get('speed')
+                self.eta = d.get('eta')
+            elif d.get('status') == 'finished':
+                size = d.get('total_bytes') or d.get('downloaded_bytes') or total or 0
+                self._files[name] = (size, size)
+                self.speed = None
+                self.eta = None
+
+    # yt-dlp postprocessor_hooks callback
+    def update_postprocessing(self, d):
+        if d.get('status') == 'started' and self.status == 'running':
+            self.status = 'postprocessing'
+
+    def progress(self):
+        with self._lock:
+            downloaded = sum(done for done, _ in self._files.values())
+            known_totals = [total for _, total in self._files.values() if total]
+            total = sum(known_totals) if len(known_totals) == len(self._files) and known_totals else None
+        return downloaded, total
+
+    def to_dict(self):
+        downloaded, total = self.progress()
+        percent = None
+        if self.status == 'finished':
+            percent = 100.0
+        elif total:
+            percent = round(min(downloaded / total * 100, 100.0), 1)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'percent': percent,
+            'speed': self.speed,
+            'eta': self.eta,
+            'filename': self.filename,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            **self.meta,
+        }
+
+
+# A job run by another worker process, as last published to the shared directory. Read-only: cancelling it
+# goes through DownloadJobManager.cancel(), which asks the owning worker.
+class SharedJob:
+    def __init__(self, record):
+        self.id = record['job_id']
+        self.status = record['status']
+        self._record = record
+
+    def to_dict(self):
+        return dict(self._record)
+
+
+# Bounded worker pool for downloads. submit() returns immediately; jobs report progress through their
+# DownloadJob and are kept for job_ttl seconds after they finish so clients can poll the result.
+# Queued jobs wait in one queue per client and a free worker takes the next client's oldest job in
+# round-robin order, so a client that queued many downloads does not hold back everyone queued after it.
+# Jobs run in the process that accepted them. With shared_dir set (a local directory shared by the gunicorn
+# workers), each worker publishes its jobs there every sync_interval seconds and on every status change, so
+# get() and cancel() find a job whichever worker the request lands on; a cancel for another worker's job is
+# left there as a request file that the owner applies on its next sync.
+class DownloadJobManager:
+    def __init__(self, max_workers=2, max_queued=16, job_ttl=3600, max_per_client=0, shared_dir=None, sync_interval=1):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.job_ttl = job_ttl
+        self.shared_dir = shared_dir
+        self.sync_interval = sync_interval
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._thread = None
+        self._jobs = {}
+        self._inflight = {}  # dedupe_key -> active job
+        self._queues = OrderedDict()  # client -> deque of (job, fn) not started yet, in round-robin order
+        self._waits = deque(maxlen=200)
+        self.coalesced = 0
+        self.rejected = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-job')
+
+    def _active_count(self, client=None):
+        return sum(1 for job in self._jobs.values()
+                   if job.status in ACTIVE_STATUSES and (client is None or job.client == client))
+
+    def _reject(self, reason, error):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED.inc(budget='download', reason=reason)
+        return error
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _shared_path(self, job_id, suffix='.json'):
+        return os.path.join(self.shared_dir, job_id + suffix)
+
+    def _publish(self, job):
+        if not self.shared_dir:
+            return
+        try:
+            atomic_write_json(self._shared_path(job.id), job.to_dict())
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not publish download job %s: %s", job.id, e)
+
+    def _load_shared(self, job_id):
+        if not self.shared_dir or not JOB_ID_RE.match(job_id):
+            return None
+        path = self._shared_path(job_id)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get('status') in ACTIVE_STATUSES and age > max(30, 10 * self.sync_interval):
+            # The owner republishes active jobs every sync; it is gone
+            record.update(status='error', error='The server process running this download stopped.')
+        return SharedJob(record)
+
+    # fn(job) runs on a worker thread and returns the downloaded filename. Submissions sharing a dedupe_key
+    # while a job for it is still active attach to that job (single-flight) instead of starting another one.
+    # client is who the job counts against for max_per_client and fair ordering (None: not limited), and
+    # whose cancel() releases this submission's subscription.
+    def submit(self, fn, dedupe_key=None, client=None, **meta):
+        with self._lock:
+            self._prune()
+            if dedupe_key is not None:
+                existing = self._inflight.get(dedupe_key)
+                if existing is not None and not existing.cancelled:
+                    existing.subscribers.add(client)
+                    self.coalesced += 1
+                    return existing
+            if self.max_per_client and client is not None and self._active_count(client) >= self.max_per_client:
+                raise self._reject('client_limit', ClientLimitError("You already have too many downloads in progress. Please wait for one to finish."))
+            if self._active_count() >= self.max_workers + self.max_queued:
+                raise self._reject('queue_full', QueueFullError("Too many downloads in progress. Please try again shortly."))
+            job = DownloadJob(meta)
+            job.dedupe_key = dedupe_key
+            job.client = client
+            job.subscribers.add(client)
+            self._jobs[job.id] = job
+            if dedupe_key is not None:
+                self._inflight[dedupe_key] = job
+            self._queues.setdefault(client, deque()).append((job, fn))
+            # One dispatch per job; which job it runs is decided when a worker frees up
+            self._executor.submit(self._dispatch)
+        self._publish(job)
+        return job
+
+    def _next_queued(self):
+        for client, queue in self._queues.items():
+            entry = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            return entry
+        return None
+
+    def _dispatch(self):
+        with self._lock:
+            entry = self._next_queued()
+        # Nothing left when the job this dispatch was for got cancelled while queued
+        if entry is not None:
+            self._run(*entry)
+
+    # Record a job that is already done, e.g. when the file was served from the download cache
+    def add_finished(self, filename, **meta):
+        job = DownloadJob(meta)
+        job.status = 'finished'
+        job.filename = filename
+        job.started_at = job.finished_at = job.created_at
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._publish(job)
+        return job
+
+    # True when a worker would start a new job right away
+    def has_idle_worker(self):
+        with self._lock:
+            return self._active_count() < self.max_workers
+
+    def is_inflight(self, dedupe_key):
+        with self._lock:
+            return dedupe_key in self._inflight
+
+    def inflight_keys(self):
+        with self._lock:
+            return set(self._inflight)
+
+    def _release(self, job):
+        with self._lock:
+            if job.dedupe_key is not None and self._inflight.get(job.dedupe_key) is job:
+                del self._inflight[job.dedupe_key]
+
+    def _run(self, job, fn):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            self._release(job)
+            self._publish(job)
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        self._publish(job)
+        with self._lock:
+            self._waits.append(job.started_at - job.created_at)
+        ADMISSION_WAIT.observe(job.started_at - job.created_at, budget='download')
+        try:
+            job.filename = fn(job)
+            job.status = 'cancelled' if job.cancelled else 'finished'
+        except DownloadJobError as e:
+            job.error = str(e)
+            job.status = 'cancelled' if job.cancelled else 'error'
+        except Exception as e:
+            job.error = f"An unexpected error occurred: {str(e)}"
+            job.status = 'cancelled' if job.cancelled else 'error'
+        finally:
+            job.finished_at = time.time()
+            self._release(job)
+            self._publish(job)
+
+    # The job with that id: a DownloadJob run here, a SharedJob run by another worker, or None
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load_shared(job_id)
+
+    # Queued jobs are dropped right away; running jobs stop at their next progress callback. A job shared
+    # by several clients is only cancelled once every one of them has cancelled it; a client cancelling a job
+    # it is not (or no longer) subscribed to changes nothing. Another worker's job is cancelled by that worker
+    # on its next sync; the SharedJob returned still shows the state before.
+    def cancel(self, job_id, client=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._request_cancel(job_id, client)
+        with self._lock:
+            if client not in job.subscribers:
+                return job
+            job.subscribers.discard(client)
+            if job.subscribers:
+                return job
+            job.cancel_event.set()
+            queue = self._queues.get(job.client)
+            entry = next((e for e in queue if e[0] is job), None) if queue else None
+            if entry is None:
+                return job
+            queue.remove(entry)
+            if not queue:
+                del self._queues[job.client]
+        job.status = 'cancelled'
+        job.finished_at = time.time()
+        self._release(job)
+        self._publish(job)
+        return job
+
+    # Ask the worker that runs another worker's job to cancel it for client
+    def _request_cancel(self, job_id, client):
+        job = self._load_shared(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return job
+        name = hashlib.sha256(repr(client).encode('utf-8')).hexdigest()[:16]
+        try:
+            atomic_write_json(self._shared_path(job_id, f".{name}.cancel"), {'client': client})
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not request cancellation of download job %s: %s", job_id, e)
+        return job
+
+    # Publish the jobs running here, apply cancel requests left for them by other workers, and drop records
+    # nobody refreshed for job_ttl seconds (finished jobs, or jobs of a worker that is gone)
+    def sync(self):
+        if not self.shared_dir:
+            return
+        with self._lock:
+            active = [job for job in self._jobs.values() if job.status in ACTIVE_STATUSES]
+            local = set(self._jobs)
+        for job in active:
+            self._publish(job)
+        cutoff = time.time() - self.job_ttl
+        entries = []
+        try:
+            with os.scandir(self.shared_dir) as it:
+                for entry in it:
+                    try:
+                        entries.append((entry.name, entry.path, entry.stat().st_mtime))
+                    except OSError:
+                        continue  # removed meanwhile
+        except OSError:
+            return
+        for name, path, mtime in entries:
+            job_id = name.partition('.')[0]
+            if name.endswith('.cancel') and job_id in local:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        client = json.load(f).get('client')
+                    os.remove(path)
+                except (OSError, ValueError):
+                    continue
+                logger.info("Cancellation of download job %s requested through another worker", job_id)
+                self.cancel(job_id, client)
+            elif mtime < cutoff and not name.endswith('.tmp'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _run_sync(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Download job sync failed: %s", e, exc_info=True)
+
+    def start(self):
+        if self.shared_dir and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run_sync, name='download-job-sync', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            waits = list(self._waits)
+            return {
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'max_per_client': self.max_per_client,
+                'jobs': counts,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'queued_clients': len(self._queues),
+                'coalesced': self.coalesced,
+                'rejected': dict(self.rejected),
+                'shared_dir': self.shared_dir,
+                'avg_wait_seconds': round(sum(waits) / len(waits), 3) if waits else None,
+                'max_wait_seconds': round(max(waits), 3) if waits else None,
+            }
@@ -0,0 +1,125 @@
+import re
+
+# A download request may name formats directly: one format ID, or a video+audio pair as yt-dlp writes them
+FORMAT_ID_RE = re.compile(r'^[A-Za-z0-9_.-]+(\+[A-Za-z0-9_.-]+)?$')
+
+# Containers yt-dlp can merge into without falling back to mkv
+_MERGE_EXT = {('mp4', 'm4a'): 'mp4', ('mp4', 'mp4'): 'mp4', ('webm', 'webm'): 'webm'}
+
+
+def _has_video(f):
+    return f.get('vcodec') not in (None, 'none')
+
+
+def _has_audio(f):
+    return f.get('acodec') not in (None, 'none')
+
+
+def _size(f):
+    return f.get('filesize') or f.get('filesize_approx')
+
+
+def _pair_ext(video, audio):
+    return _MERGE_EXT.get((video.get('ext'), audio.get('ext')), 'mkv')
+
+
+def _video_entry(height, progressive, video_only, audio_only):
+    if progressive:
+        # A single file needs no FFmpeg work at all, so it wins over a (possibly sharper) DASH pair
+        f = max(progressive, key=lambda f: (f.get('ext') == 'mp4', f.get('tbr') or 0))
+        return {
+            'quality': f"{height}p",
+            'height': height,
+            'format_id': f['format_id'],
+            'video_format_id': f['format_id'],
+            'audio_format_id': None,
+            'ext': f.get('ext'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'fps': f.get('fps'),
+            'filesize': _size(f),
+            'needs_mux': False,
+            'needs_transcode': False,
+        }
+    if not video_only or not audio_only:
+        return None
+    video = max(video_only, key=lambda f: (f.get('ext') == 'mp4', f.get('tbr') or 0))
+    # Audio in the same container family merges without re-encoding and without an mkv fallback
+    audio = max(audio_only, key=lambda f: (_pair_ext(video, f) != 'mkv', f.get('abr') or f.get('tbr') or 0))
+    video_size, audio_size = _size(video), _size(audio)
+    return {
+        'quality': f"{height}p",
+        'height': height,
+        'format_id': f"{video['format_id']}+{audio['format_id']}",
+        'video_format_id': video['format_id'],
+        'audio_format_id': audio['format_id'],
+        'ext': _pair_ext(video, audio),
+        'vcodec': video.get('vcodec'),
+        'acodec': audio.get('acodec'),
+        'fps': video.get('fps'),
+        'filesize': video_size + audio_size if video_size and audio_size else None,
+        'needs_mux': True,
+        'needs_transcode': False,
+    }
+
+
+# Build the per-video format index in one pass over yt-dlp's formats list:
+#   qualities: the quality labels shown to users (same output as the original parse_ytdlp_video_qualities)
+#   video:     per offered height, best first, the exact format ID(s) to download, size and FFmpeg work needed
+#   audio:     audio-only formats, best first; needs_transcode refers to the MP3 output of audio downloads
+def build_format_index(formats):
+    labels = {}  # label -> height
+    heights = set()
+    progressive, video_only, audio_only = {}, {}, []
+    for f in formats:
+        height = f.get('height')
+        if f.get('vcodec') != 'none' and height:
+            heights.add(height)
+            if f.get('ext') == 'mp4':
+                # mp4 with video and audio; mp4 video-only streams get no label of their own
+                if f.get('acodec') != 'none':
+                    labels[f"{height}p"] = height
+            else:
+                labels[f"{height}p (webm)"] = height
+        if not f.get('format_id'):
+            continue
+        if _has_video(f) and height:
+            if _has_audio(f):
+                progressive.setdefault(height, []).append(f)
+            elif f.get('acodec') == 'none':
+                video_only.setdefault(height, []).append(f)
+        elif _has_audio(f) and f.get('vcodec') == 'none':
+            audio_only.append(f)
+
+    if not labels and heights:
+        labels = {f"{h}p": h for h in heights}
+    qualities = [label for label, _ in sorted(labels.items(), key=lambda item: item[1], reverse=True)]
+    if not qualities:
+        qualities = ['Best Video']
+
+    video = []
+    for height in sorted(set(progressive) | set(video_only), reverse=True):
+        entry = _video_entry(height, progressive.get(height), video_only.get(height), audio_only)
+        if entry:
+            video.append(entry)
+
+    audio = [
+        {
+            'format_id': f['format_id'],
+            'ext': f.get('ext'),
+            'acodec': f.get('acodec'),
+            'abr': f.get('abr') or f.get('tbr'),
+            'filesize': _size(f),
+            'needs_transcode': f.get('acodec') != 'mp3',
+        }
+        for f in sorted(audio_only, key=lambda f: f.get('abr') or f.get('tbr') or 0, reverse=True)
+    ]
+    return {'qualities': qualities, 'video': video, 'audio': audio}
+
+
+# The index entry (video or audio) that offers exactly this format ID, or None
+def find_index_entry(index, format_id):
+    for entry in index['video'] + index['audio']:
+        if entry['format_id'] == format_id:
+            return entry
+    return None
@@ -0,0 +1,32 @@
+import os
+import sys
+
+# gunicorn reads this file when started from the repository root (start.sh, Procfile); command-line options
+# still take precedence.
+#
+# The app is loaded once in the master: yt-dlp and its ~1800 extractors are imported and their URL patterns
+# compiled before any worker is forked, and the workers share those pages copy-on-write. A worker that boots
+# or is recycled starts warm instead of paying for the imports and the warm-up itself.
+# PRELOAD_APP=0 loads the app in every worker instead.
+preload_app = os.environ.get('PRELOAD_APP', '1').lower() in ('1', 'true', 'yes')
+
+if preload_app:
+    # Tells app.py to warm up in the foreground and leave its background threads to the workers
+    os.environ['GUNICORN_PRELOAD'] = '1'
+
+
+def _app_module():
+    # Loaded in the master only when preloading; asgi:application imports it too
+    return sys.modules.get('app') if preload_app else None
+
+
+def pre_fork(server, worker):
+    app_module = _app_module()
+    if app_module is not None:
+        app_module.before_fork()
+
+
+def post_fork(server, worker):
+    app_module = _app_module()
+    if app_module is not None:
+        app_module.after_fork()
@@ -0,0 +1,44 @@
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+OEMBED_URL = 'https://www.youtube.com/oembed'
+
+
+# Thumbnail URLs on YouTube's image CDN follow the video ID; hqdefault exists for every video
+def youtube_thumbnail_url(video_id, name='hqdefault'):
+    return f"https://i.ytimg.com/vi/{video_id}/{name}.jpg"
+
+
+# Title and channel of a YouTube video from the public oEmbed endpoint: one small JSON request, no page
+# download, no format or signature resolution. Returns None when oEmbed has nothing (private, age-gated,
+# removed) or cannot be reached; callers fall back to the full extraction.
+def fetch_youtube_oembed(session, video_id, timeout=3):
+    try:
+        response = session.get(
+            OEMBED_URL,
+            params={'url': f"https://www.youtube.com/watch?v={video_id}", 'format': 'json'},
+            timeout=timeout,
+        )
+    except requests.RequestException as e:
+        logger.warning("oEmbed lookup failed for %s: %s", video_id, str(e))
+        return None
+    with response:
+        if response.status_code != 200:
+            logger.info("oEmbed has no data for %s (status %s)", video_id, response.status_code)
+            return None
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+    if not data.get('title'):
+        return None
+    return {
+        'id': video_id,
+        'title': data['title'],
+        'uploader': data.get('author_name'),
+        'thumbnail': youtube_thumbnail_url(video_id),
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+    }
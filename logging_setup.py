@@ -0,0 +1,208 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+# Logging for the app and yt-dlp. Records are filtered by level before any message formatting, repetitive
+# INFO/DEBUG messages are sampled, and formatting plus the write to stderr happen on a background thread so
+# request threads never block on log I/O. Configured from the environment:
+#   LOG_LEVEL          level for the app's own loggers (default INFO)
+#   YTDLP_LOG_LEVEL    level for yt-dlp's output (default WARNING; its DEBUG is one line per extraction step)
+#   LOG_LEVELS         per-logger overrides, e.g. "proxy_pool=DEBUG,download_cache=WARNING"
+#   LOG_FORMAT         "text" (default) or "json" (one object per line)
+#   LOG_SAMPLE_BURST   INFO/DEBUG records logged per message template and window before sampling starts (default 20)
+#   LOG_SAMPLE_RATE    past the burst, one in this many is logged (default 100; 0 disables sampling)
+#   LOG_SAMPLE_WINDOW  sampling window in seconds (default 10)
+#   LOG_QUEUE_SIZE     records waiting for the writer before new ones are dropped (default 10000)
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(name)s %(module)s.%(funcName)s:%(lineno)d - %(message)s'
+
+# Logger handed to yt-dlp (params['logger']); its level is YTDLP_LOG_LEVEL
+ytdlp_logger = logging.getLogger('yt_dlp')
+
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON line
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+def _level(value, default):
+    value = (value or '').strip().upper()
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    return level if isinstance(level, int) else default
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Tags each record with the route it was logged for (metrics.current_route of the thread that logged it)
+class RouteFilter(logging.Filter):
+    def filter(self, record):
+        record.route = metrics.current_route()
+        return True
+
+
+# Rate limit for INFO and DEBUG: per (logger, message template) the first `burst` records of each window are
+# kept, then one in `rate`. The next record that gets through carries the number dropped before it as
+# record.sampled_out. Warnings and errors are never sampled.
+class SamplingFilter(logging.Filter):
+    def __init__(self, burst=20, rate=100, window=10.0, max_keys=1000):
+        super().__init__()
+        self.burst = burst
+        self.rate = rate
+        self.window = window
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._state = {}  # (logger, template) -> [window start, count, dropped since last kept]
+
+    def filter(self, record):
+        if not self.rate or record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is None and len(self._state) >= self.max_keys:
+                    self._state.clear()
+                state = self._state[key] = [now, 0, state[2] if state else 0]
+            state[1] += 1
+            if state[1] > self.burst and (state[1] - self.burst) % self.rate:
+                state[2] += 1
+                self.suppressed += 1
+                return False
+            dropped, state[2] = state[2], 0
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+# QueueHandler that never blocks: the message is merged on the calling thread (so later changes to the
+# arguments cannot leak into the line), the formatting for output happens on the listener thread, and
+# records are dropped and counted when the writer falls behind.
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging():
+    global _listener
+    if _listener is not None:
+        return
+    app_level = _level(os.environ.get('LOG_LEVEL'), logging.INFO)
+
+    output = logging.StreamHandler()
+    if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000))))
+    handler.addFilter(SamplingFilter(
+        burst=int(os.environ.get('LOG_SAMPLE_BURST', 20)),
+        rate=int(os.environ.get('LOG_SAMPLE_RATE', 100)),
+        window=float(os.environ.get('LOG_SAMPLE_WINDOW', 10)),
+    ))
+    handler.addFilter(RouteFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(app_level)
+    ytdlp_logger.setLevel(_level(os.environ.get('YTDLP_LOG_LEVEL'), logging.WARNING))
+    for override in os.environ.get('LOG_LEVELS', '').split(','):
+        name, _, level = override.partition('=')
+        if name.strip() and level.strip():
+            logging.getLogger(name.strip()).setLevel(_level(level, app_level))
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+# A forked process inherits the log queue (with whatever the parent had not written yet) but not the writer
+# thread; give it a queue and a writer of its own
+def restart_logging_after_fork():
+    global _listener
+    if _listener is None:
+        return
+    handler = next((h for h in logging.getLogger().handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    if handler is None:
+        return
+    handler.queue = queue.Queue(maxsize=handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+# Flush queued records and stop the writer thread
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass  # writer is hopelessly behind; whatever is still queued is lost
+        _listener = None
+
+
+# Counters for /metrics and the stats endpoints
+def logging_stats():
+    root = logging.getLogger()
+    handler = next((h for h in root.handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    if handler is None:
+        return {}
+    sampler = next((f for f in handler.filters if isinstance(f, SamplingFilter)), None)
+    return {
+        'queued': handler.queue.qsize(),
+        'dropped': handler.dropped,
+        'sampled_out': sampler.suppressed if sampler else 0,
+    }
@@ -0,0 +1,129 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# Matches the 11-character YouTube video ID
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com', 'www.youtube-nocookie.com')
+
+
+# Extract the YouTube video ID from the common URL shapes (watch, youtu.be, shorts, embed, live)
+def extract_youtube_id(url):
+    if not url:
+        return None
+    url = url.strip()
+    if YOUTUBE_ID_RE.match(url):
+        return url
+    try:
+        parsed = urlparse(url if '://' in url else f'https://{url}')
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    if host in ('youtu.be', 'www.youtu.be'):
+        candidate = parsed.path.lstrip('/').split('/')[0]
+        return candidate if YOUTUBE_ID_RE.match(candidate) else None
+    if host in YOUTUBE_HOSTS:
+        video_ids = parse_qs(parsed.query).get('v')
+        if video_ids and YOUTUBE_ID_RE.match(video_ids[0]):
+            return video_ids[0]
+        path_parts = [p for p in parsed.path.split('/') if p]
+        if len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v', 'e'):
+            if YOUTUBE_ID_RE.match(path_parts[1]):
+                return path_parts[1]
+    return None
+
+
+# Normalized cache key for a user-supplied URL: the video ID when we can find one, the stripped URL otherwise
+def normalize_video_key(url):
+    video_id = extract_youtube_id(url)
+    if video_id:
+        return f'youtube:{video_id}'
+    return f'url:{(url or "").strip()}'
+
+
+def estimate_size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class CachedInfo:
+    __slots__ = ('info', 'proxy', 'expires_at', 'size')
+
+    def __init__(self, info, proxy, expires_at, size):
+        self.info = info
+        self.proxy = proxy
+        self.expires_at = expires_at
+        self.size = size
+
+
+# Thread-safe TTL + LRU cache for yt-dlp extract_info results, bounded by entry count and approximate bytes
+class MetadataCache:
+    def __init__(self, ttl=1800, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    # ttl overrides the cache's own, e.g. for entries that already spent part of their life elsewhere
+    def set(self, key, info, proxy=None, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        size = estimate_size(info)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        entry = CachedInfo(info, proxy, time.monotonic() + ttl, size)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._total_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,202 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        proxy TEXT,
+        updated_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (key, kind)
+    )""",
+    "CREATE INDEX IF NOT EXISTS metadata_expires_at ON metadata (expires_at)",
+    """CREATE TABLE IF NOT EXISTS proxy_health (
+        proxy TEXT PRIMARY KEY,
+        successes INTEGER NOT NULL,
+        failures INTEGER NOT NULL,
+        consecutive_failures INTEGER NOT NULL,
+        latency_ewma REAL,
+        cooldown_until REAL NOT NULL,
+        last_error TEXT,
+        updated_at REAL NOT NULL
+    )""",
+)
+
+
+class StoredInfo:
+    __slots__ = ('info', 'proxy', 'expires_at')
+
+    def __init__(self, info, proxy, expires_at):
+        self.info = info
+        self.proxy = proxy
+        self.expires_at = expires_at
+
+
+# Metadata that outlives the process: one SQLite database in WAL mode, shared by every worker on the host
+# (readers never block the writer, so lookups stay fast while another worker stores an extraction).
+# Entries are JSON values under (key, kind), where key is a normalize_video_key() result and kind says what
+# was stored ('full' extractions including formats and the format index, 'lite' title/thumbnail lookups);
+# each kind has its own TTL and expired rows are pruned by the background thread. The same thread writes
+# this worker's proxy health and adopts what the other workers learned (see ProxyPool.export_health).
+# Each thread (and each process after a fork) gets its own connection.
+class MetadataStore:
+    def __init__(self, path, ttls=None, sync_interval=15):
+        self.path = path
+        self.ttls = dict(ttls or {})
+        self.sync_interval = sync_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._final_sync_registered = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    # Close this thread's connection (it is reopened on next use). A preloading gunicorn master calls this
+    # before forking, so no worker inherits an open SQLite connection.
+    def close(self):
+        local = self._local
+        db = getattr(local, 'db', None)
+        if db is not None and local.pid == os.getpid():
+            db.close()
+        local.db, local.pid = None, None
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key, kind='full'):
+        try:
+            row = self._connect().execute(
+                'SELECT value, proxy, expires_at FROM metadata WHERE key = ? AND kind = ? AND expires_at > ?',
+                (key, kind, time.time())).fetchone()
+        except sqlite3.Error as e:
+            self._count('errors')
+            logger.warning("Metadata store lookup failed for %s: %s", key, e)
+            return None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return StoredInfo(json.loads(row[0]), row[1], row[2])
+
+    # value must be JSON-serializable (sanitize yt-dlp info dicts first)
+    def put(self, key, value, kind='full', proxy=None, ttl=None):
+        ttl = self.ttls.get(kind, 0) if ttl is None else ttl
+        if ttl <= 0:
+            return False
+        now = time.time()
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO metadata (key, kind, value, proxy, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, kind, json.dumps(value), proxy, now, now + ttl))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._count('errors')
+            logger.warning("Could not store %s metadata for %s: %s", kind, key, e)
+            return False
+        self._count('writes')
+        return True
+
+    def invalidate(self, key, kind=None):
+        try:
+            if kind is None:
+                self._connect().execute('DELETE FROM metadata WHERE key = ?', (key,))
+            else:
+                self._connect().execute('DELETE FROM metadata WHERE key = ? AND kind = ?', (key, kind))
+        except sqlite3.Error as e:
+            self._count('errors')
+            logger.warning("Could not drop stored metadata for %s: %s", key, e)
+
+    def prune(self):
+        return self._connect().execute('DELETE FROM metadata WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def save_proxy_health(self, rows):
+        if not rows:
+            return
+        now = time.time()
+        self._connect().executemany(
+            'INSERT OR REPLACE INTO proxy_health (proxy, successes, failures, consecutive_failures, latency_ewma, '
+            'cooldown_until, last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(r['proxy'], r['successes'], r['failures'], r['consecutive_failures'], r['latency_ewma'],
+              r['cooldown_until'], r['last_error'], now) for r in rows])
+
+    def load_proxy_health(self):
+        cursor = self._connect().execute(
+            'SELECT proxy, successes, failures, consecutive_failures, latency_ewma, cooldown_until, last_error FROM proxy_health')
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # Push this worker's proxy health, adopt the other workers', drop expired metadata
+    def sync(self, proxy_pool=None):
+        if proxy_pool is not None:
+            self.save_proxy_health(proxy_pool.export_health())
+            proxy_pool.merge_health(self.load_proxy_health())
+        pruned = self.prune()
+        if pruned:
+            logger.info("Pruned %s expired metadata entries", pruned)
+
+    def _run(self, proxy_pool):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync(proxy_pool)
+            except Exception as e:
+                logger.error("Metadata store sync failed: %s", e, exc_info=True)
+
+    def _final_sync(self, proxy_pool):
+        try:
+            self.save_proxy_health(proxy_pool.export_health())
+        except sqlite3.Error as e:
+            logger.warning("Could not save proxy health at exit: %s", e)
+
+    def start(self, proxy_pool=None):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, args=(proxy_pool,), name='metadata-store-sync', daemon=True)
+            self._thread.start()
+            if proxy_pool is not None and not self._final_sync_registered:
+                # What this worker learned since the last sync survives a restart too
+                atexit.register(self._final_sync, proxy_pool)
+                self._final_sync_registered = True
+
+    def stats(self):
+        try:
+            counts = dict(self._connect().execute(
+                'SELECT kind, COUNT(*) FROM metadata WHERE expires_at > ? GROUP BY kind', (time.time(),)).fetchall())
+            size = sum(os.path.getsize(p) for p in (self.path, f'{self.path}-wal') if os.path.exists(p))
+        except (sqlite3.Error, OSError):
+            counts, size = None, None
+        with self._lock:
+            return {
+                'path': self.path,
+                'entries': counts,
+                'bytes': size,
+                'ttls': self.ttls,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'errors': self.errors,
+            }
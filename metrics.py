@@ -0,0 +1,195 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics: labelled counters and histograms plus gauges read from callbacks at
+# scrape time, rendered in the text exposition format by render(). Values live in the process that
+# recorded them; run a single gunicorn worker (the default) or scrape each worker separately.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    # Observe the duration of a with-block (also when it raises)
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = self.header()
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# Gauge whose samples are produced by fn() at scrape time as {label tuple: value}
+class GaugeCallback(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, fn):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def render(self):
+        try:
+            samples = self.fn()
+        except Exception:
+            return []
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in sorted(samples.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, labelnames, fn):
+        return self.register(GaugeCallback(name, documentation, labelnames, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Route a piece of work is done for. Request threads set it in before_request; work handed to other threads
+# carries it along through with_route().
+_context = threading.local()
+
+
+def current_route():
+    return getattr(_context, 'route', None) or 'background'
+
+
+def set_route(route):
+    _context.route = route
+
+
+def with_route(route, fn):
+    def wrapper(*args, **kwargs):
+        previous = getattr(_context, 'route', None)
+        _context.route = route
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _context.route = previous
+    return wrapper
+
+
+# Shared metrics. Stages: cookie_prep, ydl_construct, extract (per proxy attempt), download (per proxy
+# attempt), ffmpeg (yt-dlp postprocessing and pooled transcodes) and file_send.
+STAGE_SECONDS = REGISTRY.histogram(
+    'freeytzone_stage_duration_seconds', 'Time spent per request stage', ('stage', 'route', 'proxy'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'freeytzone_http_request_duration_seconds', 'HTTP request duration until the response is closed', ('route', 'method', 'status'))
+DOWNLOAD_THROUGHPUT = REGISTRY.histogram(
+    'freeytzone_download_bytes_per_second', 'Download throughput per finished proxy attempt', ('route', 'proxy'),
+    buckets=(64e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6, 50e6, 100e6))
+ATTEMPTS = REGISTRY.counter(
+    'freeytzone_proxy_attempts_total', 'Upstream attempts by stage and outcome', ('stage', 'route', 'proxy', 'outcome'))
+RETRIES = REGISTRY.counter(
+    'freeytzone_retries_total', 'Attempts after the first one for the same lookup or download', ('stage', 'route'))
+FAILURES = REGISTRY.counter(
+    'freeytzone_failures_total', 'Operations that failed after all attempts', ('stage', 'route'))
+ADMISSION_WAIT = REGISTRY.histogram(
+    'freeytzone_admission_wait_seconds', 'Time admitted work waited in its budget queue', ('budget',))
+ADMISSION_REJECTED = REGISTRY.counter(
+    'freeytzone_admission_rejected_total', 'Work turned away by admission control', ('budget', 'reason'))
+PREFETCHES = REGISTRY.counter(
+    'freeytzone_prefetch_total', 'Speculative downloads by outcome (started, hit, wasted, skipped)', ('outcome', 'reason'))
@@ -0,0 +1,339 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import requests
+from yt_dlp.downloader import PROTOCOL_MAP
+from yt_dlp.downloader.http import HttpFD
+
+from proxy_pool import proxy_label
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# The probe range is kept small so the other connections start right away; ranges never get smaller than
+# MIN_CHUNK_SIZE when a file is split over the connections
+PROBE_SIZE = 256 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+READ_SIZE = 64 * 1024
+# Answers that will not get better by asking the same upstream again
+FATAL_STATUSES = (401, 403, 404, 410)
+
+
+class ChunkFailed(Exception):
+    # proxy_fault=False: the upstream answered, so the proxy itself works; fatal: do not use it again for this file
+    def __init__(self, message, proxy_fault=True, fatal=False):
+        super().__init__(message)
+        self.proxy_fault = proxy_fault
+        self.fatal = fatal
+
+
+# The server ignores Range requests (answers 200 with the whole file)
+class RangesUnsupported(Exception):
+    pass
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Chunk:
+    __slots__ = ('start', 'end', 'attempts', 'failed_on')
+
+    def __init__(self, start, end):
+        self.start = start  # next byte to fetch; moves forward as bytes are written
+        self.end = end
+        self.attempts = 0
+        self.failed_on = set()
+
+
+# One proxy (or the direct connection) as seen by one download
+class _Upstream:
+    __slots__ = ('proxy', 'active', 'consecutive_failures', 'disabled', 'bytes', 'chunks')
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.active = 0
+        self.consecutive_failures = 0
+        self.disabled = False
+        self.bytes = 0
+        self.chunks = 0
+
+
+def _proxies(proxy_url):
+    return {'http': proxy_url, 'https': proxy_url} if proxy_url else None
+
+
+# A single HTTP file fetched as byte ranges over several connections, spread across proxies. A small first
+# range doubles as a probe: it tells the file size and whether the server honours Range at all. The rest of
+# the file is cut into ranges of at most chunk_size (smaller when that would leave connections idle) for the
+# worker threads. Each range goes to the least busy usable proxy (preferring ones it has not failed on); what
+# arrives is written at the range's offset in the preallocated .part file, and on failure the unfinished rest
+# of the range is put back for another proxy. A proxy is dropped for the rest of the file after two failures
+# in a row, or at once when the server refuses it (e.g. 403 for a stream URL bound to another IP). Progress
+# hooks run on the calling thread, so a hook raising (cancellation, disk space) stops the workers.
+class _RangeDownload:
+    def __init__(self, fd, filename, info_dict, options):
+        self.fd = fd
+        self.filename = filename
+        self.info_dict = info_dict
+        self.url = info_dict['url']
+        self.headers = dict(info_dict.get('http_headers') or {}, **{'Accept-Encoding': 'identity'})
+        chunk_size = options.get('chunk_size') or DEFAULT_CHUNK_SIZE
+        # Sites like YouTube throttle ranges above their own chunk size
+        site_chunk_size = (info_dict.get('downloader_options') or {}).get('http_chunk_size')
+        self.chunk_size = min(chunk_size, site_chunk_size) if site_chunk_size else chunk_size
+        self.connections = options['connections']
+        self.per_proxy = max(1, options.get('per_proxy', 2))
+        self.max_attempts = options.get('max_attempts', 5)
+        self.on_proxy_error = options.get('on_proxy_error')
+        self.timeout = fd.params.get('socket_timeout') or 20
+        # The instance's own proxy first: it resolved the stream URLs, so they are known to work through it
+        proxies = [fd.params.get('proxy') or None]
+        for proxy in options.get('proxies') or []:
+            if proxy not in proxies:
+                proxies.append(proxy)
+        self.upstreams = [_Upstream(p) for p in proxies]
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._pending = deque()
+        self._in_flight = 0
+        self.total = None
+        self.downloaded = 0
+        self.retries = 0
+        self.error = None
+
+    def _fetch(self, session, chunk, upstream, fdesc):
+        headers = dict(self.headers, Range=f'bytes={chunk.start}-{chunk.end}')
+        try:
+            with session.get(self.url, headers=headers, proxies=_proxies(upstream.proxy), stream=True, timeout=self.timeout) as response:
+                if response.status_code == 200:
+                    raise RangesUnsupported()
+                if response.status_code != 206:
+                    raise ChunkFailed(f"HTTP {response.status_code}", proxy_fault=False, fatal=response.status_code in FATAL_STATUSES)
+                match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != chunk.start:
+                    raise ChunkFailed(f"Unexpected Content-Range: {response.headers.get('Content-Range')}", proxy_fault=False)
+                if match.group(3) != '*':
+                    self.total = int(match.group(3))
+                end = min(chunk.end, int(match.group(2)))
+                for piece in response.iter_content(READ_SIZE):
+                    if self._stop.is_set():
+                        raise _Stopped()
+                    piece = piece[:end - chunk.start + 1]
+                    if not piece:
+                        break
+                    os.pwrite(fdesc, piece, chunk.start)
+                    chunk.start += len(piece)
+                    with self._cond:
+                        self.downloaded += len(piece)
+                        upstream.bytes += len(piece)
+                if chunk.start <= end:
+                    raise ChunkFailed(f"Connection closed {end - chunk.start + 1} bytes early")
+        except requests.RequestException as e:
+            raise ChunkFailed(str(e))
+
+    # Least busy usable upstream for the chunk, or None when all of them are at their connection limit
+    def _pick(self, chunk):
+        usable = [u for u in self.upstreams if not u.disabled and u.active < self.per_proxy]
+        fresh = [u for u in usable if u.proxy not in chunk.failed_on]
+        return min(fresh or usable, key=lambda u: u.active, default=None)
+
+    def _next(self):
+        with self._cond:
+            while not self._stop.is_set():
+                if all(u.disabled for u in self.upstreams):
+                    self._fail("Every connection failed for this file.")
+                    break
+                if self._pending:
+                    upstream = self._pick(self._pending[0])
+                    if upstream is not None:
+                        upstream.active += 1
+                        self._in_flight += 1
+                        return self._pending.popleft(), upstream
+                elif not self._in_flight:
+                    break
+                self._cond.wait(0.5)
+        return None, None
+
+    def _fail(self, message):
+        if self.error is None:
+            self.error = message
+        self._stop.set()
+        self._cond.notify_all()
+
+    def _done(self, chunk, upstream):
+        with self._cond:
+            upstream.active -= 1
+            upstream.consecutive_failures = 0
+            upstream.chunks += 1
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _failed(self, chunk, upstream, error):
+        with self._cond:
+            upstream.active -= 1
+            upstream.consecutive_failures += 1
+            if getattr(error, 'fatal', False) or upstream.consecutive_failures >= 2:
+                upstream.disabled = True
+            self._in_flight -= 1
+            chunk.attempts += 1
+            chunk.failed_on.add(upstream.proxy)
+            self.retries += 1
+            if chunk.attempts >= self.max_attempts:
+                self._fail(f"Bytes {chunk.start}-{chunk.end} failed {chunk.attempts} times, last: {error}")
+            else:
+                self._pending.appendleft(chunk)
+            self._cond.notify_all()
+        logger.info("Range %s-%s of %s failed via %s, retrying elsewhere: %s", chunk.start, chunk.end, self.filename, proxy_label(upstream.proxy), error)
+        if getattr(error, 'proxy_fault', True) and self.on_proxy_error:
+            self.on_proxy_error(upstream.proxy, error)
+
+    def _work(self, fdesc):
+        session = requests.Session()
+        try:
+            while True:
+                chunk, upstream = self._next()
+                if chunk is None:
+                    return
+                try:
+                    self._fetch(session, chunk, upstream, fdesc)
+                except _Stopped:
+                    with self._cond:
+                        upstream.active -= 1
+                        self._in_flight -= 1
+                    return
+                except RangesUnsupported:
+                    self._failed(chunk, upstream, ChunkFailed("Range request answered with the whole file", proxy_fault=False))
+                except (ChunkFailed, OSError) as e:
+                    self._failed(chunk, upstream, e)
+                else:
+                    self._done(chunk, upstream)
+        finally:
+            session.close()
+
+    def _progress(self, status, total, tmpfilename, started):
+        now = time.time()
+        with self._cond:
+            downloaded = self.downloaded
+        speed = self.fd.calc_speed(started, now, downloaded)
+        self.fd._hook_progress({
+            'status': status,
+            'filename': self.filename,
+            'tmpfilename': tmpfilename,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'elapsed': now - started,
+            'speed': speed,
+            'eta': self.fd.calc_eta(speed, total - downloaded) if status == 'downloading' else None,
+        }, self.info_dict)
+
+    # Fetch the first range, moving on to the next upstream when one fails. Returns False when ranges cannot
+    # be used for this file; whatever was written so far is a valid start of the file either way.
+    def _probe(self, chunk, fdesc):
+        session = requests.Session()
+        try:
+            for upstream in self.upstreams[:self.max_attempts]:
+                try:
+                    self._fetch(session, chunk, upstream, fdesc)
+                except RangesUnsupported:
+                    logger.info("Server ignores range requests for %s; using a single connection", self.filename)
+                    return False
+                except (ChunkFailed, OSError) as e:
+                    logger.info("First range of %s failed via %s: %s", self.filename, proxy_label(upstream.proxy), e)
+                    upstream.consecutive_failures += 1
+                    self.retries += 1
+                    if getattr(e, 'proxy_fault', True) and self.on_proxy_error:
+                        self.on_proxy_error(upstream.proxy, e)
+                    continue
+                upstream.chunks += 1
+                return self.total is not None
+            return False
+        finally:
+            session.close()
+
+    # Returns True on success, False on failure, None when ranges cannot be used (the server ignores them or
+    # the first range failed everywhere) and the caller should fall back to a plain download
+    def run(self):
+        tmpfilename = self.fd.temp_name(self.filename)
+        started = time.time()
+        fdesc = os.open(tmpfilename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            probe = _Chunk(0, min(self.chunk_size, PROBE_SIZE) - 1)
+            if not self._probe(probe, fdesc):
+                return None
+            total = self.total
+            rest = total - probe.start
+            self.chunk_size = max(MIN_CHUNK_SIZE, min(self.chunk_size, -(-rest // self.connections)))
+            self.fd.report_destination(self.filename)
+            os.ftruncate(fdesc, total)
+            for start in range(probe.start, total, self.chunk_size):
+                self._pending.append(_Chunk(start, min(start + self.chunk_size, total) - 1))
+            workers = [
+                threading.Thread(target=self._work, args=(fdesc,), name=f'range-download-{i}', daemon=True)
+                for i in range(min(self.connections, len(self._pending)))
+            ]
+            for worker in workers:
+                worker.start()
+            try:
+                while any(worker.is_alive() for worker in workers):
+                    deadline = time.monotonic() + 0.5
+                    for worker in workers:
+                        worker.join(max(0, deadline - time.monotonic()))
+                    self._progress('downloading', total, tmpfilename, started)
+            finally:
+                with self._cond:
+                    self._stop.set()
+                    self._cond.notify_all()
+                for worker in workers:
+                    worker.join()
+        finally:
+            os.close(fdesc)
+        if self.error is not None:
+            self.fd.report_error(f"Parallel download failed: {self.error}")
+            return False
+        self.fd.try_rename(tmpfilename, self.filename)
+        self._progress('finished', total, tmpfilename, started)
+        return True
+
+    def summary(self):
+        with self._cond:
+            return {
+                'connections': self.connections,
+                'chunk_size': self.chunk_size,
+                'retries': self.retries,
+                'upstreams': [
+                    {'proxy': proxy_label(u.proxy), 'bytes': u.bytes, 'chunks': u.chunks, 'disabled': u.disabled}
+                    for u in self.upstreams if u.bytes or u.chunks or u.disabled
+                ],
+            }
+
+
+# yt-dlp's HTTP downloader with a multi-connection mode, switched on per download through the
+# 'parallel_download' param: {'connections': N, 'proxies': [...], 'per_proxy': 2, 'chunk_size': bytes,
+# 'on_proxy_error': fn(proxy, error), 'on_finished': fn(summary)}. Without it (or with a single
+# connection, a POST body, or a server that ignores Range) it behaves exactly like HttpFD.
+class ParallelHttpFD(HttpFD):
+    def real_download(self, filename, info_dict):
+        options = self.params.get('parallel_download')
+        if (not options or options.get('connections', 1) <= 1 or info_dict.get('request_data')
+                or self.params.get('test') or filename == '-'):
+            return super().real_download(filename, info_dict)
+        download = _RangeDownload(self, filename, info_dict, options)
+        result = download.run()
+        if result is None:
+            return super().real_download(filename, info_dict)
+        if options.get('on_finished'):
+            options['on_finished'](download.summary())
+        return result
+
+
+# Route yt-dlp's plain HTTP(S) downloads through ParallelHttpFD. DASH/HLS fragments keep their own
+# downloaders, which fetch fragments concurrently with the 'concurrent_fragment_downloads' param.
+def register():
+    for protocol in ('http', 'https'):
+        PROTOCOL_MAP[protocol] = ParallelHttpFD
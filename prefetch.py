@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import PREFETCHES
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running', 'postprocessing')
+
+
+# Raised by a prefetch's submit callback when the download should not be started; reason ends up in the stats
+class PrefetchSkipped(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Prefetch:
+    __slots__ = ('key', 'job', 'client', 'started_at')
+
+    def __init__(self, key, job, client):
+        self.key = key
+        self.job = job
+        self.client = client
+        self.started_at = time.monotonic()
+
+
+# Speculative downloads started right after /get_info, before the user asks for them. A prefetch is an
+# ordinary download job under the dedupe key /download computes for the same request, so a matching
+# /download attaches to it while it runs or finds its file in the download cache once it is done; that
+# /download claims it (a hit). A prefetch nobody claims within unused_timeout seconds is cancelled, or
+# written off if it already finished (waste). At most max_active prefetches download at once, and each
+# client has at most one outstanding: looking up another video replaces the previous one.
+class Prefetcher:
+    def __init__(self, jobs, max_active=2, unused_timeout=60, sweep_interval=5):
+        self.jobs = jobs
+        self.max_active = max_active
+        self.unused_timeout = unused_timeout
+        self.sweep_interval = sweep_interval
+        self._pending = OrderedDict()  # dedupe key -> _Prefetch not claimed yet, oldest first
+        self._starting = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.started = 0
+        self.skipped = {}
+        self.hits = {}  # claimed while 'running' or after it 'finished'
+        self.wasted = {}  # 'cancelled' (unclaimed in time), 'unused' (finished, never claimed), 'replaced', 'failed'
+        self.wasted_bytes = 0
+
+    def _active(self):
+        return sum(1 for p in self._pending.values() if p.job.status in ACTIVE_STATUSES)
+
+    def _skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+        PREFETCHES.inc(outcome='skipped', reason=reason)
+
+    # submit() queues the download and returns its DownloadJob, or raises PrefetchSkipped. The job must be
+    # submitted without a client: its subscription is the server's (None), which claim() and write-offs
+    # cancel. client is who the prefetch was made for. Returns the job, or None when the prefetch was skipped.
+    def prefetch(self, key, submit, client=None):
+        with self._lock:
+            if key in self._pending:
+                self._skip('pending')
+                return None
+            replaced = [p for p in self._pending.values() if client is not None and p.client == client]
+            freed = sum(1 for p in replaced if p.job.status in ACTIVE_STATUSES)
+            if self._active() - freed + self._starting >= self.max_active:
+                self._skip('budget')
+                return None
+            self._starting += 1
+            for p in replaced:
+                del self._pending[p.key]
+        for p in replaced:
+            self._write_off(p, 'replaced')
+        try:
+            job = submit()
+        except PrefetchSkipped as e:
+            with self._lock:
+                self._starting -= 1
+                self._skip(e.reason)
+            return None
+        except Exception:
+            with self._lock:
+                self._starting -= 1
+            raise
+        with self._lock:
+            self._starting -= 1
+            self._pending[key] = _Prefetch(key, job, client)
+            self.started += 1
+        PREFETCHES.inc(outcome='started', reason='')
+        logger.info("Prefetching %s as job %s", key, job.id)
+        return job
+
+    # Called by /download for the request's dedupe key: with the job it was attached to, or with job=None
+    # when the file came from the download cache. Returns True when that was a prefetch.
+    def claim(self, key, job=None):
+        with self._lock:
+            p = self._pending.get(key)
+            if p is None or (job is not None and job is not p.job):
+                return False
+            del self._pending[key]
+            state = 'finished' if p.job.status == 'finished' or job is None else 'running'
+            self.hits[state] = self.hits.get(state, 0) + 1
+        PREFETCHES.inc(outcome='hit', reason=state)
+        if job is not None:
+            # The claiming request holds its own subscription now; drop the prefetch's so that request's
+            # cancel really cancels the download
+            self.jobs.cancel(p.job.id, client=None)
+        logger.info("Prefetch %s claimed while %s", key, state)
+        return True
+
+    def _write_off(self, p, reason):
+        if p.job.status in ACTIVE_STATUSES:
+            self.jobs.cancel(p.job.id, client=None)
+        wasted_bytes = p.job.progress()[0]
+        with self._lock:
+            self.wasted[reason] = self.wasted.get(reason, 0) + 1
+            self.wasted_bytes += wasted_bytes
+        PREFETCHES.inc(outcome='wasted', reason=reason)
+        logger.info("Prefetch %s unused (%s), %s bytes", p.key, reason, wasted_bytes)
+
+    # Write off failed prefetches and those left unclaimed for unused_timeout seconds
+    def sweep(self):
+        cutoff = time.monotonic() - self.unused_timeout
+        expired = []
+        with self._lock:
+            for key, p in list(self._pending.items()):
+                if p.job.status in ('error', 'cancelled'):
+                    expired.append((p, 'failed'))
+                elif p.started_at < cutoff:
+                    expired.append((p, 'cancelled' if p.job.status in ACTIVE_STATUSES else 'unused'))
+                else:
+                    continue
+                del self._pending[key]
+        for p, reason in expired:
+            self._write_off(p, reason)
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Prefetch sweep failed: %s", e, exc_info=True)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='prefetch-sweep', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            wasted = sum(self.wasted.values())
+            resolved = hits + wasted
+            return {
+                'max_active': self.max_active,
+                'unused_timeout': self.unused_timeout,
+                'active': self._active(),
+                'pending': len(self._pending),
+                'started': self.started,
+                'skipped': dict(self.skipped),
+                'hits': dict(self.hits),
+                'wasted': dict(self.wasted),
+                'wasted_bytes': self.wasted_bytes,
+                # Over the prefetches that were claimed or written off; pending ones are not counted yet
+                'hit_ratio': round(hits / resolved, 3) if resolved else None,
+                'waste_ratio': round(wasted / resolved, 3) if resolved else None,
+            }
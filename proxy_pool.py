@@ -0,0 +1,248 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+
+# Raised by attempt functions; proxy_fault=False means the failure says nothing about the proxy (e.g. private video)
+class ProxyAttemptError(Exception):
+    def __init__(self, message, proxy_fault=True):
+        super().__init__(message)
+        self.proxy_fault = proxy_fault
+
+
+# Display name for a proxy URL without its credentials
+def proxy_label(proxy_url):
+    if not proxy_url:
+        return 'direct'
+    parsed = urlparse(proxy_url)
+    if parsed.hostname:
+        return f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+    return proxy_url
+
+
+class ProxyStats:
+    def __init__(self, proxy_url):
+        self.proxy_url = proxy_url
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.last_error = None
+        self.last_used = None
+
+    def success_rate(self):
+        # Laplace smoothing so unknown proxies start optimistic but not perfect
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def to_dict(self, now):
+        return {
+            'proxy': proxy_label(self.proxy_url),
+            'successes': self.successes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'success_rate': round(self.success_rate(), 3),
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'cooling_down': self.cooldown_until > now,
+            'cooldown_remaining': round(max(0.0, self.cooldown_until - now), 1),
+            'in_flight': self.in_flight,
+            'last_error': self.last_error,
+        }
+
+
+# Health-scored proxy pool. Proxies are ranked by success rate over latency EWMA, proxies that keep failing
+# are put in an exponential cooldown, and the direct connection (None) is only tried after the healthy proxies.
+# max_in_flight (0 = unlimited) caps concurrent attempts per upstream; further attempts wait for a free slot.
+class ProxyPool:
+    def __init__(self, proxies, include_direct=True, ewma_alpha=0.3, default_latency=2.0,
+                 cooldown=30.0, max_cooldown=600.0, max_workers=16, max_in_flight=0):
+        self.include_direct = include_direct
+        self.ewma_alpha = ewma_alpha
+        self.default_latency = default_latency
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_in_flight = max_in_flight
+        self._slots = {}  # proxy_url -> BoundedSemaphore, only when max_in_flight is set
+        self._stats = {p: ProxyStats(p) for p in proxies}
+        if include_direct:
+            self._stats[None] = ProxyStats(None)
+        self._lock = threading.Lock()
+        self._dirty = set()  # proxies whose health changed since the last export_health()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='proxy-race')
+
+    def _score(self, stats):
+        latency = stats.latency_ewma if stats.latency_ewma is not None else self.default_latency
+        # In-flight attempts count as extra latency so parallel workers spread over healthy proxies
+        return stats.success_rate() / (max(latency, 0.05) * (1 + stats.in_flight))
+
+    # All proxies ordered best first: healthy proxies by score, then the direct connection, then proxies
+    # still cooling down (soonest to recover first) as a last resort
+    def ranked(self):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [s for p, s in self._stats.items() if p is not None]
+            healthy = sorted((s for s in candidates if s.cooldown_until <= now), key=self._score, reverse=True)
+            cooling = sorted((s for s in candidates if s.cooldown_until > now), key=lambda s: s.cooldown_until)
+        ordered = [s.proxy_url for s in healthy]
+        if self.include_direct:
+            ordered.append(None)
+        return ordered + [s.proxy_url for s in cooling]
+
+    # Proxies not cooling down, best first, then the direct connection
+    def healthy(self):
+        now = time.monotonic()
+        with self._lock:
+            cooling = {p for p, s in self._stats.items() if s.cooldown_until > now}
+        return [p for p in self.ranked() if p not in cooling]
+
+    def _slot(self, proxy_url):
+        if not self.max_in_flight:
+            return None
+        with self._lock:
+            slot = self._slots.get(proxy_url)
+            if slot is None:
+                slot = self._slots[proxy_url] = threading.BoundedSemaphore(self.max_in_flight)
+            return slot
+
+    def _saturated(self, proxy_url):
+        if not self.max_in_flight:
+            return False
+        with self._lock:
+            stats = self._stats.get(proxy_url)
+            return stats is not None and stats.in_flight >= self.max_in_flight
+
+    def _begin(self, proxy_url):
+        with self._lock:
+            stats = self._stats.setdefault(proxy_url, ProxyStats(proxy_url))
+            stats.in_flight += 1
+            stats.last_used = time.time()
+
+    def _end(self, proxy_url):
+        with self._lock:
+            self._stats[proxy_url].in_flight -= 1
+
+    def record_success(self, proxy_url, latency=None):
+        with self._lock:
+            stats = self._stats.setdefault(proxy_url, ProxyStats(proxy_url))
+            stats.successes += 1
+            self._dirty.add(proxy_url)
+            stats.consecutive_failures = 0
+            stats.cooldown_until = 0.0
+            if latency is not None:
+                if stats.latency_ewma is None:
+                    stats.latency_ewma = latency
+                else:
+                    stats.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * stats.latency_ewma
+
+    def record_failure(self, proxy_url, error=None):
+        with self._lock:
+            stats = self._stats.setdefault(proxy_url, ProxyStats(proxy_url))
+            stats.failures += 1
+            self._dirty.add(proxy_url)
+            stats.consecutive_failures += 1
+            stats.last_error = str(error)[:200] if error else None
+            if proxy_url is not None:
+                backoff = min(self.cooldown * (2 ** (stats.consecutive_failures - 1)), self.max_cooldown)
+                stats.cooldown_until = time.monotonic() + backoff
+
+    # Run fn(proxy_url) and record the outcome. Exceptions propagate to the caller.
+    def attempt(self, proxy_url, fn, record_latency=True):
+        slot = self._slot(proxy_url)
+        if slot is not None:
+            slot.acquire()
+        self._begin(proxy_url)
+        started = time.monotonic()
+        try:
+            result = fn(proxy_url)
+        except ProxyAttemptError as e:
+            if e.proxy_fault:
+                self.record_failure(proxy_url, e)
+            raise
+        except Exception as e:
+            self.record_failure(proxy_url, e)
+            raise
+        finally:
+            self._end(proxy_url)
+            if slot is not None:
+                slot.release()
+        self.record_success(proxy_url, time.monotonic() - started if record_latency else None)
+        return result
+
+    # Try proxies in ranked order, keeping up to `width` attempts in flight. The first success wins; attempts
+    # that have not started yet are cancelled and results from attempts already running are discarded.
+    # Returns (result, proxy_url, last_error); result is None when every proxy failed.
+    def race(self, fn, width=1):
+        candidates = self.ranked()
+        last_error = None
+        if width <= 1:
+            for proxy_url in candidates:
+                try:
+                    return self.attempt(proxy_url, fn), proxy_url, None
+                except Exception as e:
+                    last_error = e
+            return None, None, last_error
+
+        pending = {}
+        remaining = list(candidates)
+        try:
+            while remaining or pending:
+                while remaining and len(pending) < width:
+                    # Skip upstreams that are at their in-flight cap while others still have room
+                    index = next((i for i, p in enumerate(remaining) if not self._saturated(p)), 0)
+                    proxy_url = remaining.pop(index)
+                    pending[self._executor.submit(self.attempt, proxy_url, fn)] = proxy_url
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    proxy_url = pending.pop(future)
+                    try:
+                        return future.result(), proxy_url, None
+                    except Exception as e:
+                        last_error = e
+        finally:
+            for future in pending:
+                future.cancel()
+        return None, None, last_error
+
+    # Health that changed since the last call, keyed by proxy_label (no credentials) with wall-clock cooldowns,
+    # for sharing with other processes through a MetadataStore
+    def export_health(self):
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return [{
+                'proxy': proxy_label(p),
+                'successes': s.successes,
+                'failures': s.failures,
+                'consecutive_failures': s.consecutive_failures,
+                'latency_ewma': s.latency_ewma,
+                'cooldown_until': wall + max(0.0, s.cooldown_until - now),
+                'last_error': s.last_error,
+            } for p, s in self._stats.items() if p in dirty]
+
+    # Adopt health exported by other processes (or before a restart): longer cooldowns always, counts and
+    # latency only for proxies this process has no experience with yet
+    def merge_health(self, rows):
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            by_label = {proxy_label(p): s for p, s in self._stats.items()}
+            for row in rows:
+                stats = by_label.get(row['proxy'])
+                if stats is None:
+                    continue
+                cooldown_until = now + (row['cooldown_until'] - wall)
+                if cooldown_until > stats.cooldown_until:
+                    stats.cooldown_until = cooldown_until
+                if not stats.successes and not stats.failures:
+                    stats.successes = row['successes']
+                    stats.failures = row['failures']
+                    stats.consecutive_failures = row['consecutive_failures']
+                    stats.last_error = row['last_error']
+                if stats.latency_ewma is None:
+                    stats.latency_ewma = row['latency_ewma']
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [self._stats[p].to_dict(now) for p in self._stats]
@@ -0,0 +1,196 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+
+def _key_hash(key):
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:32]
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# Coalesces concurrent calls with the same key: the first caller (the leader) runs fn, callers arriving while
+# it runs wait for its result (or its exception) instead of running fn themselves. Nothing is remembered once
+# the leader returns; caching results is the caller's business.
+# With lock_dir set, leaders in different processes (gunicorn workers) sharing that directory also take an
+# exclusive flock per key, so only one of them runs fn at a time; the others should find the first one's
+# result in a shared store once they get the lock (see SharedResultStore).
+# A follower that waited wait_timeout seconds gives up on the leader and runs fn itself.
+class SingleFlight:
+    def __init__(self, wait_timeout=120, lock_dir=None):
+        self.wait_timeout = wait_timeout
+        self.lock_dir = lock_dir
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.lock_waits = 0
+
+    # Returns (result, coalesced); coalesced is True when the result came from another caller's run
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with self._lock:
+                self.timeouts += 1
+            logger.warning("Gave up waiting %ss for the in-flight lookup of %s; running it separately", self.wait_timeout, key)
+            return fn(), False
+        try:
+            with self._process_lock(key):
+                call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    @contextmanager
+    def _process_lock(self, key):
+        if not self.lock_dir:
+            yield
+            return
+        path = os.path.join(self.lock_dir, f"{_key_hash(key)}.lock")
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning("Could not open single-flight lock %s: %s", path, e)
+            yield
+            return
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is running this lookup; wait for it (bounded, like in-process followers)
+                with self._lock:
+                    self.lock_waits += 1
+                deadline = time.monotonic() + self.wait_timeout
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            with self._lock:
+                                self.timeouts += 1
+                            break
+                        time.sleep(0.05)
+            # Marks the lock file as in use for SharedResultStore's pruning
+            os.utime(fd)
+            yield
+        finally:
+            # Closing the descriptor releases the flock; the lock file itself stays for the next lookup
+            os.close(fd)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(call.waiters for call in self._calls.values()),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'cross_process': bool(self.lock_dir),
+                'lock_waits': self.lock_waits,
+            }
+
+
+# JSON results in a local directory, readable by every worker process for ttl seconds. Lets a worker that
+# waited on another worker's single-flight lock pick up that worker's result.
+class SharedResultStore:
+    def __init__(self, folder, ttl=60):
+        self.folder = folder
+        self.ttl = ttl
+        os.makedirs(folder, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._last_prune = time.time()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{_key_hash(key)}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.misses += 1
+                return None
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # Guards against hash collisions
+        if record.get('key') != repr(key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record.get('value')
+
+    def put(self, key, value):
+        try:
+            atomic_write_json(self._path(key), {'key': repr(key), 'value': value})
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not store shared result for %s: %s", key, e)
+            return False
+        self._prune()
+        return True
+
+    # Drop expired results, and lock files not used for a day (at most once per ttl)
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < self.ttl:
+            return
+        self._last_prune = now
+        try:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    age = now - entry.stat().st_mtime
+                    if (entry.name.endswith('.json') and age > self.ttl) or (entry.name.endswith('.lock') and age > 86400):
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'folder': self.folder, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
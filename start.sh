@@ -1,2 +1,6 @@
 #!/bin/bash
+# SERVER_MODE=async serves the metadata endpoints from an asyncio event loop (see asgi.py)
+if [ "${SERVER_MODE}" = "async" ]; then
+    exec gunicorn --bind 0.0.0.0:${PORT:-5000} -k uvicorn.workers.UvicornWorker asgi:application
+fi
 exec gunicorn --bind 0.0.0.0:${PORT:-5000} app:app
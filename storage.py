@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Files named after a download key (see download_cache.download_cache_key): finished downloads and their
+# sidecars, but also yt-dlp's .part/.ytdl files, format fragments (.f137.mp4), merge temp files and sources
+# waiting for a transcode
+KEYED_RE = re.compile(r'^(?P<key>[0-9a-f]{24})\.')
+
+
+class StorageFull(Exception):
+    pass
+
+
+# Write a file next to its final name and rename it into place, so readers never see half a file
+def atomic_write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Lifecycle of UPLOAD_FOLDER on top of the DownloadCache index:
+#   - quota with watermarks: above high_watermark * quota_bytes, least recently used downloads are evicted
+#     until usage is back under low_watermark * quota_bytes
+#   - age: finished downloads not requested for max_age seconds are removed
+#   - orphans: leftovers of failed or interrupted downloads, temp files and anything else not belonging to the
+#     cache or to a running download are removed once they have not been modified for orphan_age seconds
+#   - admission: a new download reserves its expected size up front (reserve_bytes until yt-dlp knows the real
+#     size) and is refused with StorageFull when it would not fit, instead of failing halfway through
+# A background thread sweeps every sweep_interval seconds; protected_keys() returns the keys of downloads in
+# progress, whose files are never touched. A reservation is made before its download is queued, so a sweep
+# only drops unprotected reservations once they are reservation_grace seconds old.
+class StorageManager:
+    def __init__(self, folder, cache, quota_bytes, high_watermark=0.9, low_watermark=0.7, max_age=7 * 86400,
+                 orphan_age=3600, min_free_bytes=512 * 1024 * 1024, reserve_bytes=256 * 1024 * 1024,
+                 sweep_interval=300, protected_keys=set, reservation_grace=60):
+        self.folder = folder
+        self.cache = cache
+        self.quota_bytes = quota_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.max_age = max_age
+        self.orphan_age = orphan_age
+        self.min_free_bytes = min_free_bytes
+        self.reserve_bytes = reserve_bytes
+        self.sweep_interval = sweep_interval
+        self.protected_keys = protected_keys
+        self.reservation_grace = reservation_grace
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._reservations = {}  # download key -> bytes expected
+        self._reserved_at = {}  # download key -> time.monotonic() of admit()
+        self._untracked_bytes = 0  # partial and unknown files seen by the last scan
+        self._thread = None
+        self.last_sweep = None
+        self.swept_files = 0
+        self.swept_bytes = 0
+        self.expired = 0
+        self.refused = 0
+
+    @property
+    def high_bytes(self):
+        return int(self.quota_bytes * self.high_watermark)
+
+    @property
+    def low_bytes(self):
+        return int(self.quota_bytes * self.low_watermark)
+
+    def _disk_free(self):
+        try:
+            return shutil.disk_usage(self.folder).free
+        except OSError:
+            return None
+
+    def _projected(self, extra=0):
+        return self.cache.stats()['bytes'] + self._untracked_bytes + sum(self._reservations.values()) + extra
+
+    def _fits(self, extra):
+        if self._projected(extra) > self.high_bytes:
+            return False
+        free = self._disk_free()
+        return free is None or free - extra >= self.min_free_bytes
+
+    # Reserve room for a download before it is queued. Raises StorageFull when it does not fit even after a sweep.
+    def admit(self, key, expected_bytes=None):
+        needed = expected_bytes or self.reserve_bytes
+        with self._lock:
+            if key in self._reservations:
+                return
+            if self._fits(needed):
+                self._reserve(key, needed)
+                return
+        # Cached downloads give way to new ones: evict least recently used files to make room
+        self.sweep()
+        self.enforce_quota(room_for=needed)
+        with self._lock:
+            if not self._fits(needed):
+                self.refused += 1
+                raise StorageFull("The server is low on disk space. Please try again later.")
+            self._reserve(key, needed)
+
+    def _reserve(self, key, needed):
+        self._reservations[key] = needed
+        self._reserved_at[key] = time.monotonic()
+
+    # Called once the real size is known. Returns False when the larger size no longer fits.
+    def update_reservation(self, key, total_bytes):
+        with self._lock:
+            current = self._reservations.get(key)
+            if current is None or total_bytes <= current:
+                if current is not None:
+                    self._reservations[key] = total_bytes
+                return True
+            if not self._fits(total_bytes - current):
+                self.refused += 1
+                return False
+            self._reservations[key] = total_bytes
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._reservations.pop(key, None)
+            self._reserved_at.pop(key, None)
+
+    # A finished download is in the cache now: drop its reservation and get back under the watermark if needed
+    def after_store(self, key):
+        self.release(key)
+        with self._lock:
+            over = self._projected() > self.high_bytes
+        if over:
+            self.enforce_quota()
+
+    # Evict down to the low watermark, leaving room_for bytes more below the high watermark
+    def enforce_quota(self, room_for=0):
+        keep = self.protected_keys()
+        with self._lock:
+            target = min(self.low_bytes, self.high_bytes - room_for) - self._untracked_bytes - sum(self._reservations.values())
+        return self.cache.evict(keep=keep, target_bytes=max(target, 0))
+
+    def _scan(self):
+        try:
+            with os.scandir(self.folder) as it:
+                return [(e.name, e.stat()) for e in it if e.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            return []
+
+    # Remove orphans and expired downloads, then enforce the quota. Safe to call from any thread.
+    def sweep(self):
+        with self._sweep_lock:
+            started = time.time()
+            protected = self.protected_keys()
+            with self._lock:
+                # Reservations of jobs that were cancelled before they ever ran. Newer ones may belong to a
+                # download that is being queued right now.
+                cutoff = time.monotonic() - self.reservation_grace
+                for key in [k for k in self._reservations if k not in protected and self._reserved_at[k] < cutoff]:
+                    del self._reservations[key]
+                    del self._reserved_at[key]
+            files = self._scan()
+            # Finished downloads written by another worker process get indexed instead of deleted; files of
+            # downloads in progress here are not finished yet
+            for name, _ in files:
+                match = KEYED_RE.match(name)
+                if not (match and match.group('key') in protected) and not self.cache.owns(name):
+                    self.cache.adopt(name)
+            removed_files = removed_bytes = untracked = 0
+            for name, st in files:
+                match = KEYED_RE.match(name)
+                # Files of downloads in progress are covered by their reservation
+                if (match and match.group('key') in protected) or self.cache.owns(name):
+                    continue
+                if started - st.st_mtime < self.orphan_age:
+                    untracked += st.st_size
+                    continue
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning("Could not remove leftover file %s: %s", name, e)
+                    untracked += st.st_size
+                    continue
+                removed_files += 1
+                removed_bytes += st.st_size
+            with self._lock:
+                self._untracked_bytes = untracked
+            expired = self.cache.expire(self.max_age, keep=protected) if self.max_age else []
+            with self._lock:
+                over = self._projected() > self.high_bytes
+            evicted = self.enforce_quota() if over else []
+            with self._lock:
+                self.swept_files += removed_files
+                self.swept_bytes += removed_bytes
+                self.expired += len(expired)
+                self.last_sweep = {
+                    'at': started,
+                    'seconds': round(time.time() - started, 3),
+                    'removed_files': removed_files,
+                    'removed_bytes': removed_bytes,
+                    'expired': len(expired),
+                    'evicted': len(evicted),
+                }
+            if removed_files or expired or evicted:
+                logger.info("Storage sweep removed %s leftover files (%s bytes), %s expired and %s evicted downloads",
+                            removed_files, removed_bytes, len(expired), len(evicted))
+            return self.last_sweep
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Storage sweep failed: %s", e, exc_info=True)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        try:
+            disk = shutil.disk_usage(self.folder)
+            disk = {'total': disk.total, 'used': disk.used, 'free': disk.free}
+        except OSError:
+            disk = None
+        cache = self.cache.stats()
+        with self._lock:
+            reserved = sum(self._reservations.values())
+            return {
+                'quota_bytes': self.quota_bytes,
+                'high_watermark_bytes': self.high_bytes,
+                'low_watermark_bytes': self.low_bytes,
+                'min_free_bytes': self.min_free_bytes,
+                'cached_bytes': cache['bytes'],
+                'cached_files': cache['files'],
+                'untracked_bytes': self._untracked_bytes,
+                'reserved_bytes': reserved,
+                'reservations': len(self._reservations),
+                'used_bytes': cache['bytes'] + self._untracked_bytes,
+                'disk': disk,
+                'evictions': cache['evictions'],
+                'expired': self.expired,
+                'swept_files': self.swept_files,
+                'swept_bytes': self.swept_bytes,
+                'refused': self.refused,
+                'last_sweep': self.last_sweep,
+            }
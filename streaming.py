@@ -0,0 +1,154 @@
+import shutil
+import subprocess
+from urllib.parse import quote
+
+import requests
+
+
+class StreamError(Exception):
+    pass
+
+
+def _is_http(f):
+    return (f.get('protocol') or 'https') in ('http', 'https') and f.get('url')
+
+
+# Pick a single-file format that can be piped to the client as-is: a progressive (video+audio) format for
+# type=video, an audio-only format for type=audio (restricted to m4a or opus when audio_format asks for it).
+# Returns None when the video only offers split/DASH streams or no audio stream in the requested codec.
+def select_stream_format(info_dict, download_type, quality='best', audio_format=None):
+    formats = [f for f in info_dict.get('formats') or [] if _is_http(f)]
+    if download_type == 'audio':
+        candidates = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('vcodec') in (None, 'none')]
+        if audio_format == 'm4a':
+            candidates = [f for f in candidates if f.get('ext') == 'm4a' or (f.get('acodec') or '').startswith('mp4a')]
+        elif audio_format == 'opus':
+            candidates = [f for f in candidates if f.get('acodec') == 'opus']
+        # Prefer m4a/aac (plays everywhere), then by bitrate
+        return max(candidates, key=lambda f: (f.get('ext') == 'm4a', f.get('abr') or f.get('tbr') or 0), default=None)
+
+    max_height = None
+    if quality and quality != 'best' and quality.split('p')[0].isdigit():
+        max_height = int(quality.split('p')[0])
+    candidates = [
+        f for f in formats
+        if f.get('vcodec') not in (None, 'none') and f.get('acodec') not in (None, 'none')
+        and (max_height is None or (f.get('height') or 0) <= max_height)
+    ]
+    return max(candidates, key=lambda f: (f.get('height') or 0, f.get('ext') == 'mp4', f.get('tbr') or 0), default=None)
+
+
+# Content-Disposition with an ASCII fallback plus the RFC 5987 UTF-8 name
+def content_disposition(filename):
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _proxies(proxy_url):
+    return {'http': proxy_url, 'https': proxy_url} if proxy_url else None
+
+
+# Response body over a chunk generator whose cleanup also runs when the body is closed without ever being
+# iterated (the client went away before the first write): closing a generator that never started skips its
+# finally block. cleanup must be safe to call twice.
+class ClosingStream:
+    def __init__(self, chunks, cleanup):
+        self._chunks = chunks
+        self._cleanup = cleanup
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks.close()
+        self._cleanup()
+
+
+# Open the upstream format URL and return (response, ClosingStream). The connection is opened before the caller
+# builds its Response so upstream errors still surface as a normal error reply. The generator reads one chunk
+# per client write, so at most one chunk per stream is held in memory and a slow client slows the upstream read.
+def open_http_stream(fmt, proxy_url, chunk_size=64 * 1024, timeout=20):
+    try:
+        upstream = requests.get(
+            fmt['url'],
+            headers=fmt.get('http_headers') or {},
+            proxies=_proxies(proxy_url),
+            stream=True,
+            timeout=timeout,
+        )
+    except requests.RequestException as e:
+        raise StreamError(f"Could not connect to the media server: {str(e)}")
+    if upstream.status_code != 200:
+        upstream.close()
+        raise StreamError(f"Media server answered with status {upstream.status_code}")
+
+    def generate():
+        try:
+            for chunk in upstream.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+        finally:
+            upstream.close()
+
+    return upstream, ClosingStream(generate(), upstream.close)
+
+
+# Transcode a format URL to MP3 with FFmpeg reading from the network and writing to a pipe. Returns a
+# ClosingStream; the first chunk is read eagerly so FFmpeg start-up failures raise StreamError. The OS pipe
+# buffer bounds how far FFmpeg can run ahead of the client. on_close runs once FFmpeg has exited.
+def open_mp3_stream(fmt, proxy_url, chunk_size=64 * 1024, bitrate='192k', on_close=None):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise StreamError("FFmpeg is not installed on the server.")
+
+    headers = fmt.get('http_headers') or {}
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin']
+    if proxy_url:
+        cmd += ['-http_proxy', proxy_url]
+    if headers.get('User-Agent'):
+        cmd += ['-user_agent', headers['User-Agent']]
+    extra_headers = ''.join(f"{k}: {v}\r\n" for k, v in headers.items() if k.lower() != 'user-agent')
+    if extra_headers:
+        cmd += ['-headers', extra_headers]
+    cmd += ['-i', fmt['url'], '-vn', '-codec:a', 'libmp3lame', '-b:a', bitrate, '-f', 'mp3', 'pipe:1']
+
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    except OSError as e:
+        raise StreamError(f"FFmpeg could not be started: {str(e)}")
+    closed = []
+
+    # Client went away or the stream ended: make sure FFmpeg does not outlive the response
+    def cleanup():
+        if closed:
+            return
+        closed.append(True)
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+        process.wait()
+        if on_close:
+            on_close()
+
+    try:
+        first_chunk = process.stdout.read(chunk_size)
+        if not first_chunk:
+            stderr = process.stderr.read()
+            raise StreamError(f"FFmpeg failed to start the transcode: {stderr.decode('utf-8', 'replace').strip()[:300]}")
+    except BaseException:
+        cleanup()
+        raise
+
+    def generate():
+        try:
+            yield first_chunk
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            cleanup()
+
+    return ClosingStream(generate(), cleanup)
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its configuration and creates its folders at import time: give it a scratch directory, no
+# proxies, no SQLite store and no yt-dlp warm-up
+_workdir = tempfile.mkdtemp(prefix='freeytzone-tests-')
+os.chdir(_workdir)
+os.environ.update(PROXIES='', METADATA_STORE_PATH='', YDL_POOL_WARMUP='0', LOG_LEVEL='WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+def video_info(video_id):
+    return {
+        'id': video_id, 'title': f'Video {video_id}', 'uploader': 'Uploader', 'duration': 125, 'view_count': 1000,
+        'upload_date': '20200101', 'thumbnail': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg',
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        'formats': [
+            {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 360, 'url': 'https://media.example/18', 'filesize': 1000},
+            {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 1080, 'url': 'https://media.example/137', 'filesize': 5000},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'url': 'https://media.example/140', 'filesize': 300},
+            {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 160, 'url': 'https://media.example/251'},
+        ],
+    }
+
+
+# Replaces yt-dlp behind app.ydl_checkout with canned extractions and gives the test an empty metadata cache.
+# Returns the list of (url, proxy) extractions made.
+@pytest.fixture
+def fake_ydl(monkeypatch):
+    from contextlib import contextmanager
+
+    import app
+    from metadata_cache import MetadataCache, extract_youtube_id
+
+    monkeypatch.setattr(app, 'metadata_cache', MetadataCache())
+    extractions = []
+
+    class FakeYoutubeDL:
+        def __init__(self, proxy_url):
+            self.proxy_url = proxy_url
+
+        def extract_info(self, url, download=False):
+            extractions.append((url, self.proxy_url))
+            return video_info(extract_youtube_id(url) or 'dQw4w9WgXcQ')
+
+    @contextmanager
+    def checkout(proxy_url, cookies_str, profile, base_opts, overrides=None):
+        yield FakeYoutubeDL(proxy_url)
+
+    monkeypatch.setattr(app, 'ydl_checkout', checkout)
+    return extractions
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+import app
+from admission import FairLimiter, Rejected, client_identity
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_freed_slots_go_round_robin_between_clients():
+    limiter = FairLimiter('test', max_running=1)
+    limiter.acquire('holder')
+    order = []
+
+    def work(client, name):
+        limiter.acquire(client)
+        order.append(name)
+        limiter.release(client)
+
+    threads = []
+    for client, name in (('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1')):
+        threads.append(threading.Thread(target=work, args=(client, name)))
+        threads[-1].start()
+        while limiter.stats()['queued'] < len(threads):
+            time.sleep(0.01)
+    limiter.release('holder')
+    for t in threads:
+        t.join(10)
+    # b queued last but is not stuck behind all of a's requests
+    assert order == ['a1', 'b1', 'a2', 'a3']
+    assert limiter.stats()['running'] == 0
+
+
+def test_queues_are_bounded_per_client_overall_and_in_time():
+    limiter = FairLimiter('test', max_running=1, max_queued=2, max_queued_per_client=1, queue_timeout=0.5)
+    limiter.acquire('holder')
+    waiting = threading.Thread(target=lambda: pytest.raises(Rejected, limiter.acquire, 'a'))
+    waiting.start()
+    while limiter.stats()['queued'] < 1:
+        time.sleep(0.001)
+    with pytest.raises(Rejected) as e:
+        limiter.acquire('a')
+    assert (e.value.status, e.value.client) == (429, 'a')
+    waiting.join(10)
+    # The first one timed out waiting
+    assert limiter.stats()['rejected'] == {'client_limit': 1, 'timeout': 1}
+
+    limiter.max_queued = 0
+    with pytest.raises(Rejected) as e:
+        limiter.acquire('b')
+    assert e.value.status == 503
+    assert limiter.stats()['queued'] == 0
+
+
+def test_clients_are_told_apart_by_trusted_address_or_cookies():
+    assert client_identity('10.0.0.1', 'spoofed, 203.0.113.7', proxy_hops=0) == '10.0.0.1'
+    assert client_identity('10.0.0.1', 'spoofed, 203.0.113.7', proxy_hops=1) == '203.0.113.7'
+    assert client_identity('10.0.0.1', '203.0.113.7', proxy_hops=2) == '203.0.113.7'
+    by_cookies = client_identity('10.0.0.1', cookies_str=COOKIES, key='cookies')
+    assert by_cookies.startswith('cookies:') and COOKIES not in by_cookies
+    assert client_identity('10.0.0.1', key='cookies') == '10.0.0.1'
+
+
+def test_a_saturated_metadata_budget_answers_with_retry_after(monkeypatch, fake_ydl):
+    limiter = FairLimiter('metadata', max_running=1, max_queued=0, retry_after=7)
+    monkeypatch.setattr(app, 'metadata_admission', limiter)
+    limiter.acquire('someone-else')
+    response = app.app.test_client().post('/get_info', json={'url': 'https://youtu.be/MMMMMMMMM01', 'cookies': COOKIES})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+    assert fake_ydl == []
+    limiter.release('someone-else')
+    assert app.app.test_client().post('/get_info', json={'url': 'https://youtu.be/MMMMMMMMM01', 'cookies': COOKIES}).status_code == 200
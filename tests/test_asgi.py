@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+
+from flask import Response
+
+import app
+import asgi
+
+CONCURRENCY = 8
+
+# Every request to this route waits until CONCURRENCY of them are inside it at once, so it only succeeds
+# when the fallthrough really runs Flask requests in parallel
+_barrier = threading.Barrier(CONCURRENCY, timeout=10)
+
+
+@asgi.flask_app.route('/_test/barrier')
+def barrier_route():
+    _barrier.wait()
+    return {'thread': threading.get_ident()}
+
+
+@asgi.flask_app.route('/_test/chunks')
+def chunks_route():
+    return Response((b'x' * 1000 for _ in range(5)), headers={'Content-Length': '5000'})
+
+
+def http_scope(method, path):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 40000),
+        'server': ('testserver', 80),
+    }
+
+
+async def call(method, path, body=b''):
+    request_sent = asyncio.Event()
+    response_done = asyncio.Event()
+    messages = []
+
+    async def receive():
+        if not request_sent.is_set():
+            request_sent.set()
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await response_done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            response_done.set()
+
+    await asgi.application(http_scope(method, path), receive, send)
+    return messages
+
+
+def run_concurrently(method, path, count):
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(call(method, path) for _ in range(count))), 30)
+    return asyncio.run(main())
+
+
+def test_fallthrough_routes_run_in_parallel():
+    responses = run_concurrently('GET', '/_test/barrier', CONCURRENCY)
+    assert [messages[0]['status'] for messages in responses] == [200] * CONCURRENCY
+    threads = {b''.join(m.get('body', b'') for m in messages[1:]) for messages in responses}
+    assert len(threads) == CONCURRENCY
+
+
+def test_concurrent_fallthrough_requests_all_succeed():
+    for path in ('/ready', '/admission_stats', '/prefetch_stats'):
+        responses = run_concurrently('GET', path, 50)
+        assert [messages[0]['status'] for messages in responses] == [200] * 50
+
+
+def test_response_completes_with_its_last_byte():
+    messages = asyncio.run(call('GET', '/_test/chunks'))
+    bodies = messages[1:]
+    assert b''.join(m['body'] for m in bodies) == b'x' * 5000
+    assert [m.get('more_body') for m in bodies] == [True] * 4 + [False]
+
+
+def get_info_requests(count, video_id='EEEEEEEEE01'):
+    body = json.dumps({'url': f'https://youtu.be/{video_id}', 'cookies': '# Netscape HTTP Cookie File\n'}).encode()
+
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(call('POST', '/get_info', body) for _ in range(count))), 30)
+    return asyncio.run(main())
+
+
+def test_concurrent_lookups_of_one_video_share_an_extraction(fake_ydl):
+    responses = get_info_requests(CONCURRENCY)
+    assert [messages[0]['status'] for messages in responses] == [200] * CONCURRENCY
+    assert {json.loads(messages[1]['body'])['title'] for messages in responses} == {'Video EEEEEEEEE01'}
+    assert len(fake_ydl) == 1
+
+
+def test_lookups_beyond_the_pending_limit_are_turned_away(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def get_info_result(url, cookies_str):
+        started.set()
+        release.wait(10)
+        return {'title': 'Video'}, 200
+
+    monkeypatch.setattr(asgi, 'get_info_result', get_info_result)
+    monkeypatch.setattr(asgi, 'limiter', asgi.LookupLimiter(max_running=1, max_pending=1))
+
+    async def main():
+        first = asyncio.ensure_future(call('POST', '/get_info', b'{}'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+        second = await call('POST', '/get_info', b'{}')
+        release.set()
+        return await first, second
+
+    first, second = asyncio.run(main())
+    assert first[0]['status'] == 200
+    assert second[0]['status'] == 503
+    assert (b'retry-after', b'5') in second[0]['headers']
+    assert asgi.limiter.stats()['rejected'] == 1
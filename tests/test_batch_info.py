@@ -0,0 +1,68 @@
+import json
+from contextlib import contextmanager
+
+import app
+from conftest import video_info
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+PLAYLIST = 'https://www.youtube.com/playlist?list=PL0000000000'
+
+
+def read_lines(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return sorted((json.loads(line) for line in response.data.decode().splitlines()), key=lambda item: item['index'])
+
+
+def test_each_url_gets_a_line_tagged_with_its_index(fake_ydl):
+    urls = [f'https://youtu.be/BBBBBBBBB0{i}' for i in range(3)]
+    response = app.app.test_client().post('/get_info_batch', json={'urls': urls, 'cookies': COOKIES})
+    items = read_lines(response)
+    assert [(item['index'], item['url'], item['title']) for item in items] == [
+        (i, url, f'Video BBBBBBBBB0{i}') for i, url in enumerate(urls)]
+    assert sorted(url for url, _ in fake_ydl) == urls
+
+
+def test_a_failing_item_does_not_fail_the_batch(monkeypatch, fake_ydl):
+    @contextmanager
+    def checkout(proxy_url, cookies_str, profile, base_opts, overrides=None):
+        class FakeYoutubeDL:
+            def extract_info(self, url, download=False):
+                return None if url.endswith('BAD') else video_info('BBBBBBBBB10')
+        yield FakeYoutubeDL()
+
+    monkeypatch.setattr(app, 'ydl_checkout', checkout)
+    urls = ['https://youtu.be/BBBBBBBBB10', 'https://example.com/BAD']
+    items = read_lines(app.app.test_client().post('/get_info_batch', json={'urls': urls, 'cookies': COOKIES}))
+    assert items[0]['title'] == 'Video BBBBBBBBB10'
+    assert items[1]['error'].startswith('Could not retrieve video information')
+
+
+def test_a_playlist_is_expanded_into_its_videos(monkeypatch, fake_ydl):
+    @contextmanager
+    def checkout(proxy_url, cookies_str, profile, base_opts, overrides=None):
+        class FakeYoutubeDL:
+            def extract_info(self, url, download=False):
+                if url == PLAYLIST:
+                    return {'_type': 'playlist', 'entries': [{'id': 'BBBBBBBBB20', 'url': 'BBBBBBBBB20'}, None,
+                                                             {'url': 'https://www.youtube.com/watch?v=BBBBBBBBB21'}]}
+                return video_info(url[-11:])
+        yield FakeYoutubeDL()
+
+    monkeypatch.setattr(app, 'ydl_checkout', checkout)
+    items = read_lines(app.app.test_client().post('/get_info_batch', json={'playlist': PLAYLIST, 'cookies': COOKIES}))
+    assert [(item['url'], item['title']) for item in items] == [
+        ('https://www.youtube.com/watch?v=BBBBBBBBB20', 'Video BBBBBBBBB20'),
+        ('https://www.youtube.com/watch?v=BBBBBBBBB21', 'Video BBBBBBBBB21'),
+    ]
+
+
+def test_invalid_batches_are_rejected(monkeypatch):
+    monkeypatch.setitem(app.app.config, 'BATCH_MAX_ITEMS', 2)
+    client = app.app.test_client()
+    assert client.post('/get_info_batch', json={'urls': ['https://youtu.be/x']}).status_code == 400
+    assert client.post('/get_info_batch', json={'urls': 'https://youtu.be/x', 'cookies': COOKIES}).status_code == 400
+    assert client.post('/get_info_batch', json={'cookies': COOKIES}).status_code == 400
+    response = client.post('/get_info_batch', json={'urls': ['https://youtu.be/x'] * 3, 'cookies': COOKIES})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'At most 2 URLs can be looked up in one batch'}
@@ -0,0 +1,53 @@
+import logging
+
+import requests
+import yt_dlp
+
+from bench.fake_upstream import FakeProxy, FakeUpstream
+
+
+def test_media_is_served_in_ranges_through_the_proxy():
+    upstream = FakeUpstream(media_bytes=4096).start()
+    proxy = FakeProxy(latency=0).start()
+    try:
+        url = f'{upstream.address}/media/IIIIIIIII01/720.mp4'
+        whole = requests.get(url, proxies={'http': proxy.address}, timeout=10)
+        assert whole.status_code == 200
+        assert len(whole.content) == upstream.media_size(720) == 4096
+        part = requests.get(url, headers={'Range': 'bytes=100-199'}, proxies={'http': proxy.address}, timeout=10)
+        assert part.status_code == 206
+        assert part.content == whole.content[100:200]
+        assert proxy.stats()['forwarded'] == 2
+    finally:
+        proxy.stop()
+        upstream.stop()
+
+
+def test_a_failing_proxy_never_reaches_the_upstream():
+    upstream = FakeUpstream().start()
+    proxy = FakeProxy(latency=0, failure_rate=1, seed=1).start()
+    try:
+        for _ in range(4):
+            try:
+                response = requests.get(f'{upstream.address}/thumb/IIIIIIIII02.jpg', proxies={'http': proxy.address}, timeout=10)
+            except requests.ConnectionError:
+                continue
+            assert response.status_code == 502
+        assert proxy.stats()['failed'] == 4
+        assert upstream.stats()['requests'] == 0
+    finally:
+        proxy.stop()
+        upstream.stop()
+
+
+def test_yt_dlp_extracts_the_watch_page():
+    upstream = FakeUpstream().start()
+    try:
+        with yt_dlp.YoutubeDL({'quiet': True, 'logger': logging.getLogger('yt_dlp')}) as ydl:
+            info = ydl.extract_info(upstream.watch_url('IIIIIIIII03'), download=False)
+        # The generic extractor numbers the page's <video> elements
+        assert info['title'] == 'Benchmark video IIIIIIIII03 (1)'
+        assert sorted(f['height'] for f in info['formats']) == [360, 720]
+        assert all(f['acodec'] != 'none' for f in info['formats'])
+    finally:
+        upstream.stop()
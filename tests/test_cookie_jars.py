@@ -0,0 +1,53 @@
+import http.cookiejar
+import os
+import time
+
+import pytest
+
+import app
+from cookie_jars import CookieJarCache, cookie_identity
+from ydl_pool import YoutubeDLPool
+
+EXPIRES = int(time.time()) + 86400
+COOKIES = ('# Netscape HTTP Cookie File\n'
+           f'.youtube.com\tTRUE\t/\tTRUE\t{EXPIRES}\tSID\tsecret\n'
+           f'.youtube.com\tTRUE\t/\tFALSE\t{EXPIRES}\tPREF\thl=en\n')
+
+
+def test_cookies_are_parsed_once_and_every_caller_gets_its_own_jar():
+    cache = CookieJarCache()
+    first = cache.jar(COOKIES)
+    assert sorted(c.name for c in first) == ['PREF', 'SID']
+    first.clear('.youtube.com', '/', 'SID')
+    second = cache.jar(COOKIES)
+    assert sorted(c.name for c in second) == ['PREF', 'SID']
+    assert second is not first
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.jar('') is None
+
+
+def test_entries_expire_and_the_least_recently_used_are_dropped():
+    cache = CookieJarCache(ttl=0, max_entries=1)
+    cache.jar(COOKIES)
+    cache.jar(COOKIES)
+    assert cache.stats()['misses'] == 2
+    cache.jar(COOKIES.replace('hl=en', 'hl=de'))
+    assert cache.stats()['entries'] == 1
+
+
+def test_malformed_cookies_are_rejected():
+    with pytest.raises(http.cookiejar.LoadError):
+        CookieJarCache().jar('not a cookies file')
+
+
+def test_checked_out_instances_get_the_jar_without_a_cookie_file(monkeypatch):
+    monkeypatch.setattr(app, 'ydl_pool', YoutubeDLPool())
+    before = set(os.listdir('.'))
+    with app.ydl_checkout(None, COOKIES, 'info', {'quiet': True}) as ydl:
+        assert sorted(c.name for c in ydl.cookiejar) == ['PREF', 'SID']
+        assert 'cookiefile' not in ydl.params
+    assert set(os.listdir('.')) == before
+    # The pool key carries a hash of the cookies, never the cookies themselves
+    [key] = app.ydl_pool._idle
+    assert key == (None, cookie_identity(COOKIES), 'info')
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import app
+from download_cache import DownloadCache, download_cache_key
+from download_jobs import DownloadJobManager
+from metadata_cache import normalize_video_key
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_the_key_covers_everything_that_changes_the_output():
+    video = normalize_video_key('https://youtu.be/dQw4w9WgXcQ')
+    assert video == normalize_video_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42')
+    mp3 = download_cache_key(video, *app.build_download_format('audio', 'best', audio_format='mp3'))
+    assert mp3 == download_cache_key(video, *app.build_download_format('audio', 'best', audio_format='mp3'))
+    assert mp3 != download_cache_key(video, *app.build_download_format('audio', 'best', audio_format='opus'))
+    assert mp3 != download_cache_key(video, 'bestaudio/best')
+    assert download_cache_key(video, *app.build_download_format('video', '720p')) != download_cache_key(video, *app.build_download_format('video', '1080p'))
+
+
+def test_the_index_survives_a_restart_and_evicts_least_recently_used(tmp_path):
+    cache = DownloadCache(str(tmp_path), max_bytes=250)
+    for key in ('a' * 24, 'b' * 24, 'c' * 24):
+        path = tmp_path / f'{key}.mp4'
+        path.write_bytes(b'x' * 100)
+        cache.store(key, str(path), f'Title {key[0]}')
+        time.sleep(0.01)
+
+    reloaded = DownloadCache(str(tmp_path), max_bytes=250)
+    assert reloaded.lookup('a' * 24).title == 'Title a'
+    removed = reloaded.evict(keep={'b' * 24})
+    assert [e.key for e in removed] == ['c' * 24]
+    assert not os.path.exists(tmp_path / f"{'c' * 24}.mp4")
+    assert not os.path.exists(tmp_path / f"{'c' * 24}.meta.json")
+    assert reloaded.stats()['files'] == 2
+
+
+def test_identical_downloads_share_one_job_and_later_ones_hit_the_cache(monkeypatch):
+    monkeypatch.setattr(app, 'download_jobs', DownloadJobManager(max_workers=2))
+    release = threading.Event()
+    runs = []
+
+    def run_download(job, url, cookies_str, cache_key, *args, **kwargs):
+        runs.append(cache_key)
+        release.wait(10)
+        path = os.path.join(app.app.config['UPLOAD_FOLDER'], f'{cache_key}.m4a')
+        with open(path, 'wb') as f:
+            f.write(b'audio')
+        app.download_cache.store(cache_key, path, 'Video')
+        app.storage.after_store(cache_key)
+        return os.path.basename(path)
+
+    monkeypatch.setattr(app, 'run_download', run_download)
+    client = app.app.test_client()
+    request = {'url': 'https://youtu.be/CCCCCCCCC01', 'cookies': COOKIES, 'type': 'audio', 'audio_format': 'm4a'}
+    first = client.post('/download', json=request)
+    second = client.post('/download', json=dict(request, url='https://www.youtube.com/watch?v=CCCCCCCCC01'))
+    assert first.status_code == second.status_code == 202
+    assert first.get_json()['job_id'] == second.get_json()['job_id']
+
+    release.set()
+    job = app.download_jobs.get(first.get_json()['job_id'])
+    deadline = time.monotonic() + 10
+    while job.status != 'finished' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.status == 'finished'
+
+    cached = client.post('/download', json=request)
+    assert cached.status_code == 200
+    assert cached.get_json()['status'] == 'finished'
+    assert cached.get_json()['filename'] == job.filename
+    assert len(runs) == 1
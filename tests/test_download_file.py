@@ -0,0 +1,58 @@
+import os
+
+import app
+
+KEY = 'ab' * 12
+BODY = bytes(range(256)) * 40
+
+
+def cached_file(title='My Video: part 1'):
+    path = os.path.join(app.app.config['UPLOAD_FOLDER'], f'{KEY}.mp4')
+    with open(path, 'wb') as f:
+        f.write(BODY)
+    app.download_cache.store(KEY, path, title)
+    return os.path.basename(path)
+
+
+def test_ranges_are_served_partially():
+    filename = cached_file()
+    client = app.app.test_client()
+    response = client.get(f'/download_file/{filename}', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == BODY[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(BODY)}'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    response = client.get(f'/download_file/{filename}', headers={'Range': f'bytes={len(BODY)}-'})
+    assert response.status_code == 416
+
+
+def test_revalidation_with_the_etag_is_answered_without_a_body():
+    filename = cached_file()
+    client = app.app.test_client()
+    first = client.get(f'/download_file/{filename}')
+    assert first.status_code == 200
+    assert first.data == BODY
+    etag = first.headers['ETag']
+
+    again = client.get(f'/download_file/{filename}', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    # A stale validator on a range request gets the whole, current file
+    stale = client.get(f'/download_file/{filename}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == BODY
+
+
+def test_cached_files_are_named_after_the_video_title():
+    filename = cached_file()
+    client = app.app.test_client()
+    attachment = client.get(f'/download_file/{filename}').headers['Content-Disposition']
+    assert attachment == 'attachment; filename="My Video_ part 1.mp4"'
+    assert client.get(f'/download_file/{filename}?inline=1').headers['Content-Disposition'].startswith('inline;')
+
+
+def test_missing_files_and_paths_outside_the_folder_are_not_found():
+    client = app.app.test_client()
+    assert client.get('/download_file/missing.mp4').status_code == 404
+    assert client.get('/download_file/../app.py').status_code == 404
@@ -0,0 +1,68 @@
+import threading
+
+from download_jobs import DownloadJobManager, SharedJob
+
+
+def blocking_job(release):
+    def fn(job):
+        release.wait(10)
+        return 'file.mp4'
+    return fn
+
+
+def test_repeated_cancels_from_one_client_leave_a_shared_job_running():
+    jobs = DownloadJobManager(max_workers=1)
+    release = threading.Event()
+    try:
+        job = jobs.submit(blocking_job(release), dedupe_key='key', client='a')
+        assert jobs.submit(blocking_job(release), dedupe_key='key', client='b') is job
+        jobs.cancel(job.id, 'a')
+        jobs.cancel(job.id, 'a')
+        assert not job.cancelled
+        jobs.cancel(job.id, 'b')
+        assert job.cancelled
+    finally:
+        release.set()
+
+
+def test_cancel_from_a_client_not_subscribed_is_ignored():
+    jobs = DownloadJobManager(max_workers=1)
+    release = threading.Event()
+    try:
+        job = jobs.submit(blocking_job(release), dedupe_key='key', client='a')
+        jobs.cancel(job.id, 'b')
+        assert not job.cancelled
+        jobs.cancel(job.id, 'a')
+        assert job.cancelled
+    finally:
+        release.set()
+
+
+def test_another_worker_sees_the_job_and_its_cancel_reaches_the_owner(tmp_path):
+    # Two managers sharing a directory stand in for two gunicorn workers
+    owner = DownloadJobManager(max_workers=1, shared_dir=str(tmp_path))
+    other = DownloadJobManager(max_workers=1, shared_dir=str(tmp_path))
+    release = threading.Event()
+    try:
+        job = owner.submit(blocking_job(release), dedupe_key='key', client='a', url='https://youtu.be/x')
+        seen = other.get(job.id)
+        assert isinstance(seen, SharedJob)
+        assert seen.to_dict()['url'] == 'https://youtu.be/x'
+
+        other.cancel(job.id, 'b')  # not subscribed: ignored by the owner
+        owner.sync()
+        assert not job.cancelled
+        other.cancel(job.id, 'a')
+        owner.sync()
+        assert job.cancelled
+    finally:
+        release.set()
+
+
+def test_finished_jobs_are_published(tmp_path):
+    owner = DownloadJobManager(max_workers=1, shared_dir=str(tmp_path))
+    other = DownloadJobManager(max_workers=1, shared_dir=str(tmp_path))
+    job = owner.add_finished('file.mp4', url='https://youtu.be/x')
+    assert other.get(job.id).to_dict()['status'] == 'finished'
+    assert other.get('../' + job.id) is None
+    assert other.get('0' * 32) is None
@@ -0,0 +1,46 @@
+import app
+from conftest import video_info
+from format_index import FORMAT_ID_RE, build_format_index, find_index_entry
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_the_index_names_exact_formats_per_quality():
+    index = build_format_index(video_info('FFFFFFFFF01')['formats'])
+    # mp4 video-only streams get no label of their own, as in the original quality list
+    assert index['qualities'] == ['360p']
+    assert [(e['quality'], e['format_id'], e['ext'], e['needs_mux']) for e in index['video']] == [
+        ('1080p', '137+140', 'mp4', True),  # m4a merges into mp4; the better opus stream would force mkv
+        ('360p', '18', 'mp4', False),
+    ]
+    assert index['video'][0]['filesize'] == 5300
+    assert [(e['format_id'], e['needs_transcode']) for e in index['audio']] == [('251', True), ('140', True)]
+    assert find_index_entry(index, '137+140')['height'] == 1080
+    assert find_index_entry(index, '251')['acodec'] == 'opus'
+    assert find_index_entry(index, '999') is None
+
+
+def test_videos_without_labelled_formats_fall_back_to_heights():
+    formats = [{'format_id': '22', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none'}]
+    assert build_format_index(formats)['qualities'] == ['Best Video']
+    formats = [{'format_id': '303', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720}]
+    assert build_format_index(formats)['qualities'] == ['720p']
+
+
+def test_format_ids_are_validated():
+    assert FORMAT_ID_RE.match('137+140')
+    assert FORMAT_ID_RE.match('hls-1080p')
+    assert not FORMAT_ID_RE.match('best[height<=720]')
+    assert not FORMAT_ID_RE.match('137+140+251')
+
+
+def test_get_info_serves_the_index_and_download_takes_its_format_ids(fake_ydl):
+    client = app.app.test_client()
+    body = client.post('/get_info', json={'url': 'https://youtu.be/FFFFFFFFF02', 'cookies': COOKIES}).get_json()
+    assert body['qualities'] == ['360p']
+    assert body['format_index']['video'][0]['format_id'] == '137+140'
+
+    assert app.build_download_format('video', '1080p', '137+140')[0] == '137+140'
+    response = client.post('/download', json={'url': 'https://youtu.be/FFFFFFFFF02', 'cookies': COOKIES, 'format_id': 'best[height<=720]'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid format_id'}
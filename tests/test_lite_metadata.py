@@ -0,0 +1,81 @@
+import app
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append(params['url'])
+        return self.response
+
+
+def test_youtube_titles_come_from_oembed_without_an_extraction(monkeypatch, fake_ydl):
+    session = FakeSession(FakeResponse(200, {'title': 'From oEmbed', 'author_name': 'Channel'}))
+    monkeypatch.setattr(app, 'http_session', session)
+    info, error = app.fetch_lite_info('https://youtu.be/GGGGGGGGG01', COOKIES)
+    assert error is None
+    assert info['title'] == 'From oEmbed'
+    assert info['uploader'] == 'Channel'
+    assert info['thumbnail'] == 'https://i.ytimg.com/vi/GGGGGGGGG01/hqdefault.jpg'
+    # Cached under the video key, whatever the URL looks like
+    assert app.fetch_lite_info('https://www.youtube.com/watch?v=GGGGGGGGG01', COOKIES)[0] == info
+    assert session.requests == ['https://www.youtube.com/watch?v=GGGGGGGGG01']
+    assert fake_ydl == []
+
+
+def test_a_cached_full_extraction_is_used_first(monkeypatch, fake_ydl):
+    session = FakeSession(FakeResponse(200, {'title': 'From oEmbed'}))
+    monkeypatch.setattr(app, 'http_session', session)
+    app.fetch_video_info('https://youtu.be/GGGGGGGGG02', COOKIES)
+    info, _ = app.fetch_lite_info('https://youtu.be/GGGGGGGGG02', COOKIES)
+    assert info['title'] == 'Video GGGGGGGGG02'
+    assert session.requests == []
+    assert len(fake_ydl) == 1
+
+
+def test_videos_oembed_cannot_see_fall_back_to_a_full_extraction(monkeypatch, fake_ydl):
+    monkeypatch.setattr(app, 'http_session', FakeSession(FakeResponse(401)))
+    info, error = app.fetch_lite_info('https://youtu.be/GGGGGGGGG03', COOKIES)
+    assert error is None
+    assert info['title'] == 'Video GGGGGGGGG03'
+    assert fake_ydl == [('https://youtu.be/GGGGGGGGG03', None)]
+
+
+def test_get_thumbnail_does_not_resolve_formats(monkeypatch, fake_ydl):
+    monkeypatch.setattr(app, 'http_session', FakeSession(FakeResponse(200, {'title': 'From oEmbed'})))
+    served = []
+
+    class Thumbnail:
+        path = 'thumbnail.jpg'
+        content_type = 'image/jpeg'
+
+    def get(key, url):
+        served.append((key, url))
+        with open(Thumbnail.path, 'wb') as f:
+            f.write(b'jpeg')
+        return Thumbnail
+
+    monkeypatch.setattr(app.thumbnail_cache, 'get', get)
+    response = app.app.test_client().post('/get_thumbnail', json={'url': 'https://youtu.be/GGGGGGGGG04', 'cookies': COOKIES})
+    assert response.status_code == 200
+    assert served == [('youtube:GGGGGGGGG04', 'https://i.ytimg.com/vi/GGGGGGGGG04/hqdefault.jpg')]
+    assert fake_ydl == []
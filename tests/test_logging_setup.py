@@ -0,0 +1,56 @@
+import json
+import logging
+import queue
+
+import metrics
+from logging_setup import JsonFormatter, NonBlockingQueueHandler, RouteFilter, SamplingFilter, _level
+
+
+def record(msg, *args, level=logging.INFO, name='app'):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_repetitive_info_is_sampled_and_warnings_are_not():
+    sampler = SamplingFilter(burst=2, rate=3, window=60)
+    kept = [i for i in range(1, 11) if sampler.filter(record('Fetched %s', i))]
+    assert kept == [1, 2, 5, 8]
+    assert sampler.suppressed == 6
+    # The next record let through says how many were dropped before it
+    later = record('Fetched %s', 11)
+    assert sampler.filter(later)
+    assert later.sampled_out == 2
+    assert all(sampler.filter(record('Proxy %s failed', i, level=logging.WARNING)) for i in range(50))
+    assert sampler.filter(record('Other template'))
+
+
+def test_the_queue_handler_never_blocks_and_merges_messages_up_front():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    args = {'state': 'queued'}
+    handler.handle(record('Job %(state)s', args))
+    args['state'] = 'changed'
+    handler.handle(record('Dropped'))
+    assert handler.dropped == 1
+    queued = handler.queue.get_nowait()
+    assert (queued.msg, queued.args) == ('Job queued', None)
+
+
+def test_json_lines_carry_the_route_and_extra_fields():
+    entry = record('Served %s', 'file.mp4')
+    entry.job_id = 'abc'
+    metrics.set_route('/download_file/<path:filename>')
+    try:
+        RouteFilter().filter(entry)
+    finally:
+        metrics.set_route(None)
+    line = json.loads(JsonFormatter().format(entry))
+    assert line['msg'] == 'Served file.mp4'
+    assert line['level'] == 'INFO'
+    assert line['route'] == '/download_file/<path:filename>'
+    assert line['job_id'] == 'abc'
+
+
+def test_levels_are_read_by_name_or_number():
+    assert _level('debug', logging.INFO) == logging.DEBUG
+    assert _level('15', logging.INFO) == 15
+    assert _level('', logging.WARNING) == logging.WARNING
+    assert _level('chatty', logging.WARNING) == logging.WARNING
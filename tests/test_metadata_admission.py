@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+import app
+from admission import FairLimiter, Rejected, set_client
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def test_only_the_single_flight_leader_takes_an_admission_slot(monkeypatch):
+    # One slot and one queue place: if every caller took a slot, most of them would be turned away
+    limiter = FairLimiter('metadata', max_running=1, max_queued=1, queue_timeout=1)
+    monkeypatch.setattr(app, 'metadata_admission', limiter)
+    started = threading.Event()
+    release = threading.Event()
+    extractions = []
+
+    def extract(url, cookies_str, cache_key):
+        extractions.append(url)
+        started.set()
+        release.wait(10)
+        return {'id': 'dQw4w9WgXcQ'}, None, None
+
+    monkeypatch.setattr(app, 'extract_video_info', extract)
+    results = []
+
+    def lookup():
+        set_client('client-a')
+        results.append(app.fetch_video_info(URL, None))
+
+    leader = threading.Thread(target=lookup)
+    leader.start()
+    assert started.wait(10)
+    followers = [threading.Thread(target=lookup) for _ in range(4)]
+    for t in followers:
+        t.start()
+    while app.metadata_flight.stats()['waiting'] < len(followers):
+        time.sleep(0.01)
+    assert limiter.stats()['running'] == 1
+    assert limiter.stats()['queued'] == 0
+    release.set()
+    for t in [leader] + followers:
+        t.join(10)
+
+    assert len(extractions) == 1
+    assert [info for info, _, _ in results] == [{'id': 'dQw4w9WgXcQ'}] * 5
+    assert limiter.stats()['admitted'] == 1
+    assert limiter.stats()['running'] == 0
+
+
+class GatedLimiter(FairLimiter):
+    # Lets client-a's leader ask for its slot only once another lookup joined it
+    def acquire(self, client):
+        if client == 'client-a':
+            while app.metadata_flight.stats()['waiting'] < 1:
+                time.sleep(0.01)
+        super().acquire(client)
+
+
+def test_a_leader_over_its_share_does_not_turn_away_other_clients(monkeypatch):
+    limiter = GatedLimiter('metadata', max_running=4, max_per_client=1, max_queued_per_client=1, queue_timeout=1)
+    monkeypatch.setattr(app, 'metadata_admission', limiter)
+    extractions = []
+
+    def extract(url, cookies_str, cache_key):
+        extractions.append(app.current_client())
+        return {'id': 'dQw4w9WgXcQ'}, None, None
+
+    monkeypatch.setattr(app, 'extract_video_info', extract)
+    # client-a already has one extraction running and one queued
+    FairLimiter.acquire(limiter, 'client-a')
+    queued = threading.Thread(target=lambda: pytest.raises(Rejected, FairLimiter.acquire, limiter, 'client-a'))
+    queued.start()
+    while limiter.stats()['queued'] < 1:
+        time.sleep(0.01)
+    outcomes = {}
+
+    def lookup(client):
+        set_client(client)
+        try:
+            outcomes[client] = app.fetch_video_info(URL, None)[0]
+        except Rejected as e:
+            outcomes[client] = e.status
+
+    leader = threading.Thread(target=lookup, args=('client-a',))
+    leader.start()
+    while app.metadata_flight.stats()['in_flight'] < 1:
+        time.sleep(0.01)
+    follower = threading.Thread(target=lookup, args=('client-b',))
+    follower.start()
+    for t in (leader, follower, queued):
+        t.join(10)
+    limiter.release('client-a')
+
+    assert outcomes == {'client-a': 429, 'client-b': {'id': 'dQw4w9WgXcQ'}}
+    assert extractions == ['client-b']
+
+
+def test_try_slot_turns_away_instead_of_queueing():
+    limiter = FairLimiter('stream', max_running=2, max_per_client=1)
+    release = limiter.try_slot('client-a')
+    with pytest.raises(Rejected) as e:
+        limiter.try_slot('client-a')
+    assert e.value.status == 429
+    release_b = limiter.try_slot('client-b')
+    with pytest.raises(Rejected) as e:
+        limiter.try_slot('client-c')
+    assert e.value.status == 503
+    release()
+    release()
+    release_b()
+    assert limiter.stats()['running'] == 0
+    assert limiter.stats()['queued'] == 0
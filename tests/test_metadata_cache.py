@@ -0,0 +1,59 @@
+import time
+
+import app
+from metadata_cache import MetadataCache, normalize_video_key
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_url_shapes_of_one_video_share_a_key():
+    keys = {normalize_video_key(url) for url in (
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42',
+        'https://youtu.be/dQw4w9WgXcQ',
+        'youtube.com/shorts/dQw4w9WgXcQ',
+        'https://m.youtube.com/embed/dQw4w9WgXcQ',
+        'dQw4w9WgXcQ',
+    )}
+    assert keys == {'youtube:dQw4w9WgXcQ'}
+    assert normalize_video_key(' https://vimeo.com/1 ') == 'url:https://vimeo.com/1'
+
+
+def test_entries_expire_and_are_evicted_least_recently_used_first():
+    cache = MetadataCache(ttl=0.05, max_entries=2)
+    cache.set('a', {'id': 'a'})
+    cache.set('b', {'id': 'b'})
+    cache.get('a')
+    cache.set('c', {'id': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a').info == {'id': 'a'}
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_are_bounded_by_bytes():
+    cache = MetadataCache(max_bytes=100)
+    cache.set('big', {'blob': 'x' * 200})
+    assert cache.get('big') is None
+    cache.set('a', {'blob': 'x' * 40})
+    cache.set('b', {'blob': 'x' * 40})
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] <= 100
+
+
+def test_routes_share_one_extraction_per_video(fake_ydl):
+    client = app.app.test_client()
+    first = client.post('/get_info', json={'url': 'https://youtu.be/AAAAAAAAA01', 'cookies': COOKIES})
+    again = client.post('/get_info', json={'url': 'https://www.youtube.com/watch?v=AAAAAAAAA01', 'cookies': COOKIES})
+    info, _, _ = app.fetch_video_info('AAAAAAAAA01', COOKIES)
+    assert first.status_code == again.status_code == 200
+    assert first.json == again.json
+    assert info['title'] == 'Video AAAAAAAAA01'
+    assert len(fake_ydl) == 1
+
+
+def test_invalidated_video_is_extracted_again(fake_ydl):
+    app.fetch_video_info('https://youtu.be/AAAAAAAAA02', COOKIES)
+    app.metadata_cache.invalidate('youtube:AAAAAAAAA02')
+    app.fetch_video_info('https://youtu.be/AAAAAAAAA02', COOKIES)
+    assert len(fake_ydl) == 2
@@ -0,0 +1,58 @@
+import time
+
+import app
+from metadata_cache import MetadataCache
+from metadata_store import MetadataStore
+from proxy_pool import ProxyPool
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+PROXY = 'http://user:pw@proxy.example:8080'
+
+
+def test_entries_round_trip_per_kind_until_they_expire(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'), ttls={'full': 3600, 'lite': 0.05})
+    assert store.put('youtube:a', {'title': 'Full'}, proxy=PROXY)
+    assert store.put('youtube:a', {'title': 'Lite'}, kind='lite')
+    # Another worker opens the same database
+    other = MetadataStore(str(tmp_path / 'metadata.db'))
+    stored = other.get('youtube:a')
+    assert (stored.info, stored.proxy) == ({'title': 'Full'}, PROXY)
+    assert other.get('youtube:a', 'lite').info == {'title': 'Lite'}
+
+    time.sleep(0.1)
+    assert other.get('youtube:a', 'lite') is None
+    assert store.prune() == 1
+    other.invalidate('youtube:a')
+    assert store.get('youtube:a') is None
+    # Kinds without a TTL are not stored, values that are not JSON are refused
+    assert not store.put('youtube:b', {'title': 'x'}, kind='playlist')
+    assert not store.put('youtube:b', {'title': object()})
+    assert store.stats()['errors'] == 1
+
+
+def test_proxy_health_is_shared_through_the_store(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    pool = ProxyPool([PROXY], cooldown=60)
+    pool.record_failure(PROXY, 'timeout')
+    store.sync(pool)
+    assert [row['proxy'] for row in store.load_proxy_health()] == ['proxy.example:8080']
+
+    restarted = ProxyPool([PROXY], cooldown=60)
+    MetadataStore(str(tmp_path / 'metadata.db')).sync(restarted)
+    assert restarted.healthy() == [None]
+
+
+def test_a_stored_extraction_serves_other_workers(monkeypatch, tmp_path, fake_ydl):
+    store = MetadataStore(str(tmp_path / 'metadata.db'), ttls={'full': 3600})
+    monkeypatch.setattr(app, 'metadata_store', store)
+    info, _, _ = app.fetch_video_info('https://youtu.be/LLLLLLLLL01', COOKIES)
+    assert '_format_index' in info
+    # The format index stays out of the store; it is rebuilt from the formats
+    assert '_format_index' not in store.get('youtube:LLLLLLLLL01').info
+
+    # A worker with an empty memory cache
+    monkeypatch.setattr(app, 'metadata_cache', MetadataCache())
+    response = app.app.test_client().post('/get_info', json={'url': 'https://www.youtube.com/watch?v=LLLLLLLLL01', 'cookies': COOKIES})
+    assert response.get_json()['format_index']['video'][0]['format_id'] == '137+140'
+    assert len(fake_ydl) == 1
+    assert store.stats()['hits'] == 2
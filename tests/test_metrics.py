@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+import app
+import metrics
+from metrics import Registry
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_metrics_render_in_the_text_exposition_format():
+    registry = Registry()
+    counter = registry.counter('jobs_total', 'Jobs', ('outcome',))
+    histogram = registry.histogram('job_seconds', 'Job time', ('stage',), buckets=(0.1, 1))
+    registry.gauge_callback('queue_depth', 'Queued jobs', ('queue',), lambda: {('a "b"',): 3})
+    registry.gauge_callback('broken', 'Raises at scrape time', (), lambda: 1 / 0)
+    counter.inc(outcome='ok')
+    counter.inc(2, outcome='ok')
+    histogram.observe(0.05, stage='x')
+    histogram.observe(0.5, stage='x')
+    histogram.observe(5, stage='x')
+
+    assert registry.render().splitlines() == [
+        '# HELP jobs_total Jobs',
+        '# TYPE jobs_total counter',
+        'jobs_total{outcome="ok"} 3',
+        '# HELP job_seconds Job time',
+        '# TYPE job_seconds histogram',
+        'job_seconds_bucket{stage="x",le="0.1"} 1',
+        'job_seconds_bucket{stage="x",le="1"} 2',
+        'job_seconds_bucket{stage="x",le="+Inf"} 3',
+        'job_seconds_sum{stage="x"} 5.55',
+        'job_seconds_count{stage="x"} 3',
+        '# HELP queue_depth Queued jobs',
+        '# TYPE queue_depth gauge',
+        'queue_depth{queue="a \\"b\\""} 3',
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(stage='x')
+
+
+def test_work_handed_to_other_threads_keeps_its_route():
+    seen = []
+    metrics.set_route('/get_info')
+    try:
+        threads = [threading.Thread(target=metrics.with_route(metrics.current_route(), lambda: seen.append(metrics.current_route()))),
+                   threading.Thread(target=lambda: seen.append(metrics.current_route()))]
+    finally:
+        metrics.set_route(None)
+    for t in threads:
+        t.start()
+        t.join(10)
+    assert seen == ['/get_info', 'background']
+
+
+def test_requests_and_their_stages_are_timed(fake_ydl):
+    client = app.app.test_client()
+    # Request time is recorded once the response is closed
+    with client.post('/get_info', json={'url': 'https://youtu.be/HHHHHHHHH01', 'cookies': COOKIES}) as response:
+        assert response.status_code == 200
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'freeytzone_http_request_duration_seconds_count{route="/get_info",method="POST",status="200"}' in text
+    assert 'freeytzone_stage_duration_seconds_count{stage="extract",route="/get_info",proxy="direct"}' in text
+    assert 'freeytzone_proxy_attempts_total{stage="extract",route="/get_info",proxy="direct",outcome="success"}' in text
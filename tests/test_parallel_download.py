@@ -0,0 +1,72 @@
+import logging
+
+import requests
+import yt_dlp
+
+from bench.fake_upstream import FakeProxy, FakeUpstream
+from parallel_download import MIN_CHUNK_SIZE, ParallelHttpFD
+from proxy_pool import proxy_label
+
+
+def download(tmp_path, url, proxy=None, **options):
+    finished, proxy_errors = [], []
+    options.setdefault('on_finished', finished.append)
+    options.setdefault('on_proxy_error', lambda p, e: proxy_errors.append(p))
+    ydl = yt_dlp.YoutubeDL({'quiet': True, 'logger': logging.getLogger('yt_dlp')})
+    params = dict(ydl.params, proxy=proxy, socket_timeout=10, parallel_download=options)
+    filename = str(tmp_path / 'video.mp4')
+    ok = ParallelHttpFD(ydl, params).real_download(filename, {'url': url, 'http_headers': {}})
+    return ok, filename, finished, proxy_errors
+
+
+def test_a_file_is_assembled_from_ranges_over_several_upstreams(tmp_path):
+    upstream = FakeUpstream(media_bytes=8 * MIN_CHUNK_SIZE).start()
+    proxy = FakeProxy(latency=0).start()
+    try:
+        url = f'{upstream.address}/media/KKKKKKKKK01/720.mp4'
+        ok, filename, finished, _ = download(tmp_path, url, connections=4, proxies=[proxy.address], chunk_size=MIN_CHUNK_SIZE)
+        assert ok
+        with open(filename, 'rb') as f:
+            assert f.read() == requests.get(url, timeout=10).content
+        [summary] = finished
+        assert summary['retries'] == 0
+        assert sum(u['chunks'] for u in summary['upstreams']) == 8
+        assert {u['proxy'] for u in summary['upstreams']} == {'direct', proxy_label(proxy.address)}
+    finally:
+        proxy.stop()
+        upstream.stop()
+
+
+def test_ranges_move_off_a_failing_proxy(tmp_path):
+    upstream = FakeUpstream(media_bytes=8 * MIN_CHUNK_SIZE).start()
+    broken = FakeProxy(latency=0, failure_rate=1, seed=1).start()
+    working = FakeProxy(latency=0).start()
+    try:
+        url = f'{upstream.address}/media/KKKKKKKKK02/720.mp4'
+        # The proxy that resolved the stream goes first, so even the probe range has to move on
+        ok, filename, finished, proxy_errors = download(tmp_path, url, proxy=broken.address, connections=4,
+                                                        proxies=[working.address], chunk_size=MIN_CHUNK_SIZE)
+        assert ok
+        with open(filename, 'rb') as f:
+            assert f.read() == requests.get(url, timeout=10).content
+        assert set(proxy_errors) == {broken.address}
+        [summary] = finished
+        assert summary['retries'] >= 1
+        assert all(u['bytes'] == 0 for u in summary['upstreams'] if u['proxy'] != proxy_label(working.address))
+    finally:
+        working.stop()
+        broken.stop()
+        upstream.stop()
+
+
+def test_a_single_connection_is_a_plain_download(tmp_path):
+    upstream = FakeUpstream(media_bytes=MIN_CHUNK_SIZE).start()
+    try:
+        url = f'{upstream.address}/media/KKKKKKKKK03/720.mp4'
+        ok, filename, finished, _ = download(tmp_path, url, connections=1)
+        assert ok
+        with open(filename, 'rb') as f:
+            assert len(f.read()) == MIN_CHUNK_SIZE
+        assert finished == []
+    finally:
+        upstream.stop()
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import app
+from conftest import video_info
+from download_jobs import DownloadJobManager
+from prefetch import Prefetcher, PrefetchSkipped
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def wait_until_done(job):
+    deadline = time.monotonic() + 10
+    while job.status not in ('finished', 'error', 'cancelled') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.status
+
+
+def until_cancelled(job):
+    job.cancel_event.wait(10)
+    return 'video.mp4'
+
+
+def already_cached():
+    raise PrefetchSkipped('cached')
+
+
+def test_a_download_attaching_to_a_running_prefetch_claims_it():
+    jobs = DownloadJobManager(max_workers=2)
+    prefetcher = Prefetcher(jobs, max_active=1)
+    job = prefetcher.prefetch('key', lambda: jobs.submit(until_cancelled, dedupe_key='key'), client='a')
+    assert job is not None
+    # One prefetch downloads at a time
+    assert prefetcher.prefetch('other', lambda: jobs.submit(until_cancelled, dedupe_key='other'), client='b') is None
+    assert prefetcher.stats()['skipped'] == {'budget': 1}
+
+    attached = jobs.submit(until_cancelled, dedupe_key='key', client='a')
+    assert attached is job
+    assert prefetcher.claim('key', attached)
+    assert not prefetcher.claim('key', attached)
+    # The user now holds the only subscription, so their cancel stops the download
+    assert job.subscribers == {'a'}
+    jobs.cancel(job.id, client='a')
+    assert wait_until_done(job) == 'cancelled'
+    stats = prefetcher.stats()
+    assert (stats['hits'], stats['pending'], stats['hit_ratio']) == ({'running': 1}, 0, 1.0)
+
+
+def test_unclaimed_prefetches_are_written_off():
+    jobs = DownloadJobManager(max_workers=2)
+    prefetcher = Prefetcher(jobs, max_active=2, unused_timeout=0.2)
+    assert prefetcher.prefetch('cached', already_cached, client='a') is None
+    running = prefetcher.prefetch('running', lambda: jobs.submit(until_cancelled, dedupe_key='running'), client='a')
+    finished = prefetcher.prefetch('finished', lambda: jobs.submit(lambda job: 'video.mp4', dedupe_key='finished'), client='b')
+    assert wait_until_done(finished) == 'finished'
+    prefetcher.sweep()
+    assert prefetcher.stats()['pending'] == 2
+
+    time.sleep(0.3)
+    prefetcher.sweep()
+    assert wait_until_done(running) == 'cancelled'
+    stats = prefetcher.stats()
+    assert (stats['skipped'], stats['wasted']) == ({'cached': 1}, {'cancelled': 1, 'unused': 1})
+
+    # Looking up another video replaces the client's previous prefetch
+    first = prefetcher.prefetch('first', lambda: jobs.submit(until_cancelled, dedupe_key='first'), client='a')
+    second = prefetcher.prefetch('second', lambda: jobs.submit(until_cancelled, dedupe_key='second'), client='a')
+    assert wait_until_done(first) == 'cancelled'
+    stats = prefetcher.stats()
+    assert stats['wasted']['replaced'] == 1
+    assert stats['pending'] == 1
+    assert stats['waste_ratio'] == 1.0
+    jobs.cancel(second.id)
+
+
+def test_get_info_prefetches_the_download_the_page_asks_for_next(monkeypatch, fake_ydl):
+    jobs = DownloadJobManager(max_workers=2)
+    monkeypatch.setattr(app, 'download_jobs', jobs)
+    monkeypatch.setattr(app, 'prefetcher', Prefetcher(jobs, max_active=1))
+    release = threading.Event()
+    runs = []
+
+    def run_download(job, url, cookies_str, cache_key, *args, **kwargs):
+        runs.append(cache_key)
+        release.wait(10)
+        path = os.path.join(app.app.config['UPLOAD_FOLDER'], f'{cache_key}.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'video')
+        app.download_cache.store(cache_key, path, 'Video')
+        app.storage.after_store(cache_key)
+        return os.path.basename(path)
+
+    monkeypatch.setattr(app, 'run_download', run_download)
+    client = app.app.test_client()
+    assert client.post('/get_info', json={'url': 'https://youtu.be/PPPPPPPPP01', 'cookies': COOKIES}).status_code == 200
+    assert app.prefetcher.stats()['started'] == 1
+
+    download_type, quality, format_id, _ = app.likely_download(video_info('PPPPPPPPP01'))
+    response = client.post('/download', json={'url': 'https://youtu.be/PPPPPPPPP01', 'cookies': COOKIES,
+                                              'type': download_type, 'quality': quality, 'format_id': format_id})
+    assert response.status_code == 202
+    release.set()
+    assert wait_until_done(jobs.get(response.get_json()['job_id'])) == 'finished'
+    assert len(runs) == 1
+    assert app.prefetcher.stats()['hits'] == {'running': 1}
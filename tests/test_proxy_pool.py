@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+
+from proxy_pool import ProxyAttemptError, ProxyPool
+
+FAST = 'http://user:pw@fast.example:8080'
+SLOW = 'http://slow.example:8080'
+BROKEN = 'http://broken.example:8080'
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_race_returns_the_first_success_and_discards_slower_attempts():
+    pool = ProxyPool([SLOW, FAST], include_direct=False)
+    pool.record_success(SLOW, 0.1)  # ranked first, so the race starts with it
+    release = threading.Event()
+    started = []
+
+    def fetch(proxy_url):
+        started.append(proxy_url)
+        if proxy_url == SLOW:
+            release.wait(10)
+            return 'slow'
+        return 'fast'
+
+    result, proxy_url, error = pool.race(fetch, width=2)
+    release.set()
+    assert (result, proxy_url, error) == ('fast', FAST, None)
+    assert sorted(started) == sorted([SLOW, FAST])
+
+
+def test_race_falls_through_failing_proxies_and_puts_them_in_cooldown():
+    pool = ProxyPool([BROKEN, FAST], include_direct=True, cooldown=30)
+    pool.record_success(BROKEN, 0.01)
+
+    def fetch(proxy_url):
+        if proxy_url == BROKEN:
+            raise ProxyAttemptError('connection refused')
+        return 'ok'
+
+    assert pool.race(fetch)[:2] == ('ok', FAST)
+    # The broken proxy is now cooling down: behind the direct connection, and out of the healthy list
+    assert pool.ranked() == [FAST, None, BROKEN]
+    assert pool.healthy() == [FAST, None]
+    stats = {s['proxy']: s for s in pool.stats()}
+    assert stats['broken.example:8080']['cooling_down']
+    assert stats['fast.example:8080']['successes'] == 1
+
+
+def test_failures_that_are_not_the_proxys_fault_are_not_held_against_it():
+    pool = ProxyPool([FAST], include_direct=False)
+
+    def fetch(proxy_url):
+        raise ProxyAttemptError('Private video', proxy_fault=False)
+
+    result, proxy_url, error = pool.race(fetch)
+    assert result is None and proxy_url is None
+    assert str(error) == 'Private video'
+    assert pool.stats()[0]['failures'] == 0
+    assert pool.healthy() == [FAST]
+
+
+def test_cooldown_backs_off_exponentially_up_to_the_maximum():
+    pool = ProxyPool([BROKEN], cooldown=10, max_cooldown=25)
+    remaining = []
+    for _ in range(3):
+        pool.record_failure(BROKEN, 'timeout')
+        remaining.append(pool.stats()[0]['cooldown_remaining'])
+    assert remaining == [pytest.approx(10, abs=0.5), pytest.approx(20, abs=0.5), pytest.approx(25, abs=0.5)]
+    pool.record_success(BROKEN)
+    assert not pool.stats()[0]['cooling_down']
+
+
+def test_in_flight_cap_spreads_a_race_over_other_upstreams():
+    pool = ProxyPool([FAST, SLOW], include_direct=False, max_in_flight=1)
+    pool.record_success(FAST, 0.01)
+    busy = threading.Event()
+    release = threading.Event()
+    holder = threading.Thread(target=pool.attempt, args=(FAST, lambda p: (busy.set(), release.wait(10))))
+    holder.start()
+    assert busy.wait(10)
+    try:
+        started = []
+        result = pool.race(lambda p: started.append(p) or p, width=2)
+        assert result[:2] == (SLOW, SLOW)
+        assert started[0] == SLOW
+    finally:
+        release.set()
+        holder.join(10)
+
+
+def test_exported_health_is_merged_by_other_processes():
+    pool = ProxyPool([FAST, BROKEN], cooldown=60)
+    pool.record_success(FAST, 0.5)
+    pool.record_failure(BROKEN, 'timeout')
+    rows = pool.export_health()
+    assert {row['proxy'] for row in rows} == {'fast.example:8080', 'broken.example:8080'}
+    assert pool.export_health() == []
+
+    other = ProxyPool([FAST, BROKEN], cooldown=60)
+    other.merge_health(rows)
+    stats = {s['proxy']: s for s in other.stats()}
+    assert stats['fast.example:8080']['latency_ewma'] == 0.5
+    assert stats['broken.example:8080']['cooling_down']
+    assert other.healthy() == [FAST, None]
+    # A restarted cooldown lasts at least as long as the exported one
+    assert stats['broken.example:8080']['cooldown_remaining'] > 55
+
+
+def test_get_info_races_past_a_dead_proxy(monkeypatch, fake_ydl):
+    from contextlib import contextmanager
+
+    import yt_dlp
+
+    import app
+    from conftest import video_info
+
+    pool = ProxyPool([BROKEN, FAST], include_direct=False)
+    pool.record_success(BROKEN, 0.01)
+    monkeypatch.setattr(app, 'proxy_pool', pool)
+    tried = []
+
+    class FakeYoutubeDL:
+        def __init__(self, proxy_url):
+            self.proxy_url = proxy_url
+
+        def extract_info(self, url, download=False):
+            tried.append(self.proxy_url)
+            if self.proxy_url == BROKEN:
+                raise yt_dlp.utils.DownloadError('Unable to connect to proxy')
+            return video_info('dQw4w9WgXcQ')
+
+    @contextmanager
+    def checkout(proxy_url, cookies_str, profile, base_opts, overrides=None):
+        yield FakeYoutubeDL(proxy_url)
+
+    monkeypatch.setattr(app, 'ydl_checkout', checkout)
+    response = app.app.test_client().post('/get_info', json={'url': 'https://youtu.be/dQw4w9WgXcQ', 'cookies': COOKIES})
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'Video dQw4w9WgXcQ'
+    assert sorted(tried) == sorted([BROKEN, FAST])
+    assert pool.ranked() == [FAST, BROKEN]
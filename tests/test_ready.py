@@ -0,0 +1,50 @@
+import gc
+
+import app
+from metadata_store import MetadataStore
+from ydl_pool import YoutubeDLPool
+
+
+def test_ready_waits_for_the_warm_up(monkeypatch):
+    pool = YoutubeDLPool()
+    monkeypatch.setattr(app, 'ydl_pool', pool)
+    monkeypatch.setitem(app.app.config, 'YDL_POOL_WARMUP', True)
+    client = app.app.test_client()
+
+    pool.warmup_state = 'running'
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json()['ready'] is False
+
+    pool.warm_up()
+    assert pool.warmup_state == 'done'
+    assert pool.warmup_seconds is not None
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.get_json()['warmup'] == 'done'
+
+
+def test_ready_without_warm_up_or_after_a_failed_one(monkeypatch):
+    monkeypatch.setattr(app, 'ydl_pool', YoutubeDLPool())
+    client = app.app.test_client()
+    assert client.get('/ready').get_json()['warmup'] == 'disabled'
+
+    monkeypatch.setitem(app.app.config, 'YDL_POOL_WARMUP', True)
+    app.ydl_pool.warmup_state = 'failed'
+    # Requests still work without the warm-up, they are only slower
+    assert client.get('/ready').status_code == 200
+
+
+def test_the_master_closes_the_store_before_forking(monkeypatch, tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'), ttls={'full': 3600})
+    monkeypatch.setattr(app, 'metadata_store', store)
+    assert store.put('youtube:a', {'title': 'Video'})
+    try:
+        app.before_fork()
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert store._local.db is None
+    # The connection is reopened on next use
+    assert store.get('youtube:a').info == {'title': 'Video'}
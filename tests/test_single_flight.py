@@ -0,0 +1,117 @@
+import threading
+import time
+
+from single_flight import SharedResultStore, SingleFlight
+
+
+def start_calls(flight, key, fn, count):
+    results = []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            results.append(e)
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def lookup():
+        calls.append(1)
+        release.wait(10)
+        return 'info'
+
+    leader, results = start_calls(flight, 'key', lookup, 1)
+    while flight.stats()['in_flight'] < 1:
+        time.sleep(0.01)
+    followers, follower_results = start_calls(flight, 'key', lookup, 3)
+    while flight.stats()['waiting'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for t in leader + followers:
+        t.join(10)
+    assert results == [('info', False)]
+    assert follower_results == [('info', True)] * 3
+    assert len(calls) == 1
+    # Nothing is remembered afterwards
+    assert flight.do('key', lambda: 'again') == ('again', False)
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def lookup():
+        release.wait(10)
+        raise RuntimeError('extraction failed')
+
+    leader, results = start_calls(flight, 'key', lookup, 1)
+    while flight.stats()['in_flight'] < 1:
+        time.sleep(0.01)
+    followers, follower_results = start_calls(flight, 'key', lookup, 2)
+    while flight.stats()['waiting'] < 2:
+        time.sleep(0.01)
+    release.set()
+    for t in leader + followers:
+        t.join(10)
+    assert [str(e) for e in results + follower_results] == ['extraction failed'] * 3
+
+
+def test_a_follower_gives_up_on_a_slow_leader():
+    flight = SingleFlight(wait_timeout=0.05)
+    release = threading.Event()
+    leader, _ = start_calls(flight, 'key', lambda: release.wait(10), 1)
+    while flight.stats()['in_flight'] < 1:
+        time.sleep(0.01)
+    try:
+        assert flight.do('key', lambda: 'own') == ('own', False)
+        assert flight.stats()['timeouts'] == 1
+    finally:
+        release.set()
+        leader[0].join(10)
+
+
+def test_workers_sharing_a_lock_dir_take_turns_and_share_results(tmp_path):
+    # Two SingleFlight instances stand in for two worker processes: flock works per open file
+    first, second = SingleFlight(lock_dir=str(tmp_path / 'locks')), SingleFlight(lock_dir=str(tmp_path / 'locks'))
+    store = SharedResultStore(str(tmp_path / 'results'))
+    release = threading.Event()
+    calls = []
+
+    def lookup():
+        shared = store.get('key')
+        if shared is not None:
+            return shared
+        calls.append(1)
+        release.wait(10)
+        store.put('key', {'title': 'Video'})
+        return {'title': 'Video'}
+
+    leader, results = start_calls(first, 'key', lookup, 1)
+    while not calls:
+        time.sleep(0.01)
+    other, other_results = start_calls(second, 'key', lookup, 1)
+    while second.stats()['lock_waits'] < 1:
+        time.sleep(0.01)
+    release.set()
+    for t in leader + other:
+        t.join(10)
+    assert results == other_results == [({'title': 'Video'}, False)]
+    assert len(calls) == 1
+    assert store.stats()['hits'] == 1
+
+
+def test_shared_results_expire(tmp_path):
+    store = SharedResultStore(str(tmp_path), ttl=0)
+    store.put('key', {'title': 'Video'})
+    time.sleep(0.01)
+    assert store.get('key') is None
+    # Results that cannot be shared are skipped, not raised
+    assert store.put('other', object()) is False
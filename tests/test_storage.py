@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+import pytest
+
+from download_cache import DownloadCache
+from storage import StorageFull, StorageManager
+
+MB = 1024 * 1024
+
+
+def make_storage(folder, protected=frozenset(), **kwargs):
+    cache = DownloadCache(str(folder), max_bytes=1024 * MB)
+    kwargs.setdefault('min_free_bytes', 0)
+    kwargs.setdefault('quota_bytes', 1024 * MB)
+    kwargs.setdefault('reserve_bytes', MB)
+    return StorageManager(str(folder), cache, protected_keys=lambda: set(protected), **kwargs)
+
+
+def key(n):
+    return f'{n:024x}'
+
+
+def test_sweep_keeps_a_reservation_whose_job_is_not_queued_yet(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.admit(key(1))
+    storage.sweep()
+    assert storage.stats()['reservations'] == 1
+
+
+def test_sweep_drops_stale_unprotected_reservations(tmp_path):
+    protected = {key(2)}
+    storage = make_storage(tmp_path, protected, reservation_grace=0.05)
+    storage.admit(key(1))
+    storage.admit(key(2))
+    time.sleep(0.1)
+    storage.sweep()
+    assert storage.stats()['reservations'] == 1
+    assert storage.stats()['reserved_bytes'] == MB
+
+
+def test_interleaved_admit_and_sweep_never_lose_a_reservation(tmp_path):
+    # Keys are admitted while sweeps run in parallel and before their jobs are protected, as in
+    # /download between storage.admit() and download_jobs.submit()
+    storage = make_storage(tmp_path)
+    done = threading.Event()
+
+    def sweeper():
+        while not done.is_set():
+            storage.sweep()
+
+    sweepers = [threading.Thread(target=sweeper) for _ in range(2)]
+    for t in sweepers:
+        t.start()
+    try:
+        for n in range(200):
+            storage.admit(key(n))
+            storage.sweep()
+    finally:
+        done.set()
+        for t in sweepers:
+            t.join()
+    stats = storage.stats()
+    assert stats['reservations'] == 200
+    assert stats['reserved_bytes'] == 200 * MB
+
+
+def test_release_forgets_the_reservation(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.admit(key(1))
+    storage.release(key(1))
+    storage.sweep()
+    assert storage.stats()['reservations'] == 0
+
+
+def write(folder, name, data=b'x' * 1000):
+    with open(os.path.join(str(folder), name), 'wb') as f:
+        f.write(data)
+
+
+def test_sweep_leaves_files_of_a_reserved_download_alone(tmp_path):
+    # An opus download's source file, before FFmpegExtractAudio converts it
+    protected = {key(1)}
+    storage = make_storage(tmp_path, protected, orphan_age=0)
+    storage.admit(key(1))
+    write(tmp_path, key(1) + '.webm')
+    storage.sweep()
+    assert storage.cache.lookup(key(1)) is None
+    assert os.path.exists(tmp_path / (key(1) + '.webm'))
+    assert storage.stats()['reservations'] == 1
+
+
+def test_sweep_adopts_only_finished_downloads_of_other_workers(tmp_path):
+    storage = make_storage(tmp_path)
+    other = DownloadCache(str(tmp_path))
+    write(tmp_path, key(1) + '.webm')  # still downloading in another worker
+    write(tmp_path, key(2) + '.webm')  # left over from the conversion to key(2).opus
+    write(tmp_path, key(2) + '.opus')
+    other.store(key(2), str(tmp_path / (key(2) + '.opus')), title='Finished')
+    storage.sweep()
+    assert storage.cache.lookup(key(1)) is None
+    entry = storage.cache.lookup(key(2))
+    assert entry.filename == key(2) + '.opus'
+    assert entry.title == 'Finished'
+
+
+def cached(storage, n, size=3000):
+    write(storage.folder, key(n) + '.mp4', b'x' * size)
+    storage.cache.store(key(n), os.path.join(storage.folder, key(n) + '.mp4'))
+
+
+def small_storage(folder, protected=frozenset()):
+    # 10000 bytes: evictions start above 9000 and stop at 5000
+    return make_storage(folder, protected, quota_bytes=10000, high_watermark=0.9, low_watermark=0.5)
+
+
+def test_admission_evicts_least_recently_used_downloads_down_to_the_low_watermark(tmp_path):
+    storage = small_storage(tmp_path, protected={key(2)})
+    for n in (1, 2, 3):
+        cached(storage, n)
+    storage.cache.lookup(key(1))  # key(3) is now the least recently used one that may go
+    storage.admit(key(9), expected_bytes=2000)
+    assert [n for n in (1, 2, 3) if storage.cache.contains(key(n))] == [2]
+    assert not os.path.exists(tmp_path / (key(3) + '.mp4'))
+    assert storage.stats()['reserved_bytes'] == 2000
+
+
+def test_downloads_that_cannot_fit_are_refused(tmp_path):
+    storage = small_storage(tmp_path, protected={key(1), key(2), key(3)})
+    for n in (1, 2, 3):
+        cached(storage, n)
+    with pytest.raises(StorageFull):
+        storage.admit(key(9), expected_bytes=2000)
+    assert storage.stats()['refused'] == 1
+    assert storage.stats()['reservations'] == 0
+    # A download whose real size turns out larger than reserved is stopped the same way
+    storage.cache.evict(target_bytes=0)
+    storage.admit(key(9), expected_bytes=1000)
+    assert not storage.update_reservation(key(9), 20000)
+    assert storage.update_reservation(key(9), 4000)
+
+
+def test_a_stored_download_over_the_high_watermark_makes_room(tmp_path):
+    storage = small_storage(tmp_path)
+    storage.admit(key(4), expected_bytes=3000)
+    for n in (1, 2, 3):
+        cached(storage, n)
+    cached(storage, 4)
+    storage.after_store(key(4))
+    assert storage.stats()['reservations'] == 0
+    assert storage.stats()['cached_bytes'] <= 5000
+    assert storage.cache.contains(key(4))
+
+
+def test_sweep_removes_orphans_and_expired_downloads(tmp_path):
+    storage = make_storage(tmp_path, orphan_age=60, max_age=60)
+    write(tmp_path, key(1) + '.mp4.part')
+    write(tmp_path, 'stray.tmp')
+    write(tmp_path, key(2) + '.f137.mp4')
+    old = time.time() - 120
+    os.utime(tmp_path / (key(1) + '.mp4.part'), (old, old))
+    os.utime(tmp_path / 'stray.tmp', (old, old))
+    cached(storage, 3)
+    storage.cache.find_by_filename(key(3) + '.mp4').last_access = old
+    cached(storage, 4)
+
+    sweep = storage.sweep()
+    assert sorted(os.listdir(tmp_path)) == sorted([key(2) + '.f137.mp4', key(4) + '.mp4', key(4) + '.meta.json'])
+    assert (sweep['removed_files'], sweep['expired']) == (2, 1)
+    # Recent leftovers may still belong to a download and count against the quota
+    assert storage.stats()['untracked_bytes'] == 1000
@@ -0,0 +1,75 @@
+import stat
+
+import pytest
+
+import app
+import streaming
+from admission import FairLimiter
+from streaming import StreamError, open_mp3_stream
+
+FORMAT = {'format_id': '140', 'url': 'https://media.example/audio', 'protocol': 'https', 'ext': 'm4a',
+          'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 128}
+
+
+def fake_ffmpeg(monkeypatch, tmp_path, script='exec cat /dev/zero'):
+    path = tmp_path / 'ffmpeg'
+    path.write_text('#!/bin/sh\n' + script + '\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(streaming.shutil, 'which', lambda name: str(path))
+
+
+def test_closing_an_mp3_stream_that_was_never_iterated_stops_ffmpeg(monkeypatch, tmp_path):
+    fake_ffmpeg(monkeypatch, tmp_path)
+    closed = []
+    body = open_mp3_stream(FORMAT, None, chunk_size=1024, on_close=lambda: closed.append(True))
+    body.close()
+    body.close()
+    assert closed == [True]
+
+
+def test_ffmpeg_that_cannot_start_raises_stream_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(streaming.shutil, 'which', lambda name: str(tmp_path / 'missing'))
+    with pytest.raises(StreamError):
+        open_mp3_stream(FORMAT, None)
+
+
+def stream_mp3(monkeypatch):
+    monkeypatch.setattr(app, 'fetch_video_info', lambda url, cookies_str: ({'title': 'Song', 'formats': [FORMAT]}, None, None))
+    client = app.app.test_client()
+    return client.post('/download', json={'url': 'https://youtu.be/dQw4w9WgXcQ', 'cookies': '# cookies', 'type': 'audio',
+                                          'stream': True}, buffered=False)
+
+
+def test_transcode_slot_is_released_when_the_stream_is_closed_unread(monkeypatch, tmp_path):
+    fake_ffmpeg(monkeypatch, tmp_path)
+    response = stream_mp3(monkeypatch)
+    assert response.status_code == 200
+    assert app.transcode_pool.stats()['active_clients'] == 1
+    response.close()
+    assert app.transcode_pool.stats()['active_clients'] == 0
+
+
+def test_transcode_slot_is_released_when_starting_the_stream_fails(monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError('unexpected')
+
+    monkeypatch.setattr(app, 'open_mp3_stream', broken)
+    response = stream_mp3(monkeypatch)
+    assert response.status_code == 500
+    assert app.transcode_pool.stats()['active_clients'] == 0
+
+
+def test_streams_beyond_the_client_share_are_turned_away(monkeypatch, tmp_path):
+    fake_ffmpeg(monkeypatch, tmp_path)
+    monkeypatch.setattr(app, 'stream_admission', FairLimiter('stream', max_running=8, max_per_client=1))
+    monkeypatch.setattr(app.transcode_pool, 'max_per_client', 0)
+    first = stream_mp3(monkeypatch)
+    assert first.status_code == 200
+    second = stream_mp3(monkeypatch)
+    assert second.status_code == 429
+    assert second.headers['Retry-After']
+    first.close()
+    assert app.stream_admission.stats()['running'] == 0
+    third = stream_mp3(monkeypatch)
+    assert third.status_code == 200
+    third.close()
@@ -0,0 +1,56 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from thumbnail_cache import ThumbnailCache
+
+URL = 'https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg'
+
+
+class FakeResponse:
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.headers = {'ETag': '"v1"', 'Content-Type': 'image/jpeg'}
+
+    def iter_content(self, chunk_size):
+        for n, chunk in enumerate(self.chunks):
+            if n == self.fail_after:
+                raise ConnectionError('connection reset')
+            yield chunk
+
+
+def test_concurrent_stores_of_one_thumbnail_write_whole_files(tmp_path):
+    # Forked gunicorn workers: each main thread has the same thread ident, so only the pid tells their temp
+    # files apart
+    cache = ThumbnailCache(str(tmp_path), session=None)
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(4)
+
+    def store(n):
+        barrier.wait()
+        cache._store('video', URL, FakeResponse([bytes([n]) * 100] * 2000))
+
+    workers = [context.Process(target=store, args=(n,)) for n in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(30)
+    assert [p.exitcode for p in workers] == [0] * 4
+
+    image_path, meta_path = cache._paths('video')
+    with open(image_path, 'rb') as f:
+        image = f.read()
+    assert len(image) == 200000 and len(set(image)) == 1
+    with open(meta_path, encoding='utf-8') as f:
+        assert json.load(f)['key'] == 'video'
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in (image_path, meta_path))
+
+
+def test_failed_store_leaves_no_temp_file(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), session=None)
+    with pytest.raises(ConnectionError):
+        cache._store('video', URL, FakeResponse([b'x' * 1000] * 5, fail_after=2))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,79 @@
+import shutil
+import stat
+import threading
+
+import pytest
+
+import app
+from transcode import TranscodeClientLimit, TranscodeError, TranscodePool, TranscodeQueueFull
+
+
+def fake_ffmpeg(monkeypatch, tmp_path, script='eval "out=\\${$#}"; printf converted > "$out"'):
+    path = tmp_path / 'ffmpeg'
+    path.write_text('#!/bin/sh\n' + script + '\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(shutil, 'which', lambda name: str(path))
+
+
+def source(tmp_path):
+    path = tmp_path / 'source.webm'
+    path.write_bytes(b'x' * 100)
+    return str(path)
+
+
+def test_only_mp3_audio_is_transcoded():
+    assert app.build_download_format('audio', 'best', audio_format='m4a') == ('bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]', [], None)
+    assert app.build_download_format('audio', 'best', audio_format='best') == ('bestaudio[ext=m4a]/bestaudio/best', [], None)
+    # opus is copied out of its webm container by yt-dlp, without a slot on the transcode pool
+    assert app.build_download_format('audio', 'best', audio_format='opus') == (
+        'bestaudio[acodec=opus]', [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus'}], None)
+    assert app.build_download_format('audio', 'best', audio_format='mp3') == ('bestaudio/best', [], {'codec': 'mp3', 'bitrate': '192k'})
+
+
+def test_a_transcode_writes_the_target_and_records_its_timing(monkeypatch, tmp_path):
+    fake_ffmpeg(monkeypatch, tmp_path)
+    pool = TranscodePool(niceness=0)
+    target = str(tmp_path / 'out.mp3')
+    job = pool.transcode(source(tmp_path), target)
+    assert open(target).read() == 'converted'
+    assert job.timing()['status'] == 'finished'
+    assert job.timing()['input_bytes'] == 100
+    assert pool.stats()['completed'] == 1
+    assert pool.stats()['active'] == 0
+
+
+def test_transcodes_beyond_the_queue_are_turned_away_and_queued_ones_can_be_cancelled(monkeypatch, tmp_path):
+    fake_ffmpeg(monkeypatch, tmp_path, 'exec sleep 10')
+    pool = TranscodePool(max_workers=1, max_queued=1, niceness=0)
+    running_cancel, queued_cancel = threading.Event(), threading.Event()
+    running = pool.submit(source(tmp_path), str(tmp_path / 'a.mp3'), cancel_event=running_cancel)
+    queued = pool.submit(source(tmp_path), str(tmp_path / 'b.mp3'), cancel_event=queued_cancel)
+    with pytest.raises(TranscodeQueueFull):
+        pool.submit(source(tmp_path), str(tmp_path / 'c.mp3'))
+    queued_cancel.set()
+    running_cancel.set()
+    running.future.result(10)
+    queued.future.result(10)
+    assert (running.status, queued.status) == ('cancelled', 'cancelled')
+    assert pool.stats()['rejected'] == 1
+    assert pool.stats()['active'] == 0
+
+
+def test_streaming_slots_are_limited_per_client():
+    pool = TranscodePool(max_workers=2, max_per_client=1)
+    release = pool.try_slot('client-a')
+    with pytest.raises(TranscodeClientLimit):
+        pool.try_slot('client-a')
+    release_b = pool.try_slot('client-b')
+    assert pool.try_slot('client-c') is None
+    release()
+    release()
+    release_b()
+    assert pool.stats()['active_clients'] == 0
+    assert pool.try_slot('client-a') is not None
+
+
+def test_a_missing_ffmpeg_fails_the_transcode(monkeypatch, tmp_path):
+    monkeypatch.setattr(shutil, 'which', lambda name: None)
+    with pytest.raises(TranscodeError, match='FFmpeg is not installed'):
+        TranscodePool().transcode(source(tmp_path), str(tmp_path / 'out.mp3'))
@@ -0,0 +1,58 @@
+import csv
+import gzip
+import io
+import json
+import os
+
+import app
+from conftest import video_info
+from video_report import batched, generate_report, gzip_stream
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+def test_the_text_report_handles_missing_counts():
+    info = dict(video_info('JJJJJJJJJ01'), like_count=None, upload_date='2020-01')
+    text = ''.join(generate_report(info, 'https://youtu.be/JJJJJJJJJ01'))
+    assert 'Title: Video JJJJJJJJJ01\n' in text
+    assert 'Duration: 00:02:05\n' in text
+    assert 'Publish Date: 2020-01 (raw)\n' in text
+    assert 'View Count: 1,000\n' in text
+    assert 'Like Count: N/A\n' in text
+    assert text.count('  ID: ') == 4
+
+
+def test_json_and_csv_reports_hold_every_format():
+    info = video_info('JJJJJJJJJ02')
+    report = json.loads(''.join(generate_report(info, 'https://youtu.be/JJJJJJJJJ02', 'json')))
+    assert report['publish_date'] == '2020-01-01'
+    assert [f['format_id'] for f in report['formats']] == ['18', '137', '140', '251']
+    rows = list(csv.DictReader(io.StringIO(''.join(generate_report(info, 'https://youtu.be/JJJJJJJJJ02', 'csv')))))
+    assert [(r['video_id'], r['format_id'], r['filesize']) for r in rows] == [
+        ('JJJJJJJJJ02', '18', '1000'), ('JJJJJJJJJ02', '137', '5000'), ('JJJJJJJJJ02', '140', '300'), ('JJJJJJJJJ02', '251', '')]
+
+
+def test_pieces_are_batched_and_gzipped_on_the_fly():
+    pieces = ['x' * 10] * 25
+    chunks = list(batched(pieces, chunk_size=100))
+    assert [len(c) for c in chunks] == [100, 100, 50]
+    assert gzip.decompress(b''.join(gzip_stream(chunks))) == b'x' * 250
+
+
+def test_the_report_is_streamed_without_temp_files(fake_ydl):
+    client = app.app.test_client()
+    before = set(os.listdir('.'))
+    response = client.post('/get_video_info', json={'url': 'https://youtu.be/JJJJJJJJJ03', 'cookies': COOKIES, 'format': 'csv', 'gzip': True},
+                           headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="Video_JJJJJJJJJ03_info.csv"')
+    assert gzip.decompress(response.data).decode().startswith('video_id,title,format_id')
+    assert set(os.listdir('.')) == before
+
+    plain = client.post('/get_video_info', json={'url': 'https://youtu.be/JJJJJJJJJ03', 'cookies': COOKIES, 'gzip': True})
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    assert plain.get_data(as_text=True).startswith('Title: Video JJJJJJJJJ03\n')
+    assert client.post('/get_video_info', json={'url': 'https://youtu.be/JJJJJJJJJ03', 'cookies': COOKIES, 'format': 'xml'}).status_code == 400
@@ -0,0 +1,94 @@
+import logging
+import time
+
+import pytest
+import yt_dlp
+
+from ydl_pool import YoutubeDLPool
+
+PROFILE = {'quiet': True, 'logger': logging.getLogger('yt_dlp'),
+           'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus'}]}
+
+
+def test_postprocessor_hooks_reach_the_profile_postprocessors():
+    pool = YoutubeDLPool()
+
+    def first_hook(d):
+        pass
+
+    def second_hook(d):
+        pass
+
+    for hook in (first_hook, second_hook):
+        with pool.checkout('key', lambda: (dict(PROFILE), None), {'postprocessor_hooks': [hook]}) as ydl:
+            [extract_audio] = ydl._pps['post_process']
+            assert extract_audio._progress_hooks == [extract_audio.report_progress, hook]
+        assert extract_audio._progress_hooks == [extract_audio.report_progress]
+    assert pool.stats()['created'] == 1
+
+
+def make_params(calls):
+    def make():
+        calls.append(1)
+        return {'quiet': True, 'logger': logging.getLogger('yt_dlp')}, None
+    return make
+
+
+def test_instances_are_reused_per_key():
+    pool = YoutubeDLPool()
+    calls = []
+    with pool.checkout('proxy-a', make_params(calls)) as first:
+        pass
+    with pool.checkout('proxy-a', make_params(calls)) as again:
+        assert again is first
+    with pool.checkout('proxy-b', make_params(calls)) as other:
+        assert other is not first
+    assert len(calls) == 2
+    assert pool.stats()['created'] == 2
+    assert pool.stats()['reused'] == 1
+    assert pool.stats()['keys'] == 2
+
+
+def test_per_request_overrides_do_not_outlive_the_checkout():
+    pool = YoutubeDLPool()
+
+    def hook(d):
+        pass
+
+    overrides = {'format': 'bestaudio', 'outtmpl': 'downloads/%(id)s.%(ext)s', 'progress_hooks': [hook]}
+    with pool.checkout('key', make_params([]), overrides) as ydl:
+        assert ydl.params['format'] == 'bestaudio'
+        assert ydl.params['outtmpl']['default'] == 'downloads/%(id)s.%(ext)s'
+        assert ydl._progress_hooks == [hook]
+    with pool.checkout('key', make_params([])) as reused:
+        assert reused is ydl
+        assert 'format' not in reused.params
+        assert reused.params['outtmpl']['default'] != 'downloads/%(id)s.%(ext)s'
+        assert reused._progress_hooks == []
+
+
+def test_instances_are_dropped_after_unexpected_errors_and_when_worn_out():
+    pool = YoutubeDLPool(max_uses=2)
+    calls = []
+    with pytest.raises(RuntimeError):
+        with pool.checkout('key', make_params(calls)):
+            raise RuntimeError('interrupted')
+    assert pool.stats()['idle'] == 0
+    # Download errors leave the instance usable
+    with pytest.raises(yt_dlp.utils.DownloadError):
+        with pool.checkout('key', make_params(calls)) as ydl:
+            raise yt_dlp.utils.DownloadError('Video unavailable')
+    with pool.checkout('key', make_params(calls)) as again:
+        assert again is ydl
+    assert pool.stats()['idle'] == 0
+    assert len(calls) == 2
+
+
+def test_idle_instances_expire():
+    pool = YoutubeDLPool(idle_ttl=0)
+    with pool.checkout('key', make_params([])) as first:
+        pass
+    time.sleep(0.01)
+    with pool.checkout('key', make_params([])) as second:
+        assert second is not first
+    assert pool.stats()['reused'] == 0
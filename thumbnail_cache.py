@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class CachedThumbnail:
+    __slots__ = ('path', 'url', 'etag', 'last_modified', 'content_type', 'fetched_at', 'size')
+
+    def __init__(self, path, url, etag, last_modified, content_type, fetched_at, size):
+        self.path = path
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.fetched_at = fetched_at
+        self.size = size
+
+    def to_meta(self):
+        return {
+            'url': self.url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'content_type': self.content_type,
+            'fetched_at': self.fetched_at,
+        }
+
+
+# On-disk thumbnail cache keyed by video. Entries younger than ttl are served without contacting the CDN;
+# older ones are revalidated with If-None-Match/If-Modified-Since so an unchanged image costs a 304 only.
+# Images are written to disk in chunks and served from there, never held in memory as a whole.
+class ThumbnailCache:
+    def __init__(self, folder, session, ttl=6 * 3600, max_entries=1000, timeout=10, chunk_size=64 * 1024):
+        self.folder = folder
+        self.session = session
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _paths(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.folder, digest)
+        return base + '.img', base + '.json'
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.folder, name)
+            image_path = meta_path[:-len('.json')] + '.img'
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                size = os.path.getsize(image_path)
+            except (OSError, ValueError):
+                continue
+            entries.append((meta.get('key'), CachedThumbnail(image_path, meta.get('url'), meta.get('etag'), meta.get('last_modified'), meta.get('content_type'), meta.get('fetched_at', 0), size)))
+        for key, entry in sorted(entries, key=lambda item: item[1].fetched_at):
+            if key:
+                self._entries[key] = entry
+
+    # Return a CachedThumbnail for `key`, fetching or revalidating `url` as needed
+    def get(self, key, url):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and not os.path.exists(entry.path):
+            entry = None
+        if entry is not None and entry.url == url and time.time() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            return entry
+
+        headers = {}
+        if entry is not None and entry.url == url:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        try:
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            if entry is not None:
+                logger.warning("Thumbnail revalidation failed for %s, serving cached copy: %s", url, e)
+                return entry
+            raise ThumbnailError(f"Failed to download thumbnail image: {str(e)}")
+
+        with response:
+            if response.status_code == 304 and entry is not None:
+                entry.fetched_at = time.time()
+                self._write_meta(key, entry)
+                self.revalidated += 1
+                return entry
+            if response.status_code != 200:
+                if entry is not None:
+                    logger.warning("Thumbnail CDN answered %s for %s, serving cached copy", response.status_code, url)
+                    return entry
+                raise ThumbnailError(f"Failed to download thumbnail image. Status: {response.status_code}")
+            self.misses += 1
+            return self._store(key, url, response)
+
+    def _store(self, key, url, response):
+        image_path, _ = self._paths(key)
+        # Unique per worker process and thread, like storage.atomic_write_json, so concurrent fetches of one
+        # thumbnail never write to the same temp file and readers only ever see a complete image
+        tmp_path = f"{image_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, image_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        entry = CachedThumbnail(
+            image_path,
+            url,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            response.headers.get('Content-Type', 'image/jpeg'),
+            time.time(),
+            size,
+        )
+        self._write_meta(key, entry)
+        evicted = []
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        for old_key, old_entry in evicted:
+            for path in self._paths(old_key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return entry
+
+    def _write_meta(self, key, entry):
+        _, meta_path = self._paths(key)
+        try:
+            atomic_write_json(meta_path, {'key': key, **entry.to_meta()})
+        except OSError as e:
+            logger.warning("Could not write thumbnail cache metadata for %s: %s", key, e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(e.size for e in self._entries.values()),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+            }
@@ -0,0 +1,226 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+
+# Audio outputs a download can ask for. Only mp3 needs a real transcode; m4a and opus are served from the
+# stream YouTube already offers in that codec (at most a container remux).
+AUDIO_FORMATS = ('mp3', 'm4a', 'opus', 'best')
+
+
+class TranscodeError(Exception):
+    pass
+
+
+# Raised by submit() when every transcode slot is busy and the queue is full
+class TranscodeQueueFull(TranscodeError):
+    pass
+
+
+# Raised by try_slot() when the client already holds max_per_client transcodes
+class TranscodeClientLimit(TranscodeQueueFull):
+    pass
+
+
+class TranscodeJob:
+    def __init__(self, source, target, codec, bitrate):
+        self.source = source
+        self.target = target
+        self.codec = codec
+        self.bitrate = bitrate
+        self.status = 'queued'  # queued -> running -> finished | error | cancelled
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.input_bytes = None
+        self.output_bytes = None
+        self.future = None
+
+    def timing(self):
+        return {
+            'status': self.status,
+            'codec': self.codec,
+            'wait_seconds': round(self.started_at - self.queued_at, 3) if self.started_at else None,
+            'transcode_seconds': round(self.finished_at - self.started_at, 3) if self.started_at and self.finished_at else None,
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+        }
+
+
+# FFmpeg transcodes with their own concurrency limit and queue. Each transcode is a separate FFmpeg process
+# started at lower CPU priority, so at most max_workers cores go to transcoding and web workers keep
+# getting scheduled. Streaming transcodes take a slot through try_slot() and share the same limit.
+# A client may hold at most max_per_client transcodes: queued ones count towards it, but they come from
+# downloads that were already admitted, so only streaming transcodes are turned away at the limit.
+class TranscodePool:
+    def __init__(self, max_workers=1, max_queued=8, niceness=10, history=100, max_per_client=0):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.niceness = niceness
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode')
+        self._lock = threading.Lock()
+        self._active = 0  # queued or running jobs
+        self._queued = 0  # jobs waiting for a slot
+        self._clients = {}  # client -> queued, running or streaming transcodes
+        self._history = deque(maxlen=history)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _lower_priority(self):
+        if self.niceness:
+            os.nice(self.niceness)
+
+    def _claim(self, client, enforce=True):
+        if client is None:
+            return
+        if enforce and self.max_per_client and self._clients.get(client, 0) >= self.max_per_client:
+            self.rejected += 1
+            ADMISSION_REJECTED.inc(budget='transcode', reason='client_limit')
+            raise TranscodeClientLimit("You already have too many audio conversions in progress. Please wait for one to finish.")
+        self._clients[client] = self._clients.get(client, 0) + 1
+
+    def _unclaim(self, client):
+        if client is None:
+            return
+        held = self._clients.get(client, 0) - 1
+        if held > 0:
+            self._clients[client] = held
+        else:
+            self._clients.pop(client, None)
+
+    # Queue a transcode of source into target. cancel_event aborts it while queued or running.
+    # Returns the TranscodeJob; wait on job.future for completion.
+    def submit(self, source, target, codec='mp3', bitrate='192k', cancel_event=None, client=None):
+        with self._lock:
+            if self._active >= self.max_workers + self.max_queued:
+                self.rejected += 1
+                ADMISSION_REJECTED.inc(budget='transcode', reason='queue_full')
+                raise TranscodeQueueFull("Too many audio conversions in progress. Please try again shortly.")
+            self._claim(client, enforce=False)
+            self._active += 1
+            self._queued += 1
+        job = TranscodeJob(source, target, codec, bitrate)
+        job.future = self._executor.submit(self._run, job, cancel_event, client)
+        return job
+
+    # Blocking convenience: submit, wait, and raise TranscodeError unless the transcode finished
+    def transcode(self, source, target, codec='mp3', bitrate='192k', cancel_event=None, client=None):
+        job = self.submit(source, target, codec, bitrate, cancel_event, client)
+        job.future.result()
+        if job.status != 'finished':
+            raise TranscodeError(job.error or f"Transcode {job.status}")
+        return job
+
+    def _run(self, job, cancel_event, client=None):
+        try:
+            with self._slots:
+                with self._lock:
+                    self._queued -= 1
+                if cancel_event is not None and cancel_event.is_set():
+                    job.status = 'cancelled'
+                    return
+                job.status = 'running'
+                job.started_at = time.time()
+                ADMISSION_WAIT.observe(job.started_at - job.queued_at, budget='transcode')
+                self._ffmpeg(job, cancel_event)
+        except TranscodeError as e:
+            job.status = 'cancelled' if cancel_event is not None and cancel_event.is_set() else 'error'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'error'
+            job.error = f"An unexpected error occurred: {str(e)}"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active -= 1
+                self._unclaim(client)
+                if job.status == 'finished':
+                    self.completed += 1
+                elif job.status == 'error':
+                    self.failed += 1
+                self._history.append(job.timing())
+
+    def _ffmpeg(self, job, cancel_event):
+        ffmpeg = shutil.which('ffmpeg')
+        if not ffmpeg:
+            raise TranscodeError("FFmpeg is not installed on the server.")
+        job.input_bytes = os.path.getsize(job.source)
+        tmp_target = job.target + '.part'
+        cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', job.source, '-vn']
+        if job.codec == 'mp3':
+            cmd += ['-codec:a', 'libmp3lame', '-b:a', job.bitrate, '-f', 'mp3']
+        else:
+            cmd += ['-codec:a', 'copy', '-f', job.codec]
+        cmd.append(tmp_target)
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   preexec_fn=self._lower_priority if os.name == 'posix' else None)
+        try:
+            while True:
+                try:
+                    _, stderr = process.communicate(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_event is not None and cancel_event.is_set():
+                        process.kill()
+                        process.communicate()
+                        raise TranscodeError("Transcode was cancelled.")
+            if process.returncode != 0:
+                raise TranscodeError(f"FFmpeg failed: {stderr.decode('utf-8', 'replace').strip()[:300]}")
+            os.replace(tmp_target, job.target)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+        job.output_bytes = os.path.getsize(job.target)
+        job.status = 'finished'
+
+    # Non-blocking slot for a streaming transcode; returns a release callable, or None when all slots are
+    # busy. Raises TranscodeClientLimit when the client is at max_per_client.
+    def try_slot(self, client=None):
+        with self._lock:
+            self._claim(client)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._unclaim(client)
+                self.rejected += 1
+            ADMISSION_REJECTED.inc(budget='transcode', reason='queue_full')
+            return None
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._slots.release()
+                with self._lock:
+                    self._unclaim(client)
+        return release
+
+    def stats(self):
+        with self._lock:
+            history = list(self._history)
+            finished = [t for t in history if t['transcode_seconds'] is not None and t['status'] == 'finished']
+            return {
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'max_per_client': self.max_per_client,
+                'active': self._active,
+                'queued': self._queued,
+                'active_clients': len(self._clients),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_wait_seconds': round(sum(t['wait_seconds'] for t in finished) / len(finished), 3) if finished else None,
+                'avg_transcode_seconds': round(sum(t['transcode_seconds'] for t in finished) / len(finished), 3) if finished else None,
+                'recent': history[-10:],
+            }
@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+# The /get_video_info report, produced as a stream of strings: video details first, then one piece per format,
+# so a long formats list is written to the client as it is rendered and never held or stored as a whole.
+
+REPORT_FORMATS = {
+    'text': ('text/plain; charset=utf-8', 'txt'),
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+FORMAT_COLUMNS = ('format_id', 'ext', 'resolution', 'width', 'height', 'fps', 'vcodec', 'acodec', 'tbr', 'abr', 'filesize', 'format_note')
+
+
+def _duration_text(info_dict):
+    duration_sec = info_dict.get('duration')
+    if duration_sec:
+        return datetime.utcfromtimestamp(duration_sec).strftime('%H:%M:%S') if duration_sec > 0 else 'N/A'
+    return info_dict.get('duration_string', 'N/A')
+
+
+# YYYYMMDD as YYYY-MM-DD; None when missing, the raw value when it does not parse
+def _publish_date(info_dict):
+    upload_date_str = info_dict.get('upload_date')
+    if not upload_date_str:
+        return None
+    try:
+        return datetime.strptime(upload_date_str, '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return upload_date_str
+
+
+def _format_row(f):
+    return {
+        'format_id': f.get('format_id'),
+        'ext': f.get('ext'),
+        'resolution': f.get('resolution'),
+        'width': f.get('width'),
+        'height': f.get('height'),
+        'fps': f.get('fps'),
+        'vcodec': f.get('vcodec'),
+        'acodec': f.get('acodec'),
+        'tbr': f.get('tbr'),
+        'abr': f.get('abr'),
+        'filesize': f.get('filesize') or f.get('filesize_approx'),
+        'format_note': f.get('format_note'),
+    }
+
+
+def report_text(info_dict, url):
+    yield f"Title: {info_dict.get('title', 'N/A')}\n"
+    yield f"Author: {info_dict.get('uploader', 'N/A')} ({info_dict.get('uploader_url', 'N/A')})\n"
+    yield f"Video ID: {info_dict.get('id', 'N/A')}\n"
+    yield f"Original URL: {info_dict.get('webpage_url', url)}\n"
+    yield f"Duration: {_duration_text(info_dict)}\n"
+    publish_date = _publish_date(info_dict)
+    if publish_date and publish_date == info_dict.get('upload_date'):
+        publish_date += ' (raw)'
+    yield f"Publish Date: {publish_date or 'N/A'}\n"
+    # Counts can be missing (hidden likes, non-YouTube sites); only numbers get thousands separators
+    for label, count_key in (('View Count', 'view_count'), ('Like Count', 'like_count')):
+        count = info_dict.get(count_key)
+        yield f"{label}: {count:,}\n" if isinstance(count, int) else f"{label}: N/A\n"
+    yield f"Description:\n{info_dict.get('description', 'N/A')}\n"
+    yield "\n--- Available Formats ---\n"
+    for f in info_dict.get('formats') or []:
+        yield (f"  ID: {f.get('format_id', 'N/A')}, Ext: {f.get('ext', 'N/A')}, "
+               f"Resolution: {f.get('format_note', f.get('resolution', 'N/A'))}, "
+               f"Codecs: v:{f.get('vcodec', 'none')}, a:{f.get('acodec', 'none')}\n")
+
+
+# One JSON object; the formats array is written element by element
+def report_json(info_dict, url):
+    details = {
+        'id': info_dict.get('id'),
+        'title': info_dict.get('title'),
+        'uploader': info_dict.get('uploader'),
+        'uploader_url': info_dict.get('uploader_url'),
+        'webpage_url': info_dict.get('webpage_url', url),
+        'duration': info_dict.get('duration'),
+        'publish_date': _publish_date(info_dict),
+        'view_count': info_dict.get('view_count'),
+        'like_count': info_dict.get('like_count'),
+        'description': info_dict.get('description'),
+    }
+    yield json.dumps(details)[:-1] + ', "formats": ['
+    for i, f in enumerate(info_dict.get('formats') or []):
+        yield (', ' if i else '') + json.dumps(_format_row(f))
+    yield ']}\n'
+
+
+# The formats table, one row per format, with the video ID and title on every row
+def report_csv(info_dict, url):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        writer.writerow(values)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    video_id, title = info_dict.get('id'), info_dict.get('title')
+    yield row(('video_id', 'title') + FORMAT_COLUMNS)
+    for f in info_dict.get('formats') or []:
+        values = _format_row(f)
+        yield row((video_id, title) + tuple('' if values[c] is None else values[c] for c in FORMAT_COLUMNS))
+
+
+def generate_report(info_dict, url, report_format='text'):
+    return {'text': report_text, 'json': report_json, 'csv': report_csv}[report_format](info_dict, url)
+
+
+# Join small pieces into chunks of about chunk_size characters so the client gets a few large writes
+def batched(pieces, chunk_size=16 * 1024):
+    pending, size = [], 0
+    for piece in pieces:
+        pending.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield ''.join(pending)
+
+
+# UTF-8 encode and gzip a stream of strings on the fly (one gzip member, flushed only at the end)
+def gzip_stream(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
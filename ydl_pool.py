@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import yt_dlp
+from yt_dlp.extractor import gen_extractor_classes
+
+from metrics import STAGE_SECONDS, current_route
+from proxy_pool import proxy_label
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledInstance:
+    __slots__ = ('ydl', 'created_at', 'last_used', 'uses')
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+
+# Pool of ready-to-use YoutubeDL instances keyed by (proxy, cookie identity, option profile). Building a
+# YoutubeDL loads the cookie jar, builds the format selector and networking stack and initializes extractors;
+# a pooled instance keeps all of that between requests. An instance is used by one thread at a time.
+class YoutubeDLPool:
+    # Options that may differ per checkout and how to apply them to a live instance
+    OVERRIDABLE = ('format', 'outtmpl', 'progress_hooks', 'postprocessor_hooks', 'parallel_download',
+                   'concurrent_fragment_downloads')
+
+    def __init__(self, max_idle_per_key=2, max_idle_total=32, idle_ttl=600, max_uses=200):
+        self.max_idle_per_key = max_idle_per_key
+        self.max_idle_total = max_idle_total
+        self.idle_ttl = idle_ttl
+        self.max_uses = max_uses
+        self._idle = OrderedDict()  # key -> [instances], most recently returned key last
+        self._idle_count = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.warmup_state = 'pending'  # pending -> running -> done | failed
+        self.warmup_seconds = None
+
+    # Build a new instance. make_params() returns (params, cookiejar); an in-memory cookiejar replaces the
+    # one yt-dlp would otherwise load from params['cookiefile'].
+    def _create(self, make_params):
+        params, cookiejar = make_params()
+        with STAGE_SECONDS.time(stage='ydl_construct', route=current_route(), proxy=proxy_label(params.get('proxy'))):
+            ydl = yt_dlp.YoutubeDL(params)
+        if cookiejar is not None:
+            ydl.cookiejar = cookiejar  # cached_property: set before first use, so no cookie file is read
+        self.created += 1
+        return _PooledInstance(ydl)
+
+    def _take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            instances = self._idle.get(key)
+            while instances:
+                pooled = instances.pop()
+                self._idle_count -= 1
+                if not instances:
+                    del self._idle[key]
+                if now - pooled.last_used <= self.idle_ttl:
+                    self.reused += 1
+                    return pooled
+                self._close(pooled)
+                instances = self._idle.get(key)
+        return None
+
+    def _give_back(self, key, pooled):
+        pooled.last_used = time.monotonic()
+        pooled.uses += 1
+        to_close = []
+        with self._lock:
+            instances = self._idle.setdefault(key, [])
+            if pooled.uses >= self.max_uses or len(instances) >= self.max_idle_per_key:
+                to_close.append(pooled)
+            else:
+                instances.append(pooled)
+                self._idle_count += 1
+                self._idle.move_to_end(key)
+            if not instances:
+                del self._idle[key]
+            # Trim the least recently used keys when the pool holds too many idle instances overall
+            while self._idle_count > self.max_idle_total:
+                oldest_key = next(iter(self._idle))
+                oldest = self._idle[oldest_key]
+                to_close.append(oldest.pop(0))
+                self._idle_count -= 1
+                if not oldest:
+                    del self._idle[oldest_key]
+        for stale in to_close:
+            self._close(stale)
+
+    def _close(self, pooled):
+        try:
+            pooled.ydl.close()
+        except Exception as e:
+            logger.warning("Error closing pooled YoutubeDL instance: %s", e)
+
+    @staticmethod
+    def _apply_overrides(ydl, overrides):
+        saved = {
+            'params': {k: ydl.params[k] for k in overrides if k in ydl.params},
+            'absent': [k for k in overrides if k not in ydl.params],
+            'format_selector': ydl.format_selector,
+            'progress_hooks': list(ydl._progress_hooks),
+            'postprocessor_hooks': list(ydl._postprocessor_hooks),
+            'pp_hooks': [(pp, list(pp._progress_hooks)) for pps in ydl._pps.values() for pp in pps],
+        }
+        for name, value in overrides.items():
+            if name == 'format':
+                ydl.params['format'] = value
+                ydl.format_selector = ydl.build_format_selector(value) if value not in (None, '-') else value
+            elif name == 'outtmpl':
+                ydl.params['outtmpl'] = value if isinstance(value, dict) else {'default': value}
+                ydl._parse_outtmpl()
+            elif name == 'progress_hooks':
+                ydl._progress_hooks = list(value or [])
+            elif name == 'postprocessor_hooks':
+                ydl._postprocessor_hooks = list(value or [])
+                # Postprocessors from the profile (FFmpegExtractAudio, ...) copied the hooks of the time they
+                # were added, so they get this checkout's on top of their own; ones created during the download
+                # (merger, fixups) pick up _postprocessor_hooks
+                for pp, hooks in saved['pp_hooks']:
+                    pp._progress_hooks = hooks + list(value or [])
+            elif name in ('parallel_download', 'concurrent_fragment_downloads'):
+                # Read from params by the downloaders at download time
+                ydl.params[name] = value
+            else:
+                raise ValueError(f"Option {name!r} cannot be overridden on a pooled YoutubeDL; make it part of the profile")
+        return saved
+
+    @staticmethod
+    def _restore(ydl, saved):
+        ydl.params.update(saved['params'])
+        for name in saved['absent']:
+            ydl.params.pop(name, None)
+        ydl.format_selector = saved['format_selector']
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl._postprocessor_hooks = saved['postprocessor_hooks']
+        for pp, hooks in saved['pp_hooks']:
+            pp._progress_hooks = hooks
+        ydl._download_retcode = 0
+
+    # Check out an instance for `key`, applying per-request `overrides` (see OVERRIDABLE) for the duration
+    # of the with-block. make_params is only called when no idle instance exists for the key.
+    @contextmanager
+    def checkout(self, key, make_params, overrides=None):
+        pooled = self._take(key) or self._create(make_params)
+        saved = self._apply_overrides(pooled.ydl, overrides or {})
+        broken = False
+        try:
+            yield pooled.ydl
+        except yt_dlp.utils.YoutubeDLError:
+            # Regular download/extraction failures leave the instance usable
+            raise
+        except BaseException:
+            # Anything else may have left it half-way through something; do not hand it to the next request
+            broken = True
+            raise
+        finally:
+            if broken:
+                self._close(pooled)
+            else:
+                self._restore(pooled.ydl, saved)
+                self._give_back(key, pooled)
+
+    # Import every extractor, compile their URL patterns and initialize the YouTube extractor once, so the
+    # first real request does not pay for it. yt-dlp matches a URL against the extractors in order and
+    # compiles each pattern on first use; a URL no specific extractor claims compiles all ~1800 of them.
+    # Run in a preloading gunicorn master, the compiled patterns are shared with every forked worker.
+    def warm_up(self):
+        self.warmup_state = 'running'
+        started = time.monotonic()
+        try:
+            with yt_dlp.YoutubeDL({'quiet': True, 'logger': logging.getLogger('yt_dlp')}) as ydl:
+                ydl.get_info_extractor('Youtube')
+            for ie in gen_extractor_classes():
+                try:
+                    ie.suitable('https://example.com/')
+                except Exception:
+                    pass  # an extractor with an unusual pattern simply stays uncompiled
+        except Exception as e:
+            self.warmup_state = 'failed'
+            logger.warning("yt-dlp warm-up failed: %s", e)
+        else:
+            self.warmup_state = 'done'
+            logger.info("yt-dlp warm-up finished in %.2fs", time.monotonic() - started)
+        finally:
+            self.warmup_seconds = round(time.monotonic() - started, 3)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': self._idle_count,
+                'keys': len(self._idle),
+                'created': self.created,
+                'reused': self.reused,
+                'max_idle_per_key': self.max_idle_per_key,
+                'max_idle_total': self.max_idle_total,
+            }